@@ -0,0 +1,326 @@
+"""
+不具合ダッシュボード 合成データベンチマーク
+
+Access・ネットワークなしで t_外観検査集計 / t_不具合情報 相当の合成データを作り、
+defect_dashboard_generator の各処理を単体と通し（end to end）で計測する。
+夜間ジョブに載る前に処理時間・メモリの劣化を見つけるためのもの。
+
+計測対象:
+  extract_today_lots / join_defects / compute_today_summary / filter_last_1year /
+  compute_lot_history / build_defect_kind_summary / Jinja レンダリング / 通し
+
+使い方:
+  python defect_dashboard_benchmark.py                      # 1年・3年・10年
+  python defect_dashboard_benchmark.py --years 3 --repeat 5
+  python defect_dashboard_benchmark.py --output bench.json  # 結果を保存
+  python defect_dashboard_benchmark.py --baseline bench.json --tolerance 0.3
+      # 保存済み結果より tolerance 以上遅い処理があれば終了コード 1
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import defect_dashboard_generator as ddg
+
+
+# 実データに近い不具合区分（30列）
+DEFECT_KIND_COLUMNS = [
+    "外観キズ", "圧痕", "切粉", "毟れ", "穴大", "穴小", "穴キズ", "バリ", "短寸", "面粗",
+    "サビ", "ボケ", "挽目", "汚れ", "メッキ", "落下", "フクレ", "ツブレ", "ボッチ", "段差",
+    "バレル石", "径プラス", "径マイナス", "ゲージ", "異物混入", "形状不良", "こすれ", "変色シミ", "材料キズ", "その他",
+]
+
+DEFAULT_YEARS = [1, 3, 10]
+
+
+# -----------------------------
+# 合成データ
+# -----------------------------
+
+def make_synthetic_frames(
+    years: float,
+    lots_per_day: int = 40,
+    n_hinbans: int = 400,
+    end_date: datetime = datetime(2025, 6, 30),
+    seed: int = 0,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    外観検査集計・不具合情報の合成データを作る。
+    品番はジップ分布（少数の品番にロットが集中）で、先頭はワースト品番にする。
+    不具合は品番ごとに発生率が異なる疎な分布。
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(end=end_date, periods=int(365 * years), freq="D")
+    n = len(days) * lots_per_day
+
+    worst = list(ddg.FIXED_WORST_41ST_HINBANS)
+    hinbans = worst + [f"{10000 + i:05d}-{i % 97:05d}A" for i in range(max(0, n_hinbans - len(worst)))]
+    weights = 1.0 / np.arange(1, len(hinbans) + 1) ** 1.1
+    weights /= weights.sum()
+    hinban_idx = rng.choice(len(hinbans), size=n, p=weights)
+    hinban_arr = np.asarray(hinbans, dtype=object)[hinban_idx]
+
+    # 品番ごとに使う号機は数台に偏る
+    machine_base = rng.integers(1, 30, size=len(hinbans))
+    machine = np.char.add("No.", (machine_base[hinban_idx] + rng.integers(0, 3, size=n)).astype(str)).astype(object)
+
+    lot_ids = np.char.add("L", np.arange(n).astype(str)).astype(object)
+    dates = np.repeat(days.values, lots_per_day)
+    qty = rng.integers(100, 5000, size=n)
+
+    appearance = pd.DataFrame({
+        "生産ロットID": lot_ids,
+        "品番": hinban_arr,
+        "号機": machine,
+        "指示日": dates,
+        "数量": qty,
+        "検査員": "検査員A",
+    })
+
+    # 品番ごとの不具合発生率 × 区分ごとの重み
+    hinban_rate = rng.gamma(0.6, 0.02, size=len(hinbans))
+    kind_weight = rng.dirichlet(np.full(len(DEFECT_KIND_COLUMNS), 0.5))
+    lam = hinban_rate[hinban_idx, None] * kind_weight[None, :] * (qty[:, None] / 100.0)
+    kinds = rng.poisson(lam)
+
+    defects = pd.DataFrame(kinds, columns=DEFECT_KIND_COLUMNS)
+    defects.insert(0, "ID", np.arange(n))
+    defects.insert(1, "生産ロットID", lot_ids)
+    defects.insert(2, "品番", hinban_arr)
+    defects.insert(3, "号機", machine)
+    defects.insert(4, "指示日", dates)
+    defects.insert(5, "数量", qty)
+    defects["総不具合数"] = kinds.sum(axis=1)
+    return appearance, defects
+
+
+# -----------------------------
+# 計測
+# -----------------------------
+
+def measure(name: str, fn: Callable[[], object], repeat: int = 3) -> Tuple[Dict[str, object], object]:
+    """
+    所要時間（repeat 回の最小・中央値）と tracemalloc のピークメモリを計測する。
+    tracemalloc は処理を遅くするため、メモリ計測は時間計測とは別の1回で行う。
+    """
+    times: List[float] = []
+    result = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "stage": name,
+        "min_seconds": round(min(times), 4),
+        "median_seconds": round(float(np.median(times)), 4),
+        "peak_mb": round(peak / (1024 * 1024), 2),
+    }, result
+
+
+def render_dashboard(
+    cfg: ddg.Config,
+    run_date: datetime,
+    today_lots: pd.DataFrame,
+    today_summary: pd.DataFrame,
+    today_defects: pd.DataFrame,
+) -> str:
+    worst_set = set(ddg.FIXED_WORST_41ST_HINBANS)
+    mask_worst = today_summary["品番"].astype(str).isin(worst_set)
+    worst = today_summary.loc[mask_worst]
+    normal = today_summary.loc[~mask_worst]
+    normal = normal[normal["不良率"] > 0.01]
+    template = ddg.load_template(cfg)
+    return template.render(
+        run_date=run_date.strftime("%Y-%m-%d"),
+        run_date_short=f"{run_date.month}/{run_date.day}",
+        logo_text=cfg.logo_text,
+        logo_data_uri=f"data:image/png;base64,{ddg.LOGO_BASE64}",
+        today_summary=ddg.group_summary_by_hinban(normal),
+        worst_today_summary=ddg.group_summary_by_hinban(worst),
+        today_lot_count=int(today_lots["生産ロットID"].nunique()),
+        today_defect_count=int(len(today_defects)),
+        worst_lot_count=len(worst),
+        normal_lot_count=len(normal),
+        breakdown_columns=[],
+        breakdown_rows=[],
+        ai_comments={},
+        ai_status="",
+    )
+
+
+def run_benchmark(years: float, lots_per_day: int, repeat: int) -> Dict[str, object]:
+    start = time.perf_counter()
+    appearance, defects = make_synthetic_frames(years, lots_per_day=lots_per_day)
+    generate_seconds = time.perf_counter() - start
+
+    run_date = pd.Timestamp(defects["指示日"].max()).to_pydatetime()
+    cfg = ddg.Config(output_dir=tempfile.mkdtemp(prefix="ddg_bench_"))
+    product_master = pd.DataFrame({
+        "製品番号": appearance["品番"].unique(),
+        "製品名": "合成品",
+        "客先名": "合成客先",
+    })
+
+    results: List[Dict[str, object]] = []
+
+    def step(name: str, fn: Callable[[], object]):
+        record, value = measure(name, fn, repeat)
+        results.append(record)
+        return value
+
+    today_lots = step("extract_today_lots", lambda: ddg.extract_today_lots(appearance, run_date))
+    today_defects = step("join_defects", lambda: ddg.join_defects(today_lots, defects))
+    today_summary, _ = step("compute_today_summary", lambda: ddg.compute_today_summary(today_lots, today_defects))
+    defects_1y = step("filter_last_1year", lambda: ddg.filter_last_1year(defects, run_date))
+    target_hinbans = sorted(today_summary["品番"].astype(str).unique().tolist())
+    step("compute_lot_history", lambda: ddg.compute_lot_history(defects_1y, target_hinbans))
+    step(
+        "build_defect_kind_summary",
+        lambda: [ddg.build_defect_kind_summary(defects_1y, h) for h in target_hinbans],
+    )
+
+    def grouped_kind_summaries() -> List[str]:
+        sums = ddg.defect_kind_sums_by_hinban(defects_1y)
+        return [ddg.format_defect_kind_summary(sums.get(h)) for h in target_hinbans]
+
+    step("defect_kind_sums_by_hinban", grouped_kind_summaries)
+    lot_rows = step("aggregate_defects_by_lot", lambda: ddg.aggregate_defects_by_lot(defects_1y))
+    day_start = datetime.combine(run_date.date(), datetime.min.time())
+    step(
+        "lot_baselines",
+        lambda: ddg.flag_unusual_lots(today_summary, ddg.compute_lot_baselines(lot_rows, day_start)),
+    )
+    baseline = ddg.compute_lot_baselines(lot_rows, day_start)
+    step(
+        "build_local_comments",
+        lambda: ddg.build_local_comments(target_hinbans, today_summary, today_defects, lot_rows, baseline),
+    )
+    cube = step("build_monthly_cube", lambda: ddg.build_monthly_cube(ddg.aggregate_defects_by_lot(defects)))
+    step("build_quarterly_trend", lambda: ddg.build_quarterly_trend(cube, ddg.FIXED_WORST_41ST_HINBANS, run_date))
+    step("render", lambda: render_dashboard(cfg, run_date, today_lots, today_summary, today_defects))
+    step(
+        "end_to_end",
+        lambda: ddg.build_dashboard_html(
+            run_date, cfg, ddg.DefectDataset(appearance, defects, product_master)
+        ),
+    )
+
+    return {
+        "years": years,
+        "appearance_rows": len(appearance),
+        "defect_rows": len(defects),
+        "today_lots": len(today_lots),
+        "target_hinbans": len(target_hinbans),
+        "generate_seconds": round(generate_seconds, 2),
+        "stages": results,
+    }
+
+
+# -----------------------------
+# 出力・比較
+# -----------------------------
+
+def print_report(report: Dict[str, object]) -> None:
+    print(
+        f"\n=== {report['years']}年分: 外観 {report['appearance_rows']:,}行 / 不具合 {report['defect_rows']:,}行 "
+        f"/ 本日 {report['today_lots']}ロット・{report['target_hinbans']}品番 (合成 {report['generate_seconds']}s) ==="
+    )
+    print(f"{'stage':<28}{'min[s]':>10}{'median[s]':>12}{'peak[MB]':>10}")
+    for r in report["stages"]:
+        print(f"{r['stage']:<28}{r['min_seconds']:>10.4f}{r['median_seconds']:>12.4f}{r['peak_mb']:>10.2f}")
+
+
+def find_regressions(
+    reports: List[Dict[str, object]],
+    baseline: List[Dict[str, object]],
+    tolerance: float,
+    min_seconds: float = 0.05,
+) -> List[str]:
+    """baseline より (1 + tolerance) 倍以上遅くなった処理を返す。短すぎる処理は揺らぎが大きいので除外する。"""
+    base_index = {
+        (float(b["years"]), s["stage"]): s
+        for b in baseline
+        for s in b.get("stages", [])
+    }
+    regressions: List[str] = []
+    for report in reports:
+        for s in report["stages"]:
+            base = base_index.get((float(report["years"]), s["stage"]))
+            if base is None:
+                continue
+            now, before = float(s["min_seconds"]), float(base["min_seconds"])
+            if now >= min_seconds and now > before * (1.0 + tolerance):
+                regressions.append(f"{report['years']}年 {s['stage']}: {before:.3f}s -> {now:.3f}s")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Benchmark defect dashboard pipeline on synthetic data")
+    p.add_argument("--years", type=float, nargs="+", default=DEFAULT_YEARS, help="years of lots to generate (default: 1 3 10)")
+    p.add_argument("--lots-per-day", type=int, default=40, help="lots per day (default: 40)")
+    p.add_argument("--repeat", type=int, default=3, help="timing repetitions per stage (default: 3)")
+    p.add_argument("--output", type=str, help="write results as JSON")
+    p.add_argument("--baseline", type=str, help="compare with a previous --output JSON")
+    p.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown ratio against baseline (default: 0.3)")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    # 通し計測に Gemini・.env を巻き込まない
+    os.environ.pop("GEMINI_API_KEY", None)
+    os.environ["LOT_AGGREGATE_STORE"] = "0"
+
+    reports = []
+    for years in args.years:
+        report = run_benchmark(years, args.lots_per_day, args.repeat)
+        print_report(report)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"created_at": datetime.now().isoformat(timespec="seconds"), "reports": reports},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        print(f"\nresults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("reports", [])
+        regressions = find_regressions(reports, baseline, args.tolerance)
+        if regressions:
+            print("\nREGRESSION:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nno regression against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
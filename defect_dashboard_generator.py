@@ -10,24 +10,31 @@ from __future__ import annotations
 
 import argparse
 import hashlib
+import heapq
 import io
 import json
 import logging
 import os
 import smtplib
+import sqlite3
 import sys
+import threading
 import traceback
 import time
 import warnings
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timedelta, date
+from decimal import Decimal
 from email.mime.text import MIMEText
 from pathlib import Path
-from typing import Iterable, Optional, Tuple, List, Dict
+from typing import Callable, Iterable, Optional, Tuple, List, Dict
 import re
 
+import numpy as np
 import pandas as pd
-import pyodbc
 import requests
 try:
     from jinja2 import Environment, FileSystemLoader, Template
@@ -37,16 +44,36 @@ except ImportError as e:  # pragma: no cover
         " `pip install -r requirements.txt` を実行してください。"
     ) from e
 
+try:
+    import pyodbc
+except ImportError:  # pragma: no cover  # Access ドライバのない環境（ベンチマーク等）
+    pyodbc = None
+
 try:
     import google.generativeai as genai
 except ImportError:  # pragma: no cover
     genai = None
 
+try:
+    import pyarrow  # noqa: F401  # ロット集計ストア（Parquet）用
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
 try:
     from dotenv import load_dotenv
 except ImportError:  # pragma: no cover
     load_dotenv = None
 
+try:
+    import psutil  # Windows のピークRSS（peak_wset）計測用
+except ImportError:  # pragma: no cover
+    psutil = None
+
+try:
+    import resource  # Linux / macOS のピークRSS（ru_maxrss）計測用
+except ImportError:  # pragma: no cover
+    resource = None
+
 # Gemini クォータ超過時に以降の呼び出しを止めるためのフラグ
 _GEMINI_QUOTA_EXCEEDED = False
 
@@ -141,6 +168,8 @@ class Config:
     output_dir: str = "."
     template_path: Optional[str] = None  # 指定があれば外部HTMLテンプレートを利用
     logo_text: str = "ARAI"
+    push_down_filters: bool = True  # 日付・ロットIDの絞り込みを Access 側の WHERE で行う
+    typed_loading: bool = True  # 不具合情報・外観検査集計を型付き（カテゴリ・小さい整数型）で読み込む
 
 
 DEFAULT_IGNORE_COLUMNS = {
@@ -325,7 +354,11 @@ def build_worst_part_prompt_for_term(
 """.strip()
 
 
-def generate_worst_part_comment(prompt: str, model_name: Optional[str]) -> str:
+def generate_worst_part_comment(
+    prompt: str,
+    model_name: Optional[str],
+    generation_config: Optional[Dict[str, object]] = None,
+) -> str:
     if genai is None:
         return ""
     global _GEMINI_QUOTA_EXCEEDED
@@ -335,12 +368,20 @@ def generate_worst_part_comment(prompt: str, model_name: Optional[str]) -> str:
     if not model_name:
         raise RuntimeError("GEMINI_MODEL が設定されていません（.env を確認してください）")
 
+    request_kwargs: Dict[str, object] = {}
+    if generation_config:
+        request_kwargs["generation_config"] = generation_config
+    # 1リクエストの待ち時間の上限（0 以下でライブラリ既定）
+    call_timeout = float(os.environ.get("GEMINI_CALL_TIMEOUT_SECONDS", "60"))
+    if call_timeout > 0:
+        request_kwargs["request_options"] = {"timeout": call_timeout}
+
     candidates = [model_name]
     last_err: Optional[Exception] = None
     for name in [c for c in candidates if c]:
         try:
             model = genai.GenerativeModel(name)
-            response = model.generate_content(prompt)
+            response = model.generate_content(prompt, **request_kwargs)
             return (response.text or "").strip()
         except Exception as e:  # pragma: no cover
             msg = str(e)
@@ -350,7 +391,7 @@ def generate_worst_part_comment(prompt: str, model_name: Optional[str]) -> str:
                 time.sleep(60)
                 try:
                     model = genai.GenerativeModel(name)
-                    response = model.generate_content(prompt)
+                    response = model.generate_content(prompt, **request_kwargs)
                     return (response.text or "").strip()
                 except Exception as retry_err:
                     retry_msg = str(retry_err)
@@ -369,30 +410,163 @@ def generate_worst_part_comment(prompt: str, model_name: Optional[str]) -> str:
 
 
 def _get_gemini_comment_cache_path(output_dir: str) -> Path:
+    return Path(output_dir) / "gemini_comment_cache.sqlite3"
+
+
+def _get_legacy_gemini_comment_cache_path(output_dir: str) -> Path:
     return Path(output_dir) / "gemini_comment_cache.json"
 
 
-def load_gemini_comment_cache(output_dir: str) -> Dict[str, str]:
-    path = _get_gemini_comment_cache_path(output_dir)
-    if not path.exists():
-        return {}
-    try:
-        data = json.loads(path.read_text(encoding="utf-8"))
-    except (OSError, json.JSONDecodeError):
-        return {}
-    if not isinstance(data, dict):
-        return {}
-    return {str(k): str(v) for k, v in data.items()}
+class GeminiCommentCache:
+    """
+    Gemini コメントの SQLite キャッシュ。
 
+    - get / put はキー1件単位（主キー検索）で、put ごとにコミットする
+    - 開いた時点で GEMINI_CACHE_MAX_AGE_DAYS より古いもの、
+      GEMINI_CACHE_MAX_ENTRIES を超えた分（最終利用が古い順）を削除する
+    - 旧形式の gemini_comment_cache.json があれば初回のみ取り込み、.bak に退避する
+    - hits / misses / ヒット率をラン単位で数える
+    """
 
-def save_gemini_comment_cache(output_dir: str, cache: Dict[str, str]) -> None:
-    path = _get_gemini_comment_cache_path(output_dir)
-    path.write_text(json.dumps(cache, ensure_ascii=False, indent=2), encoding="utf-8")
+    def __init__(
+        self,
+        output_dir: str,
+        max_age_days: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        self.output_dir = output_dir
+        self.path = _get_gemini_comment_cache_path(output_dir)
+        self.max_age_days = (
+            max_age_days if max_age_days is not None
+            else float(os.environ.get("GEMINI_CACHE_MAX_AGE_DAYS", "90"))
+        )
+        self.max_entries = (
+            max_entries if max_entries is not None
+            else int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", "5000"))
+        )
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._migrate_legacy_json()
+        self.evict()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS comments ("
+                " key TEXT PRIMARY KEY,"
+                " comment TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_last_used ON comments(last_used_at)")
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(comments)")}
+            for col in ("run_date", "hinban"):
+                if col not in existing:
+                    conn.execute(f"ALTER TABLE comments ADD COLUMN {col} TEXT")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _migrate_legacy_json(self) -> None:
+        legacy = _get_legacy_gemini_comment_cache_path(self.output_dir)
+        if not legacy.exists():
+            return
+        try:
+            data = json.loads(legacy.read_text(encoding="utf-8"))
+            created_at = legacy.stat().st_mtime
+        except (OSError, json.JSONDecodeError):
+            return
+        if not isinstance(data, dict):
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO comments (key, comment, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                    [(str(k), str(v), created_at, created_at) for k, v in data.items()],
+                )
+        try:
+            os.replace(legacy, legacy.with_suffix(".json.bak"))
+        except OSError:
+            pass
+        logging.info("migrated %s entries from %s", len(data), legacy.name)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT comment FROM comments WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with conn:
+                conn.execute("UPDATE comments SET last_used_at = ? WHERE key = ?", (time.time(), key))
+            return str(row[0])
+
+    def put(
+        self,
+        key: str,
+        comment: str,
+        run_date: Optional[datetime] = None,
+        hinban: Optional[str] = None,
+    ) -> None:
+        """run_date / hinban はキーには含めず、参照用のメタ情報として保存する"""
+        now = time.time()
+        run_date_str = f"{run_date:%Y-%m-%d}" if run_date else None
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO comments"
+                    " (key, comment, created_at, last_used_at, run_date, hinban) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, comment, now, now, run_date_str, hinban),
+                )
+
+    def evict(self) -> int:
+        """期限切れ・件数超過分を削除し、削除件数を返す"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                removed = 0
+                if self.max_age_days > 0:
+                    cutoff = time.time() - self.max_age_days * 86400
+                    removed += conn.execute("DELETE FROM comments WHERE created_at < ?", (cutoff,)).rowcount
+                if self.max_entries > 0:
+                    removed += conn.execute(
+                        "DELETE FROM comments WHERE key NOT IN ("
+                        " SELECT key FROM comments ORDER BY last_used_at DESC LIMIT ?)",
+                        (self.max_entries,),
+                    ).rowcount
+        if removed:
+            logging.info("evicted %s Gemini comment cache entries", removed)
+        return removed
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        hit_rate = round(self.hits / lookups, 3) if lookups else 0.0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _normalize_prompt(prompt: str) -> str:
+    # 行頭・行末の空白や空白の連続の違いでキャッシュを外さない
+    lines = [" ".join(line.split()) for line in prompt.strip().splitlines()]
+    return "\n".join(lines)
 
 
-def _gemini_cache_key(run_date: datetime, model_name: str, hinban: str, prompt: str) -> str:
-    prompt_digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
-    return f"{run_date:%Y-%m-%d}|{model_name}|{hinban}|{prompt_digest}"
+def _gemini_cache_key(model_name: str, prompt: str) -> str:
+    """実行日に依存しない、モデル名と正規化プロンプトのダイジェストによるキー"""
+    prompt_digest = hashlib.sha256(_normalize_prompt(prompt).encode("utf-8")).hexdigest()
+    return f"{model_name}|{prompt_digest}"
 
 
 def select_hinbans_for_ai(today_summary: pd.DataFrame, worst_set: set[str], max_parts: int) -> List[str]:
@@ -495,6 +669,524 @@ def build_general_part_prompt(
 - 合計3〜6行以内に収めること
 """.strip()
 
+def build_history_analysis_prompt(
+    part_number: str,
+    part_name: str,
+    customer: str,
+    trend_table: str,
+    defect_kind_summary: str,
+    use_anonymization: bool = True,
+) -> str:
+    """
+    分割プロンプトの前半（過去傾向の分析）。
+    当月より前のデータだけで組み立てるため、同じ月の間は日をまたいでも同一になる。
+    """
+    anonymized_part, anonymized_name, anonymized_customer = anonymize_for_gemini(
+        part_number, part_name, customer, use_anonymization
+    )
+
+    return f"""
+以下は、当社（精密加工部品メーカー）における対象品番の過去1年のロット推移です。
+
+目的：日々の品質判断の前提となる **過去傾向の要約** を作ること。
+必ず **3〜4行以内** にまとめること。長文は禁止。
+
+---
+【対象】
+品番: {anonymized_part}
+品名: {anonymized_name}
+客先: {anonymized_customer}
+
+【過去1年の傾向】
+{trend_table}
+
+【不具合区分サマリ】
+{defect_kind_summary}
+---
+
+以下の形式で **必ず** 出力してください（形式厳守）：
+
+【傾向】不良率の水準と推移（1〜2行）
+【主要不具合】多い不具合区分とその特徴（1行）
+【注意点】再発しやすい条件・号機など（1行）
+
+【出力ルール】
+- 必ず【傾向】【主要不具合】【注意点】のラベルから始めること
+- 見出し・タイトル・品番の繰り返しは禁止
+- **や##などのMarkdown装飾は禁止
+""".strip()
+
+
+def build_daily_part_prompt(
+    part_number: str,
+    part_name: str,
+    customer: str,
+    history_analysis: str,
+    recent_table: str,
+    today_qty: int,
+    today_ng: int,
+    today_rate: float,
+    today_defect_kinds: str,
+    worst_label: str = "",
+    major_defects: str = "",
+    use_anonymization: bool = True,
+) -> str:
+    """
+    分割プロンプトの後半（昨日分の評価）。
+    過去傾向は build_history_analysis_prompt の結果を渡し、当月分のロットと昨日の不具合だけを載せる。
+    """
+    anonymized_part, anonymized_name, anonymized_customer = anonymize_for_gemini(
+        part_number, part_name, customer, use_anonymization
+    )
+    target_label = f"「{worst_label}」" if worst_label else "対象品番"
+    major_line = f"\n主な不具合: {major_defects}" if major_defects else ""
+
+    return f"""
+以下は、当社（精密加工部品メーカー）における{target_label}の
+過去傾向の分析結果と、当月のロット・昨日の不具合データです。
+
+目的：製造がすぐ行動できる **短く要点だけのコメント** を作ること。
+必ず **3〜6行以内** にまとめること。長文は禁止。
+
+---
+【対象】
+品番: {anonymized_part}
+品名: {anonymized_name}
+客先: {anonymized_customer}{major_line}
+
+【過去傾向の分析】
+{history_analysis}
+
+【当月のロット】
+{recent_table}
+
+【昨日の不具合】
+検査数={today_qty}, 不良数={today_ng}, 不良率={today_rate:.2f}%
+昨日の不具合: {today_defect_kinds}
+---
+
+以下の形式で **必ず** 出力してください（形式厳守）：
+
+【評価】昨日の品質状態の一言評価（1行）
+【判断】過去傾向と照らして「偶発か再発兆候か」の判断（1行）
+【対策】製造がすぐ実施すべき対策（1〜2行）
+
+【出力ルール】
+- 必ず【評価】【判断】【対策】のラベルから始めること
+- 各項目は1〜2行で完結すること
+- 見出し・タイトル・品番の繰り返しは禁止
+- **や##などのMarkdown装飾は禁止
+- 「製造部各位」「品質報告」などの挨拶文は禁止
+- 合計3〜6行以内に収めること
+""".strip()
+
+
+@dataclass
+class TodayPartStats:
+    """AIコメント用の品番1件分の当日集計"""
+    qty: int
+    ng: int
+    rate: float  # %
+    defect_kinds: str
+    part_name: str
+    customer: str
+
+
+def today_stats_for_hinban(today_summary: pd.DataFrame, hinban: str) -> TodayPartStats:
+    today_rows_all = today_summary[today_summary["品番"].astype(str) == hinban]
+    today_qty = int(today_rows_all["数量"].sum()) if "数量" in today_rows_all.columns else 0
+    today_ng = int(today_rows_all["総不具合数"].sum()) if "総不具合数" in today_rows_all.columns else 0
+    part_name = (
+        today_rows_all["品名"].astype(str).dropna().iloc[0]
+        if "品名" in today_rows_all.columns and len(today_rows_all) else ""
+    )
+    customer = (
+        today_rows_all["客先名"].astype(str).dropna().iloc[0]
+        if "客先名" in today_rows_all.columns and len(today_rows_all) else ""
+    )
+    today_rate = (today_ng / today_qty * 100) if today_qty else 0.0
+    today_defect_kinds = " / ".join(
+        [s for s in today_rows_all["不具合内訳"].astype(str).tolist() if s and s != "-"]
+    ) if "不具合内訳" in today_rows_all.columns else ""
+    return TodayPartStats(
+        qty=today_qty,
+        ng=today_ng,
+        rate=today_rate,
+        defect_kinds=today_defect_kinds,
+        part_name=part_name,
+        customer=customer,
+    )
+
+
+def build_ai_prompt_for_hinban(
+    hinban: str,
+    today_summary: pd.DataFrame,
+    lot_history: Dict[str, LotHistory],
+    kind_sums: Dict[str, pd.Series],
+    worst_set: set[str],
+    term_info: TermInfo,
+    use_anonymization: bool = True,
+) -> str:
+    """
+    品番1件分のプロンプトを組み立てる（固定ワーストは専用プロンプト、その他は一般プロンプト）。
+    kind_sums は品番別の不具合区分合計（defect_kind_sums_by_hinban）。
+    """
+    stats = today_stats_for_hinban(today_summary, hinban)
+    trend_table_str = build_trend_summary_from_history(lot_history.get(hinban))
+    defect_kind_summary_str = format_defect_kind_summary(kind_sums.get(hinban))
+
+    if hinban in worst_set:
+        info = FIXED_WORST_41ST_INFO.get(hinban, {})
+        return build_worst_part_prompt_for_term(
+            term_info=term_info,
+            part_number=hinban,
+            part_name=info.get("品名", stats.part_name),
+            customer=info.get("客先名", stats.customer),
+            major_defects=info.get("主な不具合", ""),
+            trend_table=trend_table_str,
+            defect_kind_summary=defect_kind_summary_str,
+            today_qty=stats.qty,
+            today_ng=stats.ng,
+            today_rate=stats.rate,
+            today_defect_kinds=stats.defect_kinds,
+            use_anonymization=use_anonymization,
+        )
+    return build_general_part_prompt(
+        part_number=hinban,
+        part_name=stats.part_name,
+        customer=stats.customer,
+        trend_table=trend_table_str,
+        defect_kind_summary=defect_kind_summary_str,
+        today_qty=stats.qty,
+        today_ng=stats.ng,
+        today_rate=stats.rate,
+        today_defect_kinds=stats.defect_kinds,
+        use_anonymization=use_anonymization,
+    )
+
+
+def build_split_prompts_for_hinbans(
+    hinbans: List[str],
+    run_date: datetime,
+    today_summary: pd.DataFrame,
+    lot_rows: pd.DataFrame,
+    worst_set: set[str],
+    term_info: TermInfo,
+    use_anonymization: bool = True,
+) -> Tuple[Dict[str, str], Callable[[str, str], str]]:
+    """
+    分割プロンプト用に、品番ごとの「過去傾向」プロンプトと、
+    分析結果から「昨日分」プロンプトを作る関数を返す。
+
+    当月1日を境に、それより前のロット（直前11か月分）を安定部分、当月分を変動部分とする。
+    安定部分の開始も月初に固定するため、同じ月の間は過去傾向プロンプト（キャッシュキー）が変わらない。
+    （run_date から1年で切ったロット集計でも、11か月前の月初は必ず範囲内に入る）
+    lot_rows は aggregate_defects_by_lot 形式のロット集計。
+    """
+    anchor = pd.Timestamp(run_date.date().replace(day=1))
+    stable_start = anchor - pd.DateOffset(months=11)
+    stable_rows = lot_rows.loc[(lot_rows["日付"] >= stable_start) & (lot_rows["日付"] < anchor)]
+    recent_rows = lot_rows.loc[lot_rows["日付"] >= anchor]
+    stable_history = lot_history_from_aggregate(stable_rows, hinbans)
+    recent_history = lot_history_from_aggregate(recent_rows, hinbans)
+
+    def names_for(hinban: str, stats: TodayPartStats) -> Tuple[str, str, str]:
+        if hinban in worst_set:
+            info = FIXED_WORST_41ST_INFO.get(hinban, {})
+            return info.get("品名", stats.part_name), info.get("客先名", stats.customer), info.get("主な不具合", "")
+        return stats.part_name, stats.customer, ""
+
+    stable_kind_sums = defect_kind_sums_by_hinban(stable_rows)
+    history_prompts: Dict[str, str] = {}
+    for hinban in hinbans:
+        part_name, customer, _ = names_for(hinban, today_stats_for_hinban(today_summary, hinban))
+        history_prompts[hinban] = build_history_analysis_prompt(
+            part_number=hinban,
+            part_name=part_name,
+            customer=customer,
+            trend_table=build_trend_summary_from_history(stable_history.get(hinban)),
+            defect_kind_summary=format_defect_kind_summary(stable_kind_sums.get(hinban)),
+            use_anonymization=use_anonymization,
+        )
+
+    def daily_prompt(hinban: str, history_analysis: str) -> str:
+        stats = today_stats_for_hinban(today_summary, hinban)
+        part_name, customer, major_defects = names_for(hinban, stats)
+        recent = recent_history.get(hinban)
+        return build_daily_part_prompt(
+            part_number=hinban,
+            part_name=part_name,
+            customer=customer,
+            history_analysis=history_analysis,
+            recent_table=build_trend_table_from_history(recent.recent_rows if recent else []),
+            today_qty=stats.qty,
+            today_ng=stats.ng,
+            today_rate=stats.rate,
+            today_defect_kinds=stats.defect_kinds,
+            worst_label=f"{term_info.term_number}期ワースト品番" if hinban in worst_set else "",
+            major_defects=major_defects,
+            use_anonymization=use_anonymization,
+        )
+
+    return history_prompts, daily_prompt
+
+
+# -----------------------------
+# Gemini 呼び出しスケジューラ
+# -----------------------------
+
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限（スレッドセーフ）。
+    最大 capacity 個まで貯まり、1分あたり rate_per_minute 個のペースで補充される。
+    clock / sleep はテスト用に差し替え可能。
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float,
+        capacity: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.rate_per_sec = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """amount 個取得できるまで待つ。待った秒数を返す。"""
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_sec)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                wait_s = (amount - self._tokens) / self.rate_per_sec
+            self._sleep(wait_s)
+            waited += wait_s
+
+
+def _estimate_prompt_tokens(prompt: str) -> int:
+    # 日本語主体のため1文字≒1トークンとして安全側に見積もる
+    return max(1, len(prompt))
+
+
+class GeminiRateLimiter:
+    """Gemini の RPM / TPM クォータに合わせたリクエスト前の待機"""
+
+    def __init__(self, rpm: TokenBucket, tpm: Optional[TokenBucket] = None) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+
+    @classmethod
+    def from_env(cls) -> "GeminiRateLimiter":
+        """
+        GEMINI_RPM（未設定なら従来の GEMINI_REQUEST_INTERVAL_SECONDS から換算）、
+        GEMINI_RPM_BURST、GEMINI_TPM（0 で無制限）から作る。
+        """
+        rpm_env = os.environ.get("GEMINI_RPM")
+        if rpm_env:
+            rpm = float(rpm_env)
+        else:
+            interval_s = float(os.environ.get("GEMINI_REQUEST_INTERVAL_SECONDS", "12"))
+            rpm = 60.0 / interval_s if interval_s > 0 else 1000.0
+        burst = float(os.environ.get("GEMINI_RPM_BURST", "1"))
+        tpm = float(os.environ.get("GEMINI_TPM", "0"))
+        # 複数プロセスで同じクォータを使う場合の按分（バックフィル時に設定される）
+        share = float(os.environ.get("GEMINI_RATE_SHARE", "1"))
+        rpm *= share
+        tpm *= share
+        return cls(
+            rpm=TokenBucket(rpm, capacity=burst),
+            tpm=TokenBucket(tpm, capacity=tpm) if tpm > 0 else None,
+        )
+
+    def acquire(self, prompt: str) -> None:
+        self.rpm.acquire(1)
+        if self.tpm is not None:
+            self.tpm.acquire(_estimate_prompt_tokens(prompt))
+
+
+class AiStageBudget:
+    """
+    AIコメント生成ステージ全体の持ち時間。
+    GEMINI_STAGE_BUDGET_SECONDS を過ぎたら以降の結果は待たずにダッシュボードを出す（既定 0 = 無制限）。
+    設定する場合は GEMINI_MAX_PARTS × 1リクエストの間隔（既定 15 × 12秒 = 180秒）より長くすること。
+    短いとレート制限の待ちだけで期限を迎え、その分の品番はコメント無しになる。
+    期限後に届いた結果はキャッシュに入るが、プロンプトに当日の実績を含むため
+    使われるのは同じ日の再実行時だけ（翌日分には効かない）。
+    """
+
+    def __init__(self, seconds: Optional[float], clock: Callable[[], float] = time.monotonic) -> None:
+        self.seconds = float(seconds) if seconds and seconds > 0 else None
+        self._clock = clock
+        self._deadline = clock() + self.seconds if self.seconds else None
+
+    @classmethod
+    def from_env(cls) -> "AiStageBudget":
+        return cls(float(os.environ.get("GEMINI_STAGE_BUDGET_SECONDS", "0")))
+
+    def remaining(self) -> Optional[float]:
+        """残り秒数（無制限なら None）"""
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - self._clock())
+
+    def expired(self) -> bool:
+        return self._deadline is not None and self._clock() >= self._deadline
+
+
+@dataclass
+class AiCommentJob:
+    hinban: str
+    prompt: str
+    cache_key: str
+
+
+def run_ai_comment_jobs(
+    jobs: List[AiCommentJob],
+    model_name: str,
+    limiter: GeminiRateLimiter,
+    max_workers: int,
+    on_result: Callable[[AiCommentJob, str], None],
+    generate: Callable[[str, Optional[str]], str] = generate_worst_part_comment,
+    budget: Optional[AiStageBudget] = None,
+    on_late_result: Optional[Callable[[AiCommentJob, str], None]] = None,
+    on_error: Optional[Callable[[AiCommentJob, Exception], None]] = None,
+) -> List[AiCommentJob]:
+    """
+    キャッシュに無い品番のコメントを少数のワーカーで並行生成する。
+
+    - 各リクエストの前に limiter で RPM / TPM を守る
+    - 生成できたコメントは呼び出し元スレッドで on_result に渡す（キャッシュ保存など）
+    - 個別の呼び出しで例外が出たジョブはログに残して on_error に渡し、飛ばす（他のジョブは続行）
+    - クォータ超過（_GEMINI_QUOTA_EXCEEDED）を検知したら未着手のジョブは取り消す
+    - budget の期限を過ぎたら待たずに戻る。未着手のジョブは取り消し、実行中のジョブの結果は
+      届いた時点でワーカースレッドから on_late_result に渡す（同じ日の再実行用にキャッシュへ保存する）
+    - generate はテスト時にローカルの偽モデルへ差し替えられる
+    返却: 期限内に結果を受け取れなかったジョブ
+    """
+    if not jobs:
+        return []
+    if budget is not None and budget.expired():
+        return list(jobs)
+
+    def work(job: AiCommentJob) -> str:
+        if _GEMINI_QUOTA_EXCEEDED or (budget is not None and budget.expired()):
+            return ""
+        limiter.acquire(job.prompt)
+        if _GEMINI_QUOTA_EXCEEDED or (budget is not None and budget.expired()):
+            return ""
+        with stage_timer("gemini_call", hinban=job.hinban, prompt_chars=len(job.prompt)):
+            return generate(job.prompt, model_name)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="gemini")
+    futures = {pool.submit(work, job): job for job in jobs}
+    not_done = set(futures)
+    try:
+        while not_done:
+            done, not_done = wait(
+                not_done,
+                timeout=budget.remaining() if budget is not None else None,
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for fut in done:
+                job = futures[fut]
+                try:
+                    comment = fut.result()
+                except Exception as e:
+                    # 1品番の失敗（タイムアウト等）でステージ全体を止めず、その品番だけ欠けた扱いにする
+                    logging.warning("Gemini comment failed for %s: %s", job.hinban, e)
+                    if on_error is not None:
+                        on_error(job, e)
+                    continue
+                if comment:
+                    on_result(job, comment)
+            if _GEMINI_QUOTA_EXCEEDED:
+                logging.error("Gemini quota exceeded; cancelling remaining comment jobs.")
+                break
+    finally:
+        # 実行中の呼び出しは待たない（期限切れ・クォータ超過・例外のいずれでも）
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if not not_done or _GEMINI_QUOTA_EXCEEDED:
+        return []
+
+    def deliver_late(fut, job: AiCommentJob) -> None:
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        comment = fut.result()
+        if not comment:
+            return
+        try:
+            on_late_result(job, comment)
+        except Exception as e:
+            logging.warning("failed to keep late Gemini comment for %s: %s", job.hinban, e)
+
+    running = [fut for fut in not_done if not fut.cancelled()]
+    if on_late_result is not None:
+        for fut in running:
+            fut.add_done_callback(lambda f, job=futures[fut]: deliver_late(f, job))
+    logging.warning(
+        "AI stage budget (%ss) expired: %s comment jobs pending, %s still running",
+        budget.seconds if budget is not None else "-",
+        len(not_done),
+        len(running),
+    )
+    return [futures[fut] for fut in not_done]
+
+
+def build_batch_prompt(keyed_prompts: Dict[str, str]) -> str:
+    """
+    複数品番の依頼をまとめ、品番キーごとのコメントを JSON で返させるプロンプトを作る。
+    キーは匿名化済みの品番（匿名化無効時は品番そのもの）。
+    """
+    sections = [f"=== {key} ===\n{prompt}" for key, prompt in keyed_prompts.items()]
+    example_key = next(iter(keyed_prompts), "品番キー")
+    return "\n\n".join([
+        f"""
+以下の{len(keyed_prompts)}件の品番について、それぞれ独立にコメントを作成してください。
+各品番の依頼内容は「=== 品番キー ===」の後に記載しています。依頼内容ごとの形式・出力ルールを守ってください。
+
+出力は JSON オブジェクトのみとし、キーは品番キー、値はその品番のコメント文字列（改行は \\n）としてください。
+例: {{"{example_key}": "【評価】...\\n【判断】...\\n【対策】..."}}
+""".strip(),
+        *sections,
+    ])
+
+
+def _parse_batch_response(text: str) -> Dict[str, str]:
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("{"):] if "{" in text else text
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end <= start:
+            return {}
+        try:
+            data = json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            return {}
+    if not isinstance(data, dict):
+        return {}
+    return {str(k): str(v).strip() for k, v in data.items() if isinstance(v, str) and v.strip()}
+
+
 def load_config(path: Optional[str]) -> Config:
     if not path:
         return Config()
@@ -518,6 +1210,162 @@ def setup_logging(output_dir: str) -> None:
     )
 
 
+# -----------------------------
+# 実行計測（ステージ別所要時間）
+# -----------------------------
+
+def _get_run_metrics_path(output_dir: str) -> Path:
+    return Path(output_dir) / "dashboard_run_metrics.jsonl"
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """プロセスのピークRSS（MB）。取得できない環境では None。"""
+    if psutil is not None and resource is None:  # resource が無いのは Windows
+        # Windows: ピーク値は psutil の peak_wset のみ（現在の rss はピークではないので使わない）
+        try:
+            peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+            if peak is not None:
+                return round(peak / (1024 * 1024), 1)
+        except Exception:
+            pass
+    if resource is not None:
+        # Linux / macOS: ru_maxrss（Linux は KB、macOS はバイト）
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak_kb /= 1024
+        return round(peak_kb / 1024, 1)
+    return None
+
+
+def _current_rss_mb() -> Optional[float]:
+    """プロセスの現在のRSS（MB）。取得できない環境では None。"""
+    if psutil is not None:
+        try:
+            return round(psutil.Process().memory_info().rss / (1024 * 1024), 1)
+        except Exception:
+            return None
+    try:
+        # Linux: /proc/self/statm の2列目が常駐ページ数
+        with open("/proc/self/statm", encoding="ascii") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class RunMetrics:
+    """
+    1回の実行のステージ別所要時間・行数・RSS の増減を記録する。
+    ステージの rss_delta_mb はステージ前後の現在RSSの差（並行して動く他スレッドの分も含む）。
+    process_peak_rss_mb はプロセス全体のピーク（その時点までの最大値）で、ステージ単位の値ではない。
+    Gemini 呼び出しはワーカースレッドから記録されるためロックで保護する。
+    """
+
+    def __init__(self, run_date: datetime) -> None:
+        self.run_date = run_date
+        self.started_at = datetime.now()
+        self._started = time.perf_counter()
+        self._stages: List[Dict[str, object]] = []
+        self._lock = threading.Lock()
+        self.record: Optional[Dict[str, object]] = None
+
+    @contextmanager
+    def stage(self, name: str, **info: object):
+        record: Dict[str, object] = {"stage": name, **info}
+        start = time.perf_counter()
+        start_rss = _current_rss_mb()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            end_rss = _current_rss_mb()
+            record["rss_delta_mb"] = (
+                round(end_rss - start_rss, 1) if start_rss is not None and end_rss is not None else None
+            )
+            record["process_peak_rss_mb"] = _peak_rss_mb()
+            with self._lock:
+                self._stages.append(record)
+
+    def to_record(self) -> Dict[str, object]:
+        total = time.perf_counter() - self._started
+        nfr_seconds = float(os.environ.get("DASHBOARD_NFR_SECONDS", "120"))
+        with self._lock:
+            stages = list(self._stages)
+        return {
+            "run_date": f"{self.run_date:%Y-%m-%d}",
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "total_seconds": round(total, 3),
+            "nfr_seconds": nfr_seconds,
+            "nfr_exceeded": total > nfr_seconds,
+            "process_peak_rss_mb": _peak_rss_mb(),
+            "stages": stages,
+        }
+
+    def finish(self) -> Dict[str, object]:
+        """計測を締めて self.record に残す。NFR（既定120秒）超過時は警告を出す。"""
+        record = self.record = self.to_record()
+        if record["nfr_exceeded"]:
+            slowest = sorted(record["stages"], key=lambda r: r["seconds"], reverse=True)[:3]
+            logging.warning(
+                "dashboard run for %s took %.1fs (NFR %gs); slowest stages: %s",
+                record["run_date"],
+                record["total_seconds"],
+                record["nfr_seconds"],
+                ", ".join(f"{r['stage']}={r['seconds']}s" for r in slowest),
+            )
+        return record
+
+
+def append_run_metrics(output_dir: str, record: Dict[str, object]) -> None:
+    """1実行1行の JSON として dashboard_run_metrics.jsonl へ追記する（書き込むのは1プロセスだけにする）"""
+    try:
+        path = _get_run_metrics_path(output_dir)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        logging.warning("failed to write run metrics: %s", e)
+
+
+# 実行中の計測（プロセス内で1つ）。未設定なら計測しない
+_ACTIVE_RUN_METRICS: Optional[RunMetrics] = None
+
+
+@contextmanager
+def stage_timer(name: str, **info: object):
+    """
+    現在の実行にステージを記録する。呼び出し側は yield された dict に rows 等を設定できる。
+        with stage_timer("join_defects") as st:
+            df = join_defects(...)
+            st["rows"] = len(df)
+    """
+    metrics = _ACTIVE_RUN_METRICS
+    if metrics is None:
+        yield {}
+        return
+    with metrics.stage(name, **info) as record:
+        yield record
+
+
+@contextmanager
+def run_metrics(run_date: datetime, output_dir: Optional[str]):
+    """
+    generate_dashboard 1回分の計測を開始し、終了時に dashboard_run_metrics.jsonl へ書き出す。
+    output_dir が None なら書き出さない（バックフィルのワーカーは metrics.record を親プロセスへ返す）。
+    """
+    global _ACTIVE_RUN_METRICS
+    metrics = RunMetrics(run_date)
+    previous = _ACTIVE_RUN_METRICS
+    _ACTIVE_RUN_METRICS = metrics
+    try:
+        yield metrics
+    finally:
+        _ACTIVE_RUN_METRICS = previous
+        record = metrics.finish()
+        if output_dir is not None:
+            append_run_metrics(output_dir, record)
+
+
 # -----------------------------
 # Access 読み込み
 # -----------------------------
@@ -528,10 +1376,200 @@ def connect_access(db_path: str):
         rf"DBQ={db_path};"
         r"ReadOnly=1;"
     )
+    if pyodbc is None:
+        raise RuntimeError("pyodbc がインストールされていないため Access に接続できません。")
     return pyodbc.connect(conn_str)
 
 
-def read_access_table(db_path: str, table: str) -> pd.DataFrame:
+def quote_access_identifier(name: str) -> str:
+    name = str(name)
+    if not name or "[" in name or "]" in name:
+        raise ValueError(f"invalid Access identifier: {name!r}")
+    return f"[{name}]"
+
+
+def build_access_select(
+    table: str,
+    columns: Optional[List[str]] = None,
+    date_column: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    lot_ids: Optional[List[object]] = None,
+    lot_column: str = "生産ロットID",
+    include_null_dates: bool = False,
+    lots_within_range: bool = False,
+) -> Tuple[str, List[object]]:
+    """
+    Access 用の SELECT 文とパラメータを組み立てる。
+
+    - columns: 取得列（None なら全列）
+    - date_from / date_to: date_column に対する期間条件（date_from 以上、date_to 未満）
+    - include_null_dates: 期間条件に日付が空の行も含める
+    - lot_ids: 指定ロットの行も取得する（期間条件とは OR で結合）
+    - lots_within_range: 期間条件と lot_ids を AND で結合する（期間内の指定ロットのみ）
+    """
+    select_cols = ", ".join(quote_access_identifier(c) for c in columns) if columns else "*"
+    sql = f"SELECT {select_cols} FROM {quote_access_identifier(table)}"
+    where, params = _build_access_where(
+        date_column, date_from, date_to, lot_ids, lot_column, include_null_dates, lots_within_range
+    )
+    return sql + where, params
+
+
+def _build_access_where(
+    date_column: Optional[str],
+    date_from: Optional[datetime],
+    date_to: Optional[datetime],
+    lot_ids: Optional[List[object]],
+    lot_column: str,
+    include_null_dates: bool = False,
+    lots_within_range: bool = False,
+) -> Tuple[str, List[object]]:
+    params: List[object] = []
+
+    # Access の日付型は秒未満を持たないため、範囲が狭まらない側へ秒単位に丸める
+    range_conds: List[str] = []
+    if date_column and date_from is not None:
+        range_conds.append(f"{quote_access_identifier(date_column)} >= ?")
+        params.append(date_from.replace(microsecond=0))
+    if date_column and date_to is not None:
+        if date_to.microsecond:
+            date_to = date_to.replace(microsecond=0) + timedelta(seconds=1)
+        range_conds.append(f"{quote_access_identifier(date_column)} < ?")
+        params.append(date_to)
+
+    conds: List[str] = []
+    if range_conds:
+        range_sql = " AND ".join(range_conds)
+        if include_null_dates:
+            range_sql = f"({range_sql}) OR {quote_access_identifier(date_column)} IS NULL"
+        conds.append("(" + range_sql + ")")
+    if lot_ids:
+        placeholders = ", ".join("?" for _ in lot_ids)
+        conds.append(f"{quote_access_identifier(lot_column)} IN ({placeholders})")
+        params.extend(lot_ids)
+
+    if not conds:
+        return "", params
+    return " WHERE " + (" AND " if lots_within_range else " OR ").join(conds), params
+
+
+class AccessReadCancelled(Exception):
+    """AccessConnectionPool.cancel() により打ち切った読み込み（再試行しない）"""
+
+
+def _close_access_connection(conn) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class AccessConnectionPool:
+    """
+    1回の実行中、DBファイルごとに最大 per_file 本（ACCESS_CONNECTIONS_PER_FILE、既定 2）の接続を使い回す。
+    Access（ODBC）の接続はスレッド間で同時に使えないため、1本の接続を同時に使うのは1スレッドだけ。
+    同じファイルのテーブルも per_file 本まで並行して読める（不具合情報と製品マスタなど）。
+    読み込みに失敗した接続は破棄し、次の試行で張り直す。
+    cancel() 後は新しい読み込みを始めず、型付きの読み込みは次のチャンクで打ち切る。
+    """
+
+    def __init__(self, per_file: Optional[int] = None) -> None:
+        if per_file is None:
+            per_file = int(os.environ.get("ACCESS_CONNECTIONS_PER_FILE", "2"))
+        self.per_file = max(1, per_file)
+        self._idle: Dict[str, List[object]] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._closed = False
+
+    def _slots_for(self, key: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.per_file)
+            return self._slots[key]
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @contextmanager
+    def connection(self, db_path: str):
+        key = os.path.normcase(os.path.abspath(db_path))
+        with self._slots_for(key):
+            if self.cancelled:
+                raise AccessReadCancelled(db_path)
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                conn = connect_access(db_path)
+            try:
+                yield conn
+            except Exception:
+                _close_access_connection(conn)
+                raise
+            with self._lock:
+                if not self._closed:
+                    self._idle.setdefault(key, []).append(conn)
+                    return
+            _close_access_connection(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            conns = [conn for idle in self._idle.values() for conn in idle]
+            self._idle = {}
+        for conn in conns:
+            _close_access_connection(conn)
+
+
+# 実行中の接続プール（未設定なら読み込みごとに接続する）
+_ACTIVE_ACCESS_POOL: Optional[AccessConnectionPool] = None
+# 読み込み中のスレッドが使っているプール（型付き読み込みの打ち切り確認用）
+_ACCESS_READ_STATE = threading.local()
+
+
+@contextmanager
+def access_connection_pool():
+    """この中の Access 読み込みは DB ファイルごとに接続を使い回す"""
+    global _ACTIVE_ACCESS_POOL
+    pool = AccessConnectionPool()
+    previous = _ACTIVE_ACCESS_POOL
+    _ACTIVE_ACCESS_POOL = pool
+    try:
+        yield pool
+    finally:
+        _ACTIVE_ACCESS_POOL = previous
+        pool.close()
+
+
+@contextmanager
+def _access_connection(db_path: str):
+    pool = _ACTIVE_ACCESS_POOL
+    if pool is not None:
+        with pool.connection(db_path) as conn:
+            _ACCESS_READ_STATE.pool = pool
+            try:
+                yield conn
+            finally:
+                _ACCESS_READ_STATE.pool = None
+    else:
+        with connect_access(db_path) as conn:
+            yield conn
+
+
+def _check_access_read_cancelled() -> None:
+    pool = getattr(_ACCESS_READ_STATE, "pool", None)
+    if pool is not None and pool.cancelled:
+        raise AccessReadCancelled("Access read cancelled")
+
+
+def _run_access_read(db_path: str, table: str, read):
     retries = int(os.environ.get("ACCESS_READ_RETRIES", "3"))
     initial_delay_s = float(os.environ.get("ACCESS_READ_RETRY_DELAY_S", "2"))
     max_delay_s = float(os.environ.get("ACCESS_READ_RETRY_MAX_DELAY_S", "20"))
@@ -539,14 +1577,10 @@ def read_access_table(db_path: str, table: str) -> pd.DataFrame:
     for attempt in range(1, retries + 1):
         try:
             logging.info("reading Access table %s from %s (attempt %s/%s)", table, db_path, attempt, retries)
-            with connect_access(db_path) as conn:
-                with warnings.catch_warnings():
-                    warnings.filterwarnings(
-                        "ignore",
-                        message="pandas only supports SQLAlchemy connectable*",
-                        category=UserWarning,
-                    )
-                    return pd.read_sql(f"SELECT * FROM {table}", conn)
+            with _access_connection(db_path) as conn:
+                return read(conn)
+        except AccessReadCancelled:
+            raise
         except Exception as e:
             if attempt >= retries:
                 raise
@@ -561,8 +1595,222 @@ def read_access_table(db_path: str, table: str) -> pd.DataFrame:
             time.sleep(delay_s)
 
 
-def read_product_master(db_path: str) -> pd.DataFrame:
-    table = "t_製品マスタ"
+def read_access_columns(db_path: str, table: str) -> List[str]:
+    """行を転送せずにテーブルの列名だけを取得する"""
+    def read(conn) -> List[str]:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT * FROM {quote_access_identifier(table)} WHERE 1=0")
+        return [d[0] for d in cursor.description]
+
+    return _run_access_read(db_path, table, read)
+
+
+# 共有辞書でカテゴリ化するキー列（外観検査集計・不具合情報で同じコードになる）
+CATEGORICAL_KEY_COLUMNS = ("生産ロットID", "品番", "号機")
+
+
+class SharedCategories:
+    """
+    複数テーブルで共有するカテゴリ辞書（文字列 → コード）。
+    値は追加のみでコードは変わらないため、同じ辞書から作ったカテゴリ列同士はコードのまま照合できる。
+    """
+
+    def __init__(self) -> None:
+        self._codes: Dict[str, int] = {}
+        self._values: List[str] = []
+        self._index: Optional[pd.Index] = None
+        # これまでに渡したカテゴリ Index（id → 弱参照）。辞書が増えると Index は作り直されるため
+        self._issued: Dict[int, "weakref.ref[pd.Index]"] = {}
+        self._lock = threading.Lock()
+
+    def encode(self, values: Iterable[object]) -> np.ndarray:
+        """値をコードに変換する（欠損は -1）。未登録の値は辞書に追加する。"""
+        codes = self._codes
+        with self._lock:
+            out = []
+            for v in values:
+                if v is None:
+                    out.append(-1)
+                    continue
+                key = v if isinstance(v, str) else str(v)
+                code = codes.get(key)
+                if code is None:
+                    code = len(self._values)
+                    codes[key] = code
+                    self._values.append(key)
+                    self._index = None
+                out.append(code)
+        return np.asarray(out, dtype=np.int32)
+
+    @property
+    def categories(self) -> pd.Index:
+        with self._lock:
+            if self._index is None or len(self._index) != len(self._values):
+                self._index = pd.Index(self._values, dtype=object)
+                self._issued = {k: r for k, r in self._issued.items() if r() is not None}
+                self._issued[id(self._index)] = weakref.ref(self._index)
+            return self._index
+
+    def owns(self, categories: pd.Index) -> bool:
+        """この辞書から作ったカテゴリか（古い Index も辞書の先頭部分なのでコードはそのまま使える）"""
+        with self._lock:
+            ref = self._issued.get(id(categories))
+            return ref is not None and ref() is categories
+
+    def categorical(self, codes: np.ndarray) -> pd.Categorical:
+        return pd.Categorical.from_codes(codes, categories=self.categories, validate=False)
+
+    def align(self, s: pd.Series) -> pd.Series:
+        """辞書が増えた後も同じカテゴリ（Index オブジェクト）を指すように揃える（コードは不変）"""
+        if not isinstance(s.dtype, pd.CategoricalDtype) or s.cat.categories is self.categories:
+            return s
+        return pd.Series(self.categorical(s.cat.codes.to_numpy()), index=s.index, name=s.name)
+
+
+_SHARED_CATEGORIES: Dict[str, SharedCategories] = {}
+_SHARED_CATEGORIES_LOCK = threading.Lock()
+
+
+def shared_categories(column: str) -> SharedCategories:
+    with _SHARED_CATEGORIES_LOCK:
+        if column not in _SHARED_CATEGORIES:
+            _SHARED_CATEGORIES[column] = SharedCategories()
+        return _SHARED_CATEGORIES[column]
+
+
+def _smallest_int_dtype(lo: float, hi: float) -> np.dtype:
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class _ColumnBuilder:
+    """fetchmany のチャンクを型付きの配列へ詰める（行タプルを全件保持しない、配列は倍々に拡張する）"""
+
+    def __init__(self, name: str, type_code: object, capacity: int = 0) -> None:
+        self.name = name
+        self.size = 0
+        if name in CATEGORICAL_KEY_COLUMNS and type_code is str:
+            self.kind = "category"
+            self.categories = shared_categories(name)
+            self.values = np.full(capacity, -1, dtype=np.int32)
+        elif type_code in (int, float) or type_code is Decimal:
+            self.kind = "int" if type_code is int else "float"
+            self.values = np.full(capacity, np.nan, dtype=np.float64)
+        elif type_code in (datetime, date):
+            self.kind = "datetime"
+            self.values = np.full(capacity, np.datetime64("NaT"), dtype="datetime64[ns]")
+        else:
+            self.kind = "object"
+            self.values = np.empty(capacity, dtype=object)
+
+    def extend(self, chunk: Tuple[object, ...]) -> None:
+        n = len(chunk)
+        if self.size + n > len(self.values):
+            # 件数は事前に数えない（COUNT(*) で全件をもう一度走査しない）ため、容量を倍々に増やす
+            grow = max(n, len(self.values))
+            fill = {"category": -1, "int": np.nan, "float": np.nan, "datetime": np.datetime64("NaT")}.get(self.kind)
+            extra = np.full(grow, fill, dtype=self.values.dtype) if fill is not None else np.empty(grow, dtype=object)
+            self.values = np.concatenate([self.values, extra])
+        target = self.values[self.size:self.size + n]
+        if self.kind == "category":
+            target[:] = self.categories.encode(chunk)
+        elif self.kind in ("int", "float"):
+            target[:] = [np.nan if v is None else float(v) for v in chunk]
+        elif self.kind == "datetime":
+            target[:] = pd.to_datetime(list(chunk), errors="coerce").to_numpy(dtype="datetime64[ns]")
+        else:
+            target[:] = chunk
+        self.size += n
+
+    def finish(self):
+        values = self.values[:self.size]
+        if self.kind == "category":
+            return self.categories.categorical(values)
+        if self.kind == "int":
+            mask = np.isnan(values)
+            if values.size == 0 or mask.all():
+                return values
+            present = values[~mask]
+            dtype = _smallest_int_dtype(present.min(), present.max())
+            if mask.any():
+                # 欠損ありは nullable 整数（Int8 など）
+                return pd.arrays.IntegerArray(np.where(mask, 0, values).astype(dtype), mask)
+            return values.astype(dtype)
+        if self.kind == "object":
+            return pd.Series(values, dtype=object).infer_objects()
+        return values
+
+
+def read_access_frame_typed(cursor, chunk_size: Optional[int] = None) -> pd.DataFrame:
+    """
+    実行済みカーソルから型付きの DataFrame を作る。
+    - 品番・号機・生産ロットID は共有辞書のカテゴリ列
+    - 整数列（不具合数・数量など）は値域に合う最小の整数型（欠損ありなら nullable 整数）
+    - 日付列は datetime64
+    """
+    chunk_size = chunk_size or int(os.environ.get("ACCESS_FETCH_CHUNK_ROWS", "5000"))
+    builders = [_ColumnBuilder(d[0], d[1], chunk_size) for d in cursor.description]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for builder, chunk in zip(builders, zip(*rows)):
+            builder.extend(chunk)
+        _check_access_read_cancelled()
+    return pd.DataFrame({b.name: b.finish() for b in builders})
+
+
+def read_access_table(
+    db_path: str,
+    table: str,
+    columns: Optional[List[str]] = None,
+    date_column: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    lot_ids: Optional[List[object]] = None,
+    typed: bool = False,
+    include_null_dates: bool = False,
+    lots_within_range: bool = False,
+) -> pd.DataFrame:
+    """
+    Access テーブルを読み込む（絞り込み条件は build_access_select 参照）。
+    typed=True なら fetchmany で型付きの列へ直接詰める（件数の事前取得はしない）
+    （read_access_frame_typed 参照）。pd.read_sql より大幅にメモリが少ない。
+    """
+    filters = dict(
+        date_column=date_column,
+        date_from=date_from,
+        date_to=date_to,
+        lot_ids=lot_ids,
+        include_null_dates=include_null_dates,
+        lots_within_range=lots_within_range,
+    )
+    sql, params = build_access_select(table, columns=columns, **filters)
+
+    def read(conn) -> pd.DataFrame:
+        if typed:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return read_access_frame_typed(cursor)
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore",
+                message="pandas only supports SQLAlchemy connectable*",
+                category=UserWarning,
+            )
+            return pd.read_sql(sql, conn, params=params or None)
+
+    df = _run_access_read(db_path, table, read)
+    if params:
+        logging.info("read %s rows from %s with pushed-down filters", len(df), table)
+    return df
+
+
+def read_product_master(db_path: str) -> pd.DataFrame:
+    table = "t_製品マスタ"
     try:
         df = read_access_table(db_path, table)
     except Exception as e:
@@ -575,15 +1823,132 @@ def read_product_master(db_path: str) -> pd.DataFrame:
     return df[list(needed)].drop_duplicates(subset=["製品番号"])
 
 
+def read_appearance_for_run_date(cfg: Config, run_date: datetime) -> pd.DataFrame:
+    """
+    外観検査集計から run_date 当日分のロットを読み込む。
+    日付列が特定できれば当日条件と列の絞り込みを Access 側で行う。
+    """
+    if not cfg.push_down_filters:
+        return read_access_table(cfg.appearance_db_path, cfg.appearance_table, typed=cfg.typed_loading)
+
+    available = read_access_columns(cfg.appearance_db_path, cfg.appearance_table)
+    date_col = find_date_column_name(available)
+    if not date_col:
+        logging.warning("no known date column in %s; reading all rows", cfg.appearance_table)
+        return read_access_table(cfg.appearance_db_path, cfg.appearance_table, typed=cfg.typed_loading)
+
+    columns = [c for c in APPEARANCE_COLUMNS if c in available]
+    if date_col not in columns:
+        columns.append(date_col)
+    day_start = datetime.combine(run_date.date(), datetime.min.time())
+    return read_access_table(
+        cfg.appearance_db_path,
+        cfg.appearance_table,
+        columns=columns,
+        date_column=date_col,
+        date_from=day_start,
+        date_to=day_start + timedelta(days=1),
+        typed=cfg.typed_loading,
+    )
+
+
+def read_defect_window(cfg: Config, since: datetime) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    不具合情報から since 以降の行を読み込む（当日ロットが決まる前に読み始められる部分）。
+    返却: (DataFrame, 日付列名)。日付列を特定できない・絞り込み無効なら全件を読み、日付列は None。
+    """
+    if not cfg.push_down_filters:
+        return read_access_table(cfg.defect_db_path, cfg.defect_table, typed=cfg.typed_loading), None
+
+    available = read_access_columns(cfg.defect_db_path, cfg.defect_table)
+    date_col = find_date_column_name(available)
+    if not date_col:
+        logging.warning("no known date column in %s; reading all rows", cfg.defect_table)
+        return read_access_table(cfg.defect_db_path, cfg.defect_table, typed=cfg.typed_loading), None
+
+    df = read_access_table(
+        cfg.defect_db_path,
+        cfg.defect_table,
+        date_column=date_col,
+        date_from=since.replace(microsecond=0),
+        typed=cfg.typed_loading,
+    )
+    return df, date_col
+
+
+def read_defects_for_lots_before(
+    cfg: Config,
+    date_col: str,
+    lot_ids: List[object],
+    since: datetime,
+) -> pd.DataFrame:
+    """
+    当日ロットの行のうち since より前（または日付なし）のものを読み込む。
+    read_defect_window と合わせて「since 以降の行 + 当日ロットの行」になる（重複しない）。
+    """
+    max_in_params = int(os.environ.get("ACCESS_MAX_IN_PARAMS", "200"))
+    if not lot_ids:
+        return pd.DataFrame()
+    if len(lot_ids) > max_in_params:
+        logging.info(
+            "too many lot IDs for IN clause (%s > %s); filtering %s by date only",
+            len(lot_ids),
+            max_in_params,
+            cfg.defect_table,
+        )
+        return pd.DataFrame()
+    return read_access_table(
+        cfg.defect_db_path,
+        cfg.defect_table,
+        date_column=date_col,
+        date_to=since.replace(microsecond=0),
+        include_null_dates=True,
+        lot_ids=lot_ids,
+        lots_within_range=True,
+        typed=cfg.typed_loading,
+    )
+
+
+def concat_access_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    同じテーブルから分けて読んだ結果を連結する。
+    共有辞書のカテゴリ列は最新のカテゴリに揃えてからつなぐ（カテゴリのまま連結される）。
+    """
+    frames = [f for f in frames if not f.empty] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    aligned = []
+    for f in frames:
+        f = f.copy(deep=False)
+        for c in CATEGORICAL_KEY_COLUMNS:
+            if c in f.columns and isinstance(f[c].dtype, pd.CategoricalDtype):
+                f[c] = shared_categories(c).align(f[c])
+        aligned.append(f)
+    return pd.concat(aligned, ignore_index=True)
+
+
 # -----------------------------
 # データ整形・抽出
 # -----------------------------
 
-def find_date_column(df: pd.DataFrame) -> Optional[str]:
-    candidates = ["指示日", "検査日", "検査日付", "日付", "実施日", "作成日"]
-    for c in candidates:
-        if c in df.columns:
+DATE_COLUMN_CANDIDATES = ["指示日", "検査日", "検査日付", "日付", "実施日", "作成日"]
+
+# 当日ロット抽出〜当日集計で外観検査側から参照する列
+APPEARANCE_COLUMNS = ["生産ロットID", "品番", "号機", "指示日", "数量"]
+
+
+def find_date_column_name(columns: Iterable[str]) -> Optional[str]:
+    cols = set(columns)
+    for c in DATE_COLUMN_CANDIDATES:
+        if c in cols:
             return c
+    return None
+
+
+def find_date_column(df: pd.DataFrame) -> Optional[str]:
+    c = find_date_column_name(df.columns)
+    if c:
+        return c
     # datetime型らしい列をヒューリスティックに探す
     for c in df.columns:
         if "日" in c and df[c].dtype != object:
@@ -592,19 +1957,26 @@ def find_date_column(df: pd.DataFrame) -> Optional[str]:
 
 
 def normalize_dates(df: pd.DataFrame, col: Optional[str]) -> pd.DataFrame:
-    if not col:
+    if not col or pd.api.types.is_datetime64_any_dtype(df[col]):
+        # 変換済みならコピーしない
         return df
     df = df.copy()
     df[col] = pd.to_datetime(df[col], errors="coerce")
     return df
 
 
-def extract_today_lots(appearance_df: pd.DataFrame, run_date: datetime) -> pd.DataFrame:
+def extract_today_lots(appearance_df: pd.DataFrame, run_date: datetime, keep_categories: bool = False) -> pd.DataFrame:
+    """
+    run_date 当日の外観検査ロット（生産ロットIDの重複は先頭1件）。
+    keep_categories=True ならカテゴリ列をそのまま返す（不具合情報とのコード照合用）。
+    """
     date_col = find_date_column(appearance_df)
     appearance_df = normalize_dates(appearance_df, date_col)
 
     if date_col:
-        today_mask = appearance_df[date_col].dt.date == run_date.date()
+        day_start = pd.Timestamp(run_date.date())
+        dates = appearance_df[date_col]
+        today_mask = (dates >= day_start) & (dates < day_start + pd.Timedelta(days=1))
         today_df = appearance_df.loc[today_mask].copy()
         logging.info("appearance rows for run_date=%s: %s", run_date.date(), len(today_df))
     else:
@@ -621,16 +1993,69 @@ def extract_today_lots(appearance_df: pd.DataFrame, run_date: datetime) -> pd.Da
     if before_count != after_count:
         logging.info("removed %s duplicate lot IDs", before_count - after_count)
     
-    return today_df
+    return today_df if keep_categories else decategorize(today_df)
+
+
+def decategorize(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    カテゴリ列を通常の列（object）に戻す。
+    当日分など小さい表を品番・号機で groupby / 並べ替えする前に使う
+    （カテゴリのままだと未出現の組み合わせや辞書順でない並びになるため）。
+    """
+    cat_cols = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if not cat_cols:
+        return df
+    df = df.copy()
+    for c in cat_cols:
+        df[c] = df[c].astype(object)
+    return df
 
 
-def join_defects(today_lots_df: pd.DataFrame, defect_df: pd.DataFrame) -> pd.DataFrame:
+def _lot_id_mask(lot_col: pd.Series, lots: List[str], today_lot_col: Optional[pd.Series] = None) -> np.ndarray:
+    """
+    lot_col のうち lots に含まれる行のマスク。
+    カテゴリ列ならカテゴリコード同士で照合し、全件の文字列化をしない。
+    today_lot_col も同じ共有辞書のカテゴリ列なら、文字列を介さずコードをそのまま使う
+    （読み込み順で辞書の大きさが違っても、追加のみの辞書なのでコードは一致する）。
+    """
+    if not isinstance(lot_col.dtype, pd.CategoricalDtype):
+        return lot_col.astype(str).isin(lots).to_numpy()
+    categories = lot_col.cat.categories
+    shared = shared_categories("生産ロットID")
+    if (
+        today_lot_col is not None
+        and isinstance(today_lot_col.dtype, pd.CategoricalDtype)
+        and (
+            today_lot_col.cat.categories is categories
+            or (shared.owns(today_lot_col.cat.categories) and shared.owns(categories))
+        )
+    ):
+        codes = today_lot_col.cat.codes.to_numpy()
+    else:
+        codes = categories.get_indexer(pd.Index(lots, dtype=object))
+    codes = np.unique(codes[codes >= 0])
+    return np.isin(lot_col.cat.codes.to_numpy(), codes)
+
+
+def join_defects(
+    today_lots_df: pd.DataFrame,
+    defect_df: pd.DataFrame,
+    today_lot_col: Optional[pd.Series] = None,
+) -> pd.DataFrame:
+    """
+    当日ロットの不具合情報を取り出す。
+    today_lot_col は当日ロットの生産ロットID（カテゴリのまま。あればコードで照合する）。
+    """
     if "生産ロットID" not in defect_df.columns:
         raise KeyError("defect table must include 生産ロットID")
-    lots = today_lots_df["生産ロットID"].dropna().astype(str).unique().tolist()
-    defect_df = defect_df.copy()
-    defect_df["生産ロットID"] = defect_df["生産ロットID"].astype(str)
-    joined = defect_df[defect_df["生産ロットID"].isin(lots)].copy()
+    if today_lot_col is None:
+        today_lot_col = today_lots_df["生産ロットID"]
+    today_lot_col = today_lot_col.dropna()
+    lots = today_lot_col.astype(str).unique().tolist()
+    # 対象ロットの行だけを取り出してから文字列化する（全件のコピーはしない）
+    joined = decategorize(defect_df.loc[_lot_id_mask(defect_df["生産ロットID"], lots, today_lot_col)])
+    joined = joined.copy()
+    joined["生産ロットID"] = joined["生産ロットID"].astype(str)
     # 不具合側に号機が無い場合、外観側から付与
     if "号機" not in joined.columns and "号機" in today_lots_df.columns:
         joined = joined.merge(
@@ -656,20 +2081,27 @@ def detect_defect_columns(df: pd.DataFrame) -> List[str]:
     return cols
 
 
-def _summarize_defect_breakdown_row(row: pd.Series, defect_cols: List[str]) -> str:
-    parts: List[str] = []
-    for c in defect_cols:
-        v = row.get(c, 0)
-        try:
-            if pd.isna(v) or float(v) <= 0:
-                continue
-        except Exception:
-            continue
-        parts.append(f"{c}{int(v)}")
-    return "、".join(parts) if parts else "-"
-
-
-def compute_today_summary(today_lots_df: pd.DataFrame, today_defects_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+def _summarize_defect_breakdown(frame: pd.DataFrame, defect_cols: List[str]) -> pd.Series:
+    """
+    行ごとに「区分名+件数」を「、」区切りで連結する（0件・欠損の区分は省略、全て0なら "-"）。
+    非ゼロのセルだけを取り出して連結するため、コストは非ゼロセル数に比例する。
+    """
+    values = frame[defect_cols].to_numpy(dtype=float, na_value=np.nan)
+    with np.errstate(invalid="ignore"):
+        row_idx, col_idx = np.nonzero(values > 0)
+    labels = [f"{defect_cols[j]}{int(v)}" for j, v in zip(col_idx, values[row_idx, col_idx])]
+    joined = pd.Series(labels, index=row_idx, dtype=object).groupby(level=0, sort=False).agg("、".join)
+    out = pd.Series("-", index=range(len(frame)), dtype=object)
+    out.loc[joined.index] = joined.to_numpy()
+    out.index = frame.index
+    return out
+
+
+def compute_today_summary(
+    today_lots_df: pd.DataFrame,
+    today_defects_df: pd.DataFrame,
+    defect_cols: Optional[List[str]] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
     if "品番" not in today_defects_df.columns and "品番" not in today_lots_df.columns:
         raise KeyError("品番 column not found in either table")
 
@@ -680,7 +2112,8 @@ def compute_today_summary(today_lots_df: pd.DataFrame, today_defects_df: pd.Data
     # 指示日（ロット日）をグループキーに追加
     if "指示日" in today_lots_df.columns or "指示日" in today_defects_df.columns:
         group_keys.append("指示日")
-    defect_cols = detect_defect_columns(today_defects_df)
+    if defect_cols is None:
+        defect_cols = detect_defect_columns(today_defects_df)
 
     # 数量は外観側（あれば）→不具合側へフォールバック（合算せず最初の値を採用）
     qty_col = "数量" if "数量" in today_lots_df.columns else ("数量" if "数量" in today_defects_df.columns else None)
@@ -701,169 +2134,1021 @@ def compute_today_summary(today_lots_df: pd.DataFrame, today_defects_df: pd.Data
         total_def_by_hinban["総不具合数"] = total_def_by_hinban[defect_cols].sum(axis=1)
         total_def_by_hinban = total_def_by_hinban[group_keys + ["総不具合数"]]
 
-    summary = qty_by_hinban.merge(total_def_by_hinban, on=group_keys, how="outer").fillna(0)
-    summary["不良率"] = summary.apply(
-        lambda r: (r["総不具合数"] / r[qty_col]) if qty_col and r[qty_col] else 0.0,
-        axis=1,
-    )
-    summary = summary.sort_values("不良率", ascending=False).reset_index(drop=True)
+    summary = qty_by_hinban.merge(total_def_by_hinban, on=group_keys, how="outer").fillna(0)
+    if qty_col:
+        qty = summary[qty_col].to_numpy(dtype=float)
+        ng = summary["総不具合数"].to_numpy(dtype=float)
+        summary["不良率"] = np.divide(ng, qty, out=np.zeros_like(ng), where=qty != 0)
+    else:
+        summary["不良率"] = 0.0
+    summary = summary.sort_values("不良率", ascending=False).reset_index(drop=True)
+
+    # 区分別集計（見やすさ重視で1列にまとめる）- 合算せず最初の値を採用
+    if defect_cols:
+        defects_breakdown = today_defects_df.groupby(group_keys, as_index=False)[defect_cols].first()
+        defects_breakdown["不具合内訳"] = _summarize_defect_breakdown(defects_breakdown, defect_cols)
+        defects_breakdown = defects_breakdown[group_keys + ["不具合内訳"]]
+    else:
+        defects_breakdown = pd.DataFrame(columns=group_keys + ["不具合内訳"])
+
+    # サマリーに内訳を統合
+    summary = summary.merge(defects_breakdown, on=group_keys, how="left")
+    summary["不具合内訳"] = summary["不具合内訳"].fillna("-")
+
+    return summary, defects_breakdown
+
+
+def last_1year_bounds(run_date: datetime) -> Tuple[datetime, pd.Timestamp]:
+    """
+    過去1年の範囲 [開始, 終了) を返す。
+    終了は run_date 当日の翌0時（バックフィルで run_date より後のロットを読み込んでいても含めない）。
+    """
+    return run_date - timedelta(days=365 * 1), pd.Timestamp(run_date.date()) + pd.Timedelta(days=1)
+
+
+def filter_last_1year(defect_df: pd.DataFrame, run_date: datetime) -> pd.DataFrame:
+    date_col = find_date_column(defect_df)
+    defect_df = normalize_dates(defect_df, date_col)
+    if not date_col:
+        logging.warning("no date column in defect table; using all rows for 1-year stats")
+        return defect_df
+    cutoff, end = last_1year_bounds(run_date)
+    dates = defect_df[date_col]
+    return defect_df.loc[(dates >= cutoff) & (dates < end)].copy()
+
+
+LOT_AGGREGATE_KEYS = ["品番", "生産ロットID", "号機", "日付"]
+
+
+def _as_str_keys(s: pd.Series) -> pd.Series:
+    # 欠損は保持したまま文字列化（Parquet に混在型を書かないため）
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype(object)
+    return s.where(s.isna(), s.astype(str))
+
+
+def aggregate_defects_by_lot(defects: pd.DataFrame, defect_cols: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    不具合情報をロット単位（品番, 生産ロットID, 号機, 日付）に集計する。
+    数量・総不具合数に加えて不具合区分ごとの合計も保持する。
+    号機列が無い場合は空文字、日付列がある場合は日付欠損行を除外する。
+    """
+    if defects.empty or "品番" not in defects.columns or "生産ロットID" not in defects.columns:
+        return pd.DataFrame(columns=LOT_AGGREGATE_KEYS + ["数量", "総不具合数"])
+
+    date_col = find_date_column(defects)
+    defects = normalize_dates(defects, date_col)
+    if defect_cols is None:
+        defect_cols = detect_defect_columns(defects)
+    kind_cols = [c for c in defect_cols if c not in LOT_AGGREGATE_KEYS and c != "総不具合数"]
+
+    work = pd.DataFrame({
+        "品番": _as_str_keys(defects["品番"]),
+        "生産ロットID": _as_str_keys(defects["生産ロットID"]),
+        "号機": _as_str_keys(defects["号機"]) if "号機" in defects.columns else "",
+        "日付": defects[date_col] if date_col else pd.NaT,
+        "数量": defects["数量"] if "数量" in defects.columns else 0,
+    }, index=defects.index)
+    if "総不具合数" in defects.columns:
+        work["総不具合数"] = defects["総不具合数"]
+    else:
+        work["総不具合数"] = defects[defect_cols].sum(axis=1) if defect_cols else 0
+    for c in kind_cols:
+        work[c] = defects[c]
+    if date_col:
+        work = work[work["日付"].notna()]
+
+    agg = work.groupby(LOT_AGGREGATE_KEYS, as_index=False, dropna=False)[
+        ["数量", "総不具合数", *kind_cols]
+    ].sum()
+    agg["日付"] = pd.to_datetime(agg["日付"])
+    return agg
+
+
+# プロンプトに載せる直近ロット数（build_trend_summary_from_history の recent_limit と揃える）
+LOT_HISTORY_RECENT_LIMIT = 20
+
+
+@dataclass
+class LotHistory:
+    """品番ごとの過去ロット推移（プロンプトで使う分だけ保持）"""
+    recent_rows: List[Dict[str, object]]  # 直近ロット（古い順）: {生産ロットID, 日付, 号機, 数量, 総不具合数, 不良率}
+    lot_count: int
+    start: str
+    end: str
+    by_year: Dict[str, Dict[str, float]]  # {年: {"qty": 数量合計, "ng": 不良数合計}}
+
+
+def lot_history_from_aggregate(
+    lot_agg: pd.DataFrame,
+    target_hinbans: List[str],
+    recent_limit: int = LOT_HISTORY_RECENT_LIMIT,
+) -> Dict[str, LotHistory]:
+    """
+    aggregate_defects_by_lot の結果から品番ごとのロット推移を作る。
+    返却形式は compute_lot_history と同じ。
+    """
+    if lot_agg.empty:
+        return {}
+    # 生産ロットID / 号機が欠けた集計行は compute_lot_history の groupby と同様に除外する
+    g = lot_agg.loc[
+        lot_agg["品番"].isin(target_hinbans) & lot_agg["号機"].notna() & lot_agg["生産ロットID"].notna()
+    ]
+    if g.empty:
+        return {}
+    g = g.sort_values("日付", kind="mergesort")
+
+    qty = g["数量"].to_numpy(dtype=float)
+    ng = g["総不具合数"].to_numpy(dtype=float)
+    date_str = g["日付"].dt.strftime("%Y-%m-%d").fillna("")
+    rows = pd.DataFrame({
+        "品番": g["品番"].astype(str).to_numpy(),
+        "生産ロットID": g["生産ロットID"].astype(str).to_numpy(),
+        "日付": date_str.to_numpy(),
+        "号機": g["号機"].astype(str).to_numpy(),
+        "数量": qty,
+        "総不具合数": ng,
+        "不良率": np.divide(ng, qty, out=np.zeros_like(ng), where=qty != 0),
+    })
+    rows["年"] = rows["日付"].str[:4].where(rows["日付"] != "", "unknown")
+
+    by_hinban = rows.groupby("品番", sort=False)
+    lot_counts = by_hinban.size().to_dict()
+    dated = rows.loc[rows["日付"] != ""].groupby("品番")["日付"]
+    starts = dated.min().to_dict()
+    ends = dated.max().to_dict()
+    yearly = rows.groupby(["品番", "年"])[["数量", "総不具合数"]].sum()
+
+    by_year: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for (hinban, year), qty_sum, ng_sum in zip(yearly.index, yearly["数量"], yearly["総不具合数"]):
+        by_year.setdefault(hinban, {})[year] = {"qty": float(qty_sum), "ng": float(ng_sum)}
+
+    recent: Dict[str, List[Dict[str, object]]] = {}
+    tail = by_hinban.tail(recent_limit)
+    record_cols = ["生産ロットID", "日付", "号機", "数量", "総不具合数", "不良率"]
+    for hinban, record in zip(tail["品番"], tail[record_cols].to_dict("records")):
+        recent.setdefault(hinban, []).append(record)
+
+    return {
+        hinban: LotHistory(
+            recent_rows=recent.get(hinban, []),
+            lot_count=int(lot_counts[hinban]),
+            start=starts.get(hinban, ""),
+            end=ends.get(hinban, ""),
+            by_year=by_year.get(hinban, {}),
+        )
+        for hinban in lot_counts
+    }
+
+
+def compute_lot_history(defects_3y: pd.DataFrame, target_hinbans: List[str]) -> Dict[str, LotHistory]:
+    """
+    過去1年分のロット単位推移を返す。
+    返却形式: {品番: LotHistory（直近ロット + 期間・ロット数・年次合計）}
+    """
+    if defects_3y.empty or "品番" not in defects_3y.columns or "生産ロットID" not in defects_3y.columns:
+        return {}
+    base = defects_3y[defects_3y["品番"].isin(target_hinbans)]
+    if base.empty:
+        return {}
+    return lot_history_from_aggregate(aggregate_defects_by_lot(base), target_hinbans)
+
+
+def build_trend_table_from_history(history_rows: List[Dict[str, object]], limit: int = 20) -> str:
+    if not history_rows:
+        return "過去ロットなし"
+    rows = history_rows[-limit:]
+    header = "日付, 生産ロットID, 号機, 数量, 不良数, 不良率"
+    lines = [header]
+    for r in rows:
+        lines.append(
+            f"{r.get('日付','')}, {r.get('生産ロットID','')}, {r.get('号機','')}, "
+            f"{int(r.get('数量',0))}, {int(r.get('総不具合数',0))}, {r.get('不良率',0)*100:.2f}%"
+        )
+    return "\n".join(lines)
+
+
+def build_trend_summary_from_history(history: Optional[LotHistory], recent_limit: int = LOT_HISTORY_RECENT_LIMIT) -> str:
+    """
+    過去1年の全体要約 + 直近期ロット表を返す。
+    AIが「直近だけ」と誤解しないよう、期間・ロット数・年次傾向を明示する。
+    """
+    if history is None or not history.lot_count:
+        return "過去1年のロットデータなし"
+
+    year_lines = []
+    for y in sorted(history.by_year.keys()):
+        qty = history.by_year[y]["qty"]
+        ng = history.by_year[y]["ng"]
+        rate = (ng / qty * 100) if qty else 0.0
+        year_lines.append(f"{y}: 検査数{int(qty)} / 不良数{int(ng)} / 不良率{rate:.2f}%")
+
+    recent_table = build_trend_table_from_history(history.recent_rows, limit=recent_limit)
+
+    return "\n".join([
+        f"【過去1年のロット推移 要約】",
+        f"- 期間: {history.start} 〜 {history.end}",
+        f"- ロット数: {history.lot_count}",
+        *[f"- {l}" for l in year_lines],
+        "",
+        f"【直近期{recent_limit}ロットの詳細】",
+        recent_table,
+    ])
+
+
+def build_defect_kind_summary(defects_3y: pd.DataFrame, hinban: str) -> str:
+    if defects_3y.empty or "品番" not in defects_3y.columns:
+        return "不具合区分データなし"
+    sub = defects_3y[defects_3y["品番"].astype(str) == str(hinban)]
+    if sub.empty:
+        return "不具合区分データなし"
+    defect_cols = detect_defect_columns(sub)
+    if not defect_cols:
+        return "不具合区分データなし"
+    return format_defect_kind_summary(sub[defect_cols].sum())
+
+
+def defect_kind_sums_by_hinban(rows: pd.DataFrame) -> Dict[str, pd.Series]:
+    """
+    品番ごとの不具合区分別合計を1回の groupby で求める（品番→区分別件数の Series）。
+    不具合情報の行でもロット集計でもよい。
+    """
+    if rows.empty or "品番" not in rows.columns:
+        return {}
+    defect_cols = detect_defect_columns(rows)
+    if not defect_cols:
+        return {}
+    sums = rows[defect_cols].groupby(rows["品番"].astype(str), sort=False).sum()
+    return {hinban: row for hinban, row in sums.iterrows()}
+
+
+def format_defect_kind_summary(sums: Optional[pd.Series]) -> str:
+    """区分別件数を多い順に最大6件「区分: n件 (割合)」で連結する"""
+    if sums is None or sums.empty:
+        return "不具合区分データなし"
+    sums = sums.sort_values(ascending=False)
+    total = float(sums.sum()) or 1.0
+    parts = []
+    for k, v in sums.head(6).items():
+        if v <= 0:
+            continue
+        parts.append(f"{k}: {int(v)}件 ({v/total:.1%})")
+    return " / ".join(parts) if parts else "不具合区分データなし"
+
+
+# 統計ベースラインの指標列
+BASELINE_COLUMNS = ["ロット数", "平均", "標準偏差", "EWMA", "上位パーセンタイル"]
+
+
+@dataclass
+class LotBaseline:
+    """品番×号機 と 品番全体 の不良率の基準（過去ロットから算出）"""
+    by_machine: pd.DataFrame  # index=(品番, 号機), columns=BASELINE_COLUMNS
+    by_part: pd.DataFrame  # index=品番, columns=BASELINE_COLUMNS
+
+
+def _baseline_stats(frame: pd.DataFrame, keys: List[str], window: int, span: float, percentile: float) -> pd.DataFrame:
+    """keys ごとに直近 window ロットの平均・標準偏差・パーセンタイルと EWMA を求める（古い順に並んでいること）"""
+    if frame.empty:
+        return pd.DataFrame(columns=BASELINE_COLUMNS)
+    recent = frame.groupby(keys, sort=False).tail(window)
+    rates = recent.groupby(keys, sort=False)["不良率"]
+    stats = rates.agg(["count", "mean", "std"])
+    stats.columns = ["ロット数", "平均", "標準偏差"]
+    stats["標準偏差"] = stats["標準偏差"].fillna(0.0)
+    ewma = rates.ewm(span=span).mean()
+    stats["EWMA"] = ewma.groupby(level=list(range(len(keys))), sort=False).last()
+    stats["上位パーセンタイル"] = rates.quantile(percentile)
+    return stats[BASELINE_COLUMNS]
+
+
+def compute_lot_baselines(lot_rows: pd.DataFrame, before: datetime) -> LotBaseline:
+    """
+    before より前のロット（ロット単位集計）から不良率の基準を求める。
+    品番×号機 と 品番全体 について、直近 BASELINE_WINDOW_LOTS ロットの移動平均・標準偏差・
+    上位パーセンタイル（BASELINE_PERCENTILE）と EWMA（BASELINE_EWMA_SPAN）を groupby でまとめて計算する。
+    """
+    window = int(os.environ.get("BASELINE_WINDOW_LOTS", "30"))
+    span = float(os.environ.get("BASELINE_EWMA_SPAN", "10"))
+    percentile = float(os.environ.get("BASELINE_PERCENTILE", "0.95"))
+
+    required = {"品番", "日付", "数量", "総不具合数"}
+    if lot_rows.empty or not required.issubset(lot_rows.columns):
+        empty = pd.DataFrame(columns=BASELINE_COLUMNS)
+        return LotBaseline(by_machine=empty, by_part=empty)
+
+    qty = lot_rows["数量"].to_numpy(dtype=float, na_value=np.nan)
+    ng = lot_rows["総不具合数"].to_numpy(dtype=float, na_value=np.nan)
+    mask = (lot_rows["日付"] < pd.Timestamp(before)).to_numpy() & (qty > 0)
+    hist = pd.DataFrame({
+        "品番": lot_rows["品番"].astype(str).to_numpy()[mask],
+        "号機": (lot_rows["号機"].fillna("").astype(str).to_numpy()[mask] if "号機" in lot_rows.columns else ""),
+        "日付": lot_rows["日付"].to_numpy()[mask],
+        "不良率": np.nan_to_num(ng[mask]) / qty[mask],
+    })
+    hist = hist.sort_values("日付", kind="mergesort")
+    return LotBaseline(
+        by_machine=_baseline_stats(hist, ["品番", "号機"], window, span, percentile),
+        by_part=_baseline_stats(hist, ["品番"], window, span, percentile),
+    )
+
+
+def flag_unusual_lots(summary: pd.DataFrame, baseline: LotBaseline) -> pd.DataFrame:
+    """
+    当日集計の各行（品番・号機・ロット日）を基準と比べ、統計的に異常なものに印を付ける。
+    基準は品番×号機（履歴が BASELINE_MIN_LOTS 未満なら品番全体）。
+    上限 = max(上位パーセンタイル, EWMA + BASELINE_SIGMA × 標準偏差)。
+    不具合があり上限を超える行、または履歴不足で不具合がある行を「要注意」とする。
+    返却: summary と同じ index の DataFrame（要注意, 基準不良率, 上限不良率, 判定）
+    """
+    min_lots = int(os.environ.get("BASELINE_MIN_LOTS", "5"))
+    sigma = float(os.environ.get("BASELINE_SIGMA", "3"))
+    if summary.empty or "品番" not in summary.columns:
+        return pd.DataFrame({"要注意": pd.Series(dtype=bool)}, index=summary.index)
+
+    hinbans = summary["品番"].astype(str).to_numpy()
+    machines = summary["号機"].fillna("").astype(str).to_numpy() if "号機" in summary.columns else np.full(len(summary), "")
+    machine_stats = baseline.by_machine.reindex(pd.MultiIndex.from_arrays([hinbans, machines]))
+    part_stats = baseline.by_part.reindex(pd.Index(hinbans))
+    use_machine = (machine_stats["ロット数"].fillna(0) >= min_lots).to_numpy()
+    use_part = ~use_machine & (part_stats["ロット数"].fillna(0) >= min_lots).to_numpy()
+
+    def pick(col: str) -> np.ndarray:
+        return np.where(use_machine, machine_stats[col].to_numpy(dtype=float), part_stats[col].to_numpy(dtype=float))
+
+    has_base = use_machine | use_part
+    ewma = np.where(has_base, pick("EWMA"), np.nan)
+    upper = np.where(has_base, np.maximum(pick("上位パーセンタイル"), pick("EWMA") + sigma * pick("標準偏差")), np.nan)
+
+    rate = summary["不良率"].to_numpy(dtype=float, na_value=0.0) if "不良率" in summary.columns else np.zeros(len(summary))
+    ng = summary["総不具合数"].to_numpy(dtype=float, na_value=0.0) if "総不具合数" in summary.columns else np.zeros(len(summary))
+    with np.errstate(invalid="ignore"):
+        unusual = (ng > 0) & np.where(has_base, rate > upper, True)
+
+    reason = np.where(
+        ~has_base,
+        "履歴不足",
+        np.where(use_machine, "号機基準", "品番基準"),
+    )
+    return pd.DataFrame({
+        "要注意": unusual,
+        "基準不良率": ewma,
+        "上限不良率": upper,
+        "判定": reason,
+    }, index=summary.index)
+
+
+class DefectDataset:
+    """
+    1回の実行（バックフィルでは期間全体）で使う外観検査集計・不具合情報・製品マスタ。
+
+    日付列の特定・日付の変換・不具合区分列の判定は読み込み時に1回だけ行う。
+    当日ロット・過去1年・ロット集計・品番別の不具合区分合計などのビューは初回参照時に作って保持し、以降は再利用する。
+    ビューは run_date 単位で保持し、別の日を参照すると前の日のビューは破棄する。
+    lot_agg（ロット集計ストア）があれば過去1年の推移・不具合区分はそこから作る。
+    term_worst_state は保存済みの期別ワースト状態（load_term_worst_state）、
+    monthly_cube は保存済みの月次キューブ（無ければ読み込んだロットから作る）。
+    """
+
+    def __init__(
+        self,
+        appearance_df: pd.DataFrame,
+        defect_df: Optional[pd.DataFrame] = None,
+        product_master_df: Optional[pd.DataFrame] = None,
+        lot_agg: Optional[pd.DataFrame] = None,
+    ) -> None:
+        self.appearance_date_col = find_date_column(appearance_df)
+        self.appearance = normalize_dates(appearance_df, self.appearance_date_col)
+        self._views: Dict[str, object] = {}
+        self._views_date: Optional[date] = None
+        self.term_worst_state: Dict[str, object] = {}
+        self.monthly_cube: Optional[pd.DataFrame] = None
+        self.attach_defects(
+            defect_df if defect_df is not None else pd.DataFrame(),
+            product_master_df,
+            lot_agg,
+        )
+
+    def attach_defects(
+        self,
+        defect_df: pd.DataFrame,
+        product_master_df: Optional[pd.DataFrame] = None,
+        lot_agg: Optional[pd.DataFrame] = None,
+    ) -> None:
+        """不具合情報などを後から設定する（当日ロットを先に求めてから不具合情報を読む場合）"""
+        self.defect_date_col = find_date_column(defect_df)
+        self.defects = normalize_dates(defect_df, self.defect_date_col)
+        self.defect_columns = detect_defect_columns(self.defects)
+        self.product_master = product_master_df if product_master_df is not None else pd.DataFrame()
+        self.lot_agg = lot_agg
+        # 外観検査集計だけから作るビュー以外は作り直す
+        self._views = {k: v for k, v in self._views.items() if k in ("today_lots", "today_lots_coded")}
+
+    def _view(self, run_date: datetime, name: str, build: Callable[[], object]):
+        day = run_date.date()
+        if self._views_date != day:
+            self._views = {}
+            self._views_date = day
+        if name not in self._views:
+            self._views[name] = build()
+        return self._views[name]
+
+    def today_lots_coded(self, run_date: datetime) -> pd.DataFrame:
+        """当日ロット（カテゴリ列のまま。不具合情報との照合用）"""
+        return self._view(
+            run_date, "today_lots_coded", lambda: extract_today_lots(self.appearance, run_date, keep_categories=True)
+        )
+
+    def today_lots(self, run_date: datetime) -> pd.DataFrame:
+        return self._view(run_date, "today_lots", lambda: decategorize(self.today_lots_coded(run_date)))
+
+    def today_defects(self, run_date: datetime) -> pd.DataFrame:
+        return self._view(
+            run_date,
+            "today_defects",
+            lambda: join_defects(
+                self.today_lots(run_date),
+                self.defects,
+                today_lot_col=self.today_lots_coded(run_date)["生産ロットID"],
+            ),
+        )
+
+    def last_1year(self, run_date: datetime) -> pd.DataFrame:
+        """過去1年（run_date 当日まで）の行（ロット集計ストアがあればロット単位、なければ不具合情報の行）"""
+        def build() -> pd.DataFrame:
+            if self.lot_agg is not None:
+                cutoff, end = last_1year_bounds(run_date)
+                dates = self.lot_agg["日付"]
+                return self.lot_agg.loc[(dates >= cutoff) & (dates < end)]
+            return filter_last_1year(self.defects, run_date)
+
+        return self._view(run_date, "last_1year", build)
+
+    def lot_rows_1y(self, run_date: datetime) -> pd.DataFrame:
+        """過去1年のロット単位集計"""
+        def build() -> pd.DataFrame:
+            if self.lot_agg is not None:
+                return self.last_1year(run_date)
+            return aggregate_defects_by_lot(self.last_1year(run_date), self.defect_columns)
+
+        return self._view(run_date, "lot_rows_1y", build)
+
+    def lot_history(self, run_date: datetime, hinbans: List[str]) -> Dict[str, LotHistory]:
+        key = "lot_history:" + "\t".join(hinbans)
+        return self._view(run_date, key, lambda: lot_history_from_aggregate(self.lot_rows_1y(run_date), hinbans))
+
+    def term_lot_rows(self, run_date: datetime) -> pd.DataFrame:
+        """期別集計に使うロット単位集計（ストアがあれば保持期間全体、なければ過去1年）"""
+        return self.lot_agg if self.lot_agg is not None else self.lot_rows_1y(run_date)
+
+    def worst_ranking(self, run_date: datetime) -> TermWorstRanking:
+        """run_date の前期のワースト品番"""
+        return self._view(
+            run_date,
+            "worst_ranking",
+            lambda: worst_ranking_for_run(self.term_worst_state, self.term_lot_rows(run_date), run_date),
+        )
+
+    def monthly_rollup(self, run_date: datetime) -> pd.DataFrame:
+        """run_date の月までの月次キューブ"""
+        def build() -> pd.DataFrame:
+            cube = self.monthly_cube if self.monthly_cube is not None else build_monthly_cube(self.term_lot_rows(run_date))
+            if cube.empty:
+                return cube
+            return cube.loc[cube["月"] <= _month_start(run_date)]
+
+        return self._view(run_date, "monthly_rollup", build)
+
+    def lot_baseline(self, run_date: datetime) -> LotBaseline:
+        """run_date より前の1年分のロットから求めた不良率の基準"""
+        day_start = datetime.combine(run_date.date(), datetime.min.time())
+        return self._view(run_date, "lot_baseline", lambda: compute_lot_baselines(self.lot_rows_1y(run_date), day_start))
+
+    def defect_kind_sums(self, run_date: datetime) -> Dict[str, pd.Series]:
+        """過去1年の品番別・不具合区分別合計（ロット集計を品番でまとめ直す）"""
+        return self._view(run_date, "defect_kind_sums", lambda: defect_kind_sums_by_hinban(self.lot_rows_1y(run_date)))
+
+
+# -----------------------------
+# ロット集計ストア（増分更新）
+# -----------------------------
+
+def _get_lot_aggregate_paths(output_dir: str) -> Tuple[Path, Path]:
+    base = Path(output_dir)
+    return base / "defect_lot_aggregate.parquet", base / "defect_lot_aggregate.json"
+
+
+def load_lot_aggregate(output_dir: str) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """
+    保存済みのロット集計とメタ情報（covered_from / high_water_mark）を読み込む。
+    壊れている・存在しない場合は空として扱い、次回更新で作り直す。
+    """
+    data_path, meta_path = _get_lot_aggregate_paths(output_dir)
+    if pyarrow is None or not data_path.exists() or not meta_path.exists():
+        return pd.DataFrame(), {}
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        agg = pd.read_parquet(data_path)
+    except Exception as e:
+        logging.warning("failed to load lot aggregate store; rebuilding: %s", e)
+        return pd.DataFrame(), {}
+    if not isinstance(meta, dict):
+        return pd.DataFrame(), {}
+    return agg, {str(k): str(v) for k, v in meta.items()}
+
+
+def _write_json_atomic(path: Path, obj: object) -> None:
+    """一時ファイルに書いてから置き換える（書き込み途中のファイルを読ませない）"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def save_lot_aggregate(output_dir: str, lot_agg: pd.DataFrame, meta: Dict[str, str]) -> None:
+    data_path, meta_path = _get_lot_aggregate_paths(output_dir)
+    tmp_path = data_path.with_suffix(".parquet.tmp")
+    lot_agg.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, data_path)
+    _write_json_atomic(meta_path, meta)
+
+
+def lot_aggregate_refresh_start(meta: Dict[str, str], cutoff: datetime, run_date: datetime) -> datetime:
+    """
+    今回 Access から読み直す開始日時を返す。
+
+    ストアが cutoff までカバーしていれば high_water_mark から重複期間分だけ遡り、
+    そうでなければ cutoff から作り直す。後から入力・修正されるロットがあるため、
+    直近 LOT_AGGREGATE_OVERLAP_DAYS 日分は毎回再集計する。
+    """
+    overlap_days = int(os.environ.get("LOT_AGGREGATE_OVERLAP_DAYS", "7"))
+    covered_from = pd.to_datetime(meta.get("covered_from"), errors="coerce")
+    high_water_mark = pd.to_datetime(meta.get("high_water_mark"), errors="coerce")
+    if pd.isna(covered_from) or pd.isna(high_water_mark) or covered_from > cutoff:
+        return cutoff
+    since = (high_water_mark - timedelta(days=overlap_days)).to_pydatetime()
+    day_start = datetime.combine(run_date.date(), datetime.min.time())
+    return max(min(since, day_start), cutoff)
+
+
+def update_lot_aggregate(
+    stored: pd.DataFrame,
+    meta: Dict[str, str],
+    fresh: pd.DataFrame,
+    since: datetime,
+    run_date: datetime,
+) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """
+    since 以降のロットを fresh（今回の再集計）で置き換え、保持期間外を削除する。
+    """
+    if not stored.empty and "日付" in stored.columns:
+        kept = stored[stored["日付"] < since]
+        covered_from = pd.to_datetime(meta.get("covered_from"), errors="coerce")
+        if pd.isna(covered_from) or covered_from > since:
+            covered_from = pd.Timestamp(since)
+    else:
+        kept = stored.iloc[0:0]
+        covered_from = pd.Timestamp(since)
+
+    merged = pd.concat([kept, fresh], ignore_index=True) if not kept.empty else fresh.copy()
+    kind_cols = [c for c in merged.columns if c not in LOT_AGGREGATE_KEYS]
+    merged[kind_cols] = merged[kind_cols].fillna(0)
+
+    retention_days = int(os.environ.get("LOT_AGGREGATE_RETENTION_DAYS", str(365 * 3)))
+    retention_cutoff = pd.Timestamp(run_date - timedelta(days=retention_days))
+    merged = merged[merged["日付"] >= retention_cutoff].reset_index(drop=True)
+    covered_from = max(covered_from, retention_cutoff)
+
+    high_water_mark = merged["日付"].max() if not merged.empty else pd.NaT
+    if pd.isna(high_water_mark):
+        high_water_mark = pd.Timestamp(since)
+    new_meta = {
+        "covered_from": covered_from.strftime("%Y-%m-%d %H:%M:%S"),
+        "high_water_mark": pd.Timestamp(high_water_mark).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    return merged, new_meta
+
+
+def lot_aggregate_store_enabled() -> bool:
+    if pyarrow is None:
+        return False
+    return os.environ.get("LOT_AGGREGATE_STORE", "true").lower() in ("true", "1", "yes", "on")
+
+
+def refresh_lot_aggregate(
+    output_dir: str,
+    stored: pd.DataFrame,
+    meta: Dict[str, str],
+    defect_df: pd.DataFrame,
+    since: datetime,
+    run_date: datetime,
+) -> Optional[pd.DataFrame]:
+    """
+    今回読み込んだ不具合情報のうち since 以降をロット集計してストアへ反映し、保存する。
+    日付列が無くストアを日付で管理できない場合は None を返す。
+    """
+    date_col = find_date_column(defect_df)
+    if not date_col:
+        logging.warning("no date column in defect table; lot aggregate store disabled")
+        return None
+    defect_df = normalize_dates(defect_df, date_col)
+    fresh = aggregate_defects_by_lot(defect_df.loc[defect_df[date_col] >= since])
+    lot_agg, new_meta = update_lot_aggregate(stored, meta, fresh, since=since, run_date=run_date)
+    try:
+        save_lot_aggregate(output_dir, lot_agg, new_meta)
+    except Exception as e:
+        logging.warning("failed to save lot aggregate store: %s", e)
+    logging.info(
+        "lot aggregate store: %s new lots since %s, %s lots total (high_water_mark=%s)",
+        len(fresh),
+        f"{since:%Y-%m-%d}",
+        len(lot_agg),
+        new_meta["high_water_mark"],
+    )
+    return lot_agg
+
+
+# -----------------------------
+# 期別ワースト品番ランキング
+# -----------------------------
+
+@dataclass
+class TermWorstRanking:
+    term: TermInfo
+    hinbans: List[str]
+    source: str  # persisted（保存済み）/ computed（今回のロットから算出）/ fixed（固定リスト）
+
+
+def worst_top_n() -> int:
+    return int(os.environ.get("WORST_TOP_N", str(len(FIXED_WORST_41ST_HINBANS))))
+
+
+def _get_term_worst_path(output_dir: str) -> Path:
+    return Path(output_dir) / "term_worst_ranking.json"
+
+
+def load_term_worst_state(output_dir: str) -> Dict[str, object]:
+    """
+    保存済みの期別ワースト状態を読み込む。
+    closed: 締めた期のランキング（期番号 -> {"hinbans": [...]}）
+    current: 当期の品番別合計（確定済みの日付まで）
+    """
+    path = _get_term_worst_path(output_dir)
+    if not path.exists():
+        return {}
+    try:
+        state = json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        logging.warning("failed to load term worst ranking; rebuilding: %s", e)
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def save_term_worst_state(output_dir: str, state: Dict[str, object]) -> None:
+    _write_json_atomic(_get_term_worst_path(output_dir), state)
+
+
+def _lot_rows_start(lot_rows: pd.DataFrame) -> Optional[date]:
+    if lot_rows.empty or "日付" not in lot_rows.columns:
+        return None
+    first = lot_rows["日付"].min()
+    return None if pd.isna(first) else pd.Timestamp(first).date()
+
+
+def term_totals_by_hinban(lot_rows: pd.DataFrame, start: date, end: date) -> pd.DataFrame:
+    """[start, end) のロットを品番別に合計する（index=品番, columns=総不具合数, 数量）"""
+    if lot_rows.empty or not {"品番", "日付", "総不具合数"}.issubset(lot_rows.columns):
+        return pd.DataFrame(columns=["総不具合数", "数量"], dtype=float)
+    rows = lot_rows.loc[(lot_rows["日付"] >= pd.Timestamp(start)) & (lot_rows["日付"] < pd.Timestamp(end))]
+    frame = pd.DataFrame({
+        "品番": rows["品番"].astype(str),
+        "総不具合数": pd.to_numeric(rows["総不具合数"], errors="coerce").fillna(0).astype(float),
+        "数量": pd.to_numeric(rows["数量"], errors="coerce").fillna(0).astype(float) if "数量" in rows.columns else 0.0,
+    })
+    return frame.groupby("品番", sort=False)[["総不具合数", "数量"]].sum()
+
+
+def _merge_totals(totals: Dict[str, List[float]], fresh: pd.DataFrame) -> Dict[str, List[float]]:
+    """品番 -> [総不具合数, 数量] の合計に fresh（term_totals_by_hinban）を加算する"""
+    merged = {str(h): [float(v[0]), float(v[1])] for h, v in totals.items()}
+    for hinban, ng, qty in zip(fresh.index, fresh["総不具合数"].to_numpy(dtype=float), fresh["数量"].to_numpy(dtype=float)):
+        entry = merged.setdefault(str(hinban), [0.0, 0.0])
+        entry[0] += ng
+        entry[1] += qty
+    return merged
+
+
+def rank_worst_hinbans(totals: Dict[str, List[float]], n: int) -> List[str]:
+    """総不具合数の多い順に上位 n 品番を返す（同数は不良率の高い順、不具合なしは除く）"""
+    def key(item: Tuple[str, List[float]]) -> Tuple[float, float]:
+        ng, qty = item[1]
+        return ng, (ng / qty if qty else 0.0)
 
-    # 区分別集計（見やすさ重視で1列にまとめる）- 合算せず最初の値を採用
-    if defect_cols:
-        defects_breakdown = today_defects_df.groupby(group_keys, as_index=False)[defect_cols].first()
-        defects_breakdown["不具合内訳"] = defects_breakdown.apply(
-            lambda r: _summarize_defect_breakdown_row(r, defect_cols),
-            axis=1,
-        )
-        defects_breakdown = defects_breakdown[group_keys + ["不具合内訳"]]
-    else:
-        defects_breakdown = pd.DataFrame(columns=group_keys + ["不具合内訳"])
+    return [hinban for hinban, (ng, _) in heapq.nlargest(n, totals.items(), key=key) if ng > 0]
 
-    # サマリーに内訳を統合
-    summary = summary.merge(defects_breakdown, on=group_keys, how="left")
-    summary["不具合内訳"] = summary["不具合内訳"].fillna("-")
 
-    return summary, defects_breakdown
+def update_term_worst_state(
+    state: Dict[str, object],
+    lot_rows: pd.DataFrame,
+    run_date: datetime,
+) -> Dict[str, object]:
+    """
+    期別ワーストの状態を更新する（日次実行から呼ぶ）。
+
+    当期は確定済み（直近 LOT_AGGREGATE_OVERLAP_DAYS 日より前）のロットを品番別合計へ加算していき、
+    期が替わった時点で前期の合計を締めてランキングを保存する。締めた期は以後再計算しない。
+    前期のランキングが無く、lot_rows が前期全体をカバーしていればロットから求めて保存する。
+    """
+    n = worst_top_n()
+    overlap_days = int(os.environ.get("LOT_AGGREGATE_OVERLAP_DAYS", "7"))
+    closed: Dict[str, object] = dict(state.get("closed") or {})
+    current = state.get("current") if isinstance(state.get("current"), dict) else None
+    data_from = _lot_rows_start(lot_rows)
+    term = get_term_info(run_date.date())
+
+    def covers(day: date) -> bool:
+        return data_from is not None and data_from <= day
+
+    # 期が替わった: 前の期の残り（確定済みの日付以降）を足して締める
+    if current and int(current.get("term", 0)) < term.term_number:
+        old = get_term_info(date.fromisoformat(str(current["term_start"])))
+        settled = date.fromisoformat(str(current["settled_through"]))
+        if str(old.term_number) not in closed and not current.get("partial") and covers(settled):
+            totals = _merge_totals(
+                current.get("totals") or {},
+                term_totals_by_hinban(lot_rows, settled, old.end_date + timedelta(days=1)),
+            )
+            closed[str(old.term_number)] = {"hinbans": rank_worst_hinbans(totals, n), "source": "incremental"}
+            logging.info("closed worst ranking for term %s", old.term_number)
+        current = None
+
+    # 当期の合計を確定済みの日付まで進める（過去日の再実行では当期の状態に触れない）
+    if current is None or int(current.get("term", 0)) == term.term_number:
+        if current is None:
+            current = {
+                "term": term.term_number,
+                "term_start": term.start_date.isoformat(),
+                "settled_through": term.start_date.isoformat(),
+                "totals": {},
+                "partial": False,
+            }
+        settle_until = min(run_date.date() - timedelta(days=overlap_days), term.end_date + timedelta(days=1))
+        settled = date.fromisoformat(str(current["settled_through"]))
+        if settle_until > settled:
+            if covers(settled) and not (current.get("partial") and covers(term.start_date)):
+                totals = _merge_totals(current.get("totals") or {}, term_totals_by_hinban(lot_rows, settled, settle_until))
+            else:
+                # 前回から読み込み範囲が空いている（または期初から読めるようになった）: 読めている分から作り直す
+                totals = _merge_totals({}, term_totals_by_hinban(lot_rows, term.start_date, settle_until))
+                current["partial"] = not covers(term.start_date)
+            current["totals"] = totals
+            current["settled_through"] = settle_until.isoformat()
+            current["hinbans"] = rank_worst_hinbans(totals, n)
 
+    prev = get_previous_term_info(run_date.date())
+    if str(prev.term_number) not in closed and covers(prev.start_date):
+        totals = _merge_totals({}, term_totals_by_hinban(lot_rows, prev.start_date, prev.end_date + timedelta(days=1)))
+        closed[str(prev.term_number)] = {"hinbans": rank_worst_hinbans(totals, n), "source": "computed"}
+        logging.info("computed worst ranking for term %s from lot history", prev.term_number)
 
-def filter_last_1year(defect_df: pd.DataFrame, run_date: datetime) -> pd.DataFrame:
-    date_col = find_date_column(defect_df)
-    defect_df = normalize_dates(defect_df, date_col)
-    if not date_col:
-        logging.warning("no date column in defect table; using all rows for 1-year stats")
-        return defect_df
-    cutoff = run_date - timedelta(days=365 * 1)
-    return defect_df.loc[defect_df[date_col] >= cutoff].copy()
+    return {"closed": closed, "current": current if current is not None else state.get("current")}
 
 
-def compute_lot_history(defects_3y: pd.DataFrame, target_hinbans: List[str]) -> Dict[str, List[Dict[str, object]]]:
+def worst_ranking_for_run(state: Dict[str, object], lot_rows: pd.DataFrame, run_date: datetime) -> TermWorstRanking:
     """
-    過去1年分のロット単位推移を返す。
-    返却形式: {品番: [{生産ロットID, 日付, 号機, 数量, 総不具合数, 不良率}, ...]}
+    run_date のダッシュボードで使うワースト品番（前期のランキング）を返す。
+    保存済み → lot_rows が前期全体をカバーしていれば算出 → 固定リスト の順に使う。
     """
-    if defects_3y.empty or "品番" not in defects_3y.columns or "生産ロットID" not in defects_3y.columns:
-        return {}
+    prev = get_previous_term_info(run_date.date())
+    entry = (state.get("closed") or {}).get(str(prev.term_number))
+    if isinstance(entry, dict) and entry.get("hinbans"):
+        return TermWorstRanking(prev, [str(h) for h in entry["hinbans"]], "persisted")
+
+    data_from = _lot_rows_start(lot_rows)
+    if data_from is not None and data_from <= prev.start_date:
+        totals = _merge_totals({}, term_totals_by_hinban(lot_rows, prev.start_date, prev.end_date + timedelta(days=1)))
+        hinbans = rank_worst_hinbans(totals, worst_top_n())
+        if hinbans:
+            return TermWorstRanking(prev, hinbans, "computed")
+
+    fixed_term = get_term_info(FIRST_TERM_START)
+    if prev.term_number != fixed_term.term_number:
+        logging.info(
+            "worst ranking for term %s not available; using fixed term %s list",
+            prev.term_number,
+            fixed_term.term_number,
+        )
+    return TermWorstRanking(fixed_term, list(FIXED_WORST_41ST_HINBANS), "fixed")
 
-    date_col = find_date_column(defects_3y)
-    defects_3y = normalize_dates(defects_3y, date_col)
-    defect_cols = detect_defect_columns(defects_3y)
 
-    base = defects_3y[defects_3y["品番"].isin(target_hinbans)].copy()
-    if base.empty:
-        return {}
+# -----------------------------
+# 月次ロールアップ（過去3年集計）
+# -----------------------------
 
-    if "総不具合数" in base.columns:
-        base["_defect_total"] = base["総不具合数"]
-    else:
-        base["_defect_total"] = base[defect_cols].sum(axis=1) if defect_cols else 0
+MONTHLY_CUBE_KEYS = ["品番", "号機", "月"]
+# 月数で表す集計単位（年は暦年）
+CUBE_PERIOD_MONTHS = {"month": 1, "quarter": 3, "term": FISCAL_YEAR_MONTHS}
 
-    qty_col = "数量" if "数量" in base.columns else None
-    base["_qty_total"] = base[qty_col] if qty_col else 0
 
-    group_keys = ["品番", "生産ロットID"]
-    if "号機" in base.columns:
-        group_keys.append("号機")
-    if date_col:
-        group_keys.append(date_col)
+def _month_start(value) -> pd.Timestamp:
+    ts = pd.Timestamp(value)
+    return pd.Timestamp(ts.year, ts.month, 1)
 
-    g = base.groupby(group_keys, as_index=False).agg({"_defect_total": "sum", "_qty_total": "sum"})
-    g["不良率"] = g.apply(
-        lambda r: (r["_defect_total"] / r["_qty_total"]) if r["_qty_total"] else 0.0,
-        axis=1,
-    )
-    if date_col:
-        g = g.sort_values(date_col)
-
-    history: Dict[str, List[Dict[str, object]]] = {}
-    for hinban, sub in g.groupby("品番"):
-        rows: List[Dict[str, object]] = []
-        for _, r in sub.iterrows():
-            rows.append({
-                "生産ロットID": str(r["生産ロットID"]),
-                "日付": r[date_col].strftime("%Y-%m-%d") if date_col and pd.notna(r[date_col]) else "",
-                "号機": str(r["号機"]) if "号機" in r else "",
-                "数量": float(r["_qty_total"]),
-                "総不具合数": float(r["_defect_total"]),
-                "不良率": float(r["不良率"]),
-            })
-        history[str(hinban)] = rows
-    return history
 
+def _get_monthly_cube_paths(output_dir: str) -> Tuple[Path, Path]:
+    base = Path(output_dir)
+    return base / "defect_monthly_cube.parquet", base / "defect_monthly_cube.json"
 
-def build_trend_table_from_history(history_rows: List[Dict[str, object]], limit: int = 20) -> str:
-    if not history_rows:
-        return "過去ロットなし"
-    rows = history_rows[-limit:]
-    header = "日付, 生産ロットID, 号機, 数量, 不良数, 不良率"
-    lines = [header]
-    for r in rows:
-        lines.append(
-            f"{r.get('日付','')}, {r.get('生産ロットID','')}, {r.get('号機','')}, "
-            f"{int(r.get('数量',0))}, {int(r.get('総不具合数',0))}, {r.get('不良率',0)*100:.2f}%"
-        )
-    return "\n".join(lines)
+
+def load_monthly_cube(output_dir: str) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """保存済みの月次キューブとメタ情報（first_month / last_month）を読み込む"""
+    data_path, meta_path = _get_monthly_cube_paths(output_dir)
+    if pyarrow is None or not data_path.exists() or not meta_path.exists():
+        return pd.DataFrame(), {}
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        cube = pd.read_parquet(data_path)
+    except Exception as e:
+        logging.warning("failed to load monthly cube; rebuilding: %s", e)
+        return pd.DataFrame(), {}
+    if not isinstance(meta, dict):
+        return pd.DataFrame(), {}
+    return cube, {str(k): str(v) for k, v in meta.items()}
+
+
+def save_monthly_cube(output_dir: str, cube: pd.DataFrame, meta: Dict[str, str]) -> None:
+    data_path, meta_path = _get_monthly_cube_paths(output_dir)
+    tmp_path = data_path.with_suffix(".parquet.tmp")
+    cube.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, data_path)
+    _write_json_atomic(meta_path, meta)
 
 
-def build_trend_summary_from_history(history_rows: List[Dict[str, object]], recent_limit: int = 20) -> str:
+def build_monthly_cube(lot_rows: pd.DataFrame, month_from: Optional[pd.Timestamp] = None) -> pd.DataFrame:
     """
-    過去1年の全体要約 + 直近期ロット表を返す。
-    AIが「直近だけ」と誤解しないよう、期間・ロット数・年次傾向を明示する。
+    ロット集計を（品番, 号機, 月）で合計する（数量・総不具合数・不具合区分ごと）。
+    月は月初の日付。month_from があればその月以降だけを対象にする。
     """
-    if not history_rows:
-        return "過去1年のロットデータなし"
+    if lot_rows.empty or "日付" not in lot_rows.columns:
+        return pd.DataFrame(columns=MONTHLY_CUBE_KEYS + ["数量", "総不具合数"])
+    value_cols = [c for c in lot_rows.columns if c not in LOT_AGGREGATE_KEYS]
+    months = lot_rows["日付"].dt.to_period("M").dt.to_timestamp()
+    mask = (months >= month_from).to_numpy() if month_from is not None else np.ones(len(lot_rows), dtype=bool)
+    work = lot_rows.loc[mask, ["品番", "号機", *value_cols]]
+    work.insert(2, "月", months[mask])
+    return work.groupby(MONTHLY_CUBE_KEYS, as_index=False, dropna=False, sort=True)[value_cols].sum()
 
-    # 全体期間
-    dates = [r.get("日付") for r in history_rows if r.get("日付")]
-    start = min(dates) if dates else ""
-    end = max(dates) if dates else ""
-    lot_count = len(history_rows)
-
-    # 年次要約
-    by_year: Dict[str, Dict[str, float]] = {}
-    for r in history_rows:
-        d = r.get("日付") or ""
-        y = str(d)[:4] if d else "unknown"
-        by_year.setdefault(y, {"qty": 0.0, "ng": 0.0})
-        by_year[y]["qty"] += float(r.get("数量", 0) or 0)
-        by_year[y]["ng"] += float(r.get("総不具合数", 0) or 0)
 
-    year_lines = []
-    for y in sorted(by_year.keys()):
-        qty = by_year[y]["qty"]
-        ng = by_year[y]["ng"]
-        rate = (ng / qty * 100) if qty else 0.0
-        year_lines.append(f"{y}: 検査数{int(qty)} / 不良数{int(ng)} / 不良率{rate:.2f}%")
+def monthly_cube_refresh_from(meta: Dict[str, str], lot_rows: pd.DataFrame, run_date: datetime) -> pd.Timestamp:
+    """
+    今回集計し直す最初の月を返す。
 
-    recent_table = build_trend_table_from_history(history_rows, limit=recent_limit)
+    通常は当月だけ（月初から LOT_AGGREGATE_OVERLAP_DAYS 日以内は後から修正される前月も）。
+    保存済みの最終月より後に抜けている月があればそこから、キューブが無ければ
+    lot_rows の最初の丸1か月から作る。
+    """
+    overlap_days = int(os.environ.get("LOT_AGGREGATE_OVERLAP_DAYS", "7"))
+    current = _month_start(run_date - timedelta(days=overlap_days))
+    data_from = _lot_rows_start(lot_rows)
+    first_full = current
+    if data_from is not None:
+        first_full = _month_start(data_from)
+        if data_from.day != 1:
+            first_full += pd.DateOffset(months=1)
+    last_month = pd.to_datetime(meta.get("last_month"), errors="coerce")
+    if pd.isna(last_month):
+        return first_full
+    return max(min(current, last_month + pd.DateOffset(months=1)), first_full)
+
+
+def update_monthly_cube(
+    stored: pd.DataFrame,
+    fresh: pd.DataFrame,
+    refresh_from: pd.Timestamp,
+    run_date: datetime,
+) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """refresh_from 以降の月を fresh で置き換え、CUBE_RETENTION_MONTHS か月より前を削除する"""
+    if not stored.empty and "月" in stored.columns:
+        kept = stored[stored["月"] < refresh_from]
+    else:
+        kept = stored.iloc[0:0]
+    cube = pd.concat([kept, fresh], ignore_index=True) if not kept.empty else fresh.copy()
+    value_cols = [c for c in cube.columns if c not in MONTHLY_CUBE_KEYS]
+    cube[value_cols] = cube[value_cols].fillna(0)
+
+    retention_months = int(os.environ.get("CUBE_RETENTION_MONTHS", "36"))
+    retention_cutoff = _month_start(run_date) - pd.DateOffset(months=retention_months)
+    cube = cube[cube["月"] >= retention_cutoff].reset_index(drop=True)
+
+    meta: Dict[str, str] = {}
+    if not cube.empty:
+        meta = {
+            "first_month": f"{cube['月'].min():%Y-%m-%d}",
+            "last_month": f"{cube['月'].max():%Y-%m-%d}",
+        }
+    return cube, meta
+
+
+def refresh_monthly_cube(output_dir: str, lot_rows: pd.DataFrame, run_date: datetime) -> pd.DataFrame:
+    """保存済みキューブの当月分（と抜けている月）だけをロット集計から作り直して保存する"""
+    stored, meta = load_monthly_cube(output_dir)
+    refresh_from = monthly_cube_refresh_from(meta, lot_rows, run_date)
+    fresh = build_monthly_cube(lot_rows, refresh_from)
+    cube, new_meta = update_monthly_cube(stored, fresh, refresh_from, run_date)
+    try:
+        save_monthly_cube(output_dir, cube, new_meta)
+    except Exception as e:
+        logging.warning("failed to save monthly cube: %s", e)
+    logging.info(
+        "monthly cube: %s rows refreshed from %s, %s rows total",
+        len(fresh),
+        f"{refresh_from:%Y-%m}",
+        len(cube),
+    )
+    return cube
 
-    return "\n".join([
-        f"【過去1年のロット推移 要約】",
-        f"- 期間: {start} 〜 {end}",
-        f"- ロット数: {lot_count}",
-        *[f"- {l}" for l in year_lines],
-        "",
-        f"【直近期{recent_limit}ロットの詳細】",
-        recent_table,
-    ])
 
+def rollup_monthly_cube(cube: pd.DataFrame, period: str = "quarter", by: Tuple[str, ...] = ("品番",)) -> pd.DataFrame:
+    """
+    月次キューブを 月（month）/ 四半期（quarter）/ 期（term）/ 暦年（year）単位にまとめ直す。
+    四半期・期は期初（FIRST_TERM_START の月）基準で、ラベルは「42期Q1」「42期」。
+    返却列: *by, 期間, 期間開始, 数量, 総不具合数, 不良率, 不具合区分…
+    """
+    value_cols = [c for c in cube.columns if c not in MONTHLY_CUBE_KEYS]
+    if cube.empty:
+        return pd.DataFrame(columns=[*by, "期間", "期間開始", *value_cols, "不良率"])
+
+    # ラベルは月のユニーク値だけで計算してから割り当てる
+    months = pd.DatetimeIndex(pd.to_datetime(cube["月"]).unique())
+    if period == "year":
+        starts = pd.DatetimeIndex(pd.to_datetime({"year": months.year, "month": 1, "day": 1}))
+        labels = [f"{s.year}年" for s in starts]
+    else:
+        span = CUBE_PERIOD_MONTHS[period]
+        months_diff = (months.year - FIRST_TERM_START.year) * 12 + (months.month - FIRST_TERM_START.month)
+        total = months.year * 12 + (months.month - 1) - months_diff % span
+        starts = pd.DatetimeIndex(pd.to_datetime({"year": total // 12, "month": total % 12 + 1, "day": 1}))
+        start_diff = months_diff - months_diff % span
+        terms = FIRST_TERM_NUMBER + start_diff // FISCAL_YEAR_MONTHS
+        if period == "quarter":
+            labels = [f"{t}期Q{q}" for t, q in zip(terms, (start_diff % FISCAL_YEAR_MONTHS) // 3 + 1)]
+        elif period == "term":
+            labels = [f"{t}期" for t in terms]
+        else:
+            labels = [f"{s:%Y-%m}" for s in starts]
+
+    start_of = pd.Series(starts, index=months)
+    label_of = pd.Series(labels, index=months)
+    work = cube[[*by, *value_cols]].copy()
+    month_values = pd.to_datetime(cube["月"])
+    work["期間開始"] = month_values.map(start_of).to_numpy()
+    work["期間"] = month_values.map(label_of).to_numpy()
+    rolled = work.groupby([*by, "期間開始", "期間"], as_index=False, dropna=False, sort=True)[value_cols].sum()
+    qty = rolled["数量"].to_numpy(dtype=float)
+    ng = rolled["総不具合数"].to_numpy(dtype=float)
+    rolled["不良率"] = np.divide(ng, qty, out=np.zeros_like(ng), where=qty != 0)
+    return rolled
+
+
+def build_quarterly_trend(
+    cube: pd.DataFrame,
+    hinbans: List[str],
+    run_date: datetime,
+) -> Tuple[List[str], List[Dict[str, object]]]:
+    """
+    過去3年サマリ（HTML用）: 指定品番と全品番合計の四半期別の数量・不良数・不良率。
+    返却: (四半期ラベル（古い順）, [{品番, 四半期: [{数量, 総不具合数, 不良率} or None, ...]}])
+    """
+    if cube.empty:
+        return [], []
+    years = int(os.environ.get("TREND_YEARS", "3"))
+    last_month = _month_start(run_date)
+    # 当四半期を含む直近 4×years 四半期（先頭が四半期の途中から始まらないように揃える）
+    months_diff = (last_month.year - FIRST_TERM_START.year) * 12 + (last_month.month - FIRST_TERM_START.month)
+    first_month = last_month - pd.DateOffset(months=months_diff % 3 + 3 * (4 * years - 1))
+    window = cube.loc[(cube["月"] >= first_month) & (cube["月"] <= last_month)]
+    if window.empty:
+        return [], []
+
+    by_part = rollup_monthly_cube(window.loc[window["品番"].isin(hinbans)], "quarter")
+    overall = rollup_monthly_cube(window.assign(品番="全品番"), "quarter")
+    quarters = overall.sort_values("期間開始")[["期間開始", "期間"]]
+    labels = quarters["期間"].tolist()
+
+    def cells(frame: pd.DataFrame) -> List[Optional[Dict[str, float]]]:
+        values = frame.set_index("期間開始")
+        result: List[Optional[Dict[str, float]]] = []
+        for start in quarters["期間開始"]:
+            if start not in values.index:
+                result.append(None)
+                continue
+            row = values.loc[start]
+            result.append({"数量": float(row["数量"]), "総不具合数": float(row["総不具合数"]), "不良率": float(row["不良率"])})
+        return result
 
-def build_defect_kind_summary(defects_3y: pd.DataFrame, hinban: str) -> str:
-    if defects_3y.empty or "品番" not in defects_3y.columns:
-        return "不具合区分データなし"
-    sub = defects_3y[defects_3y["品番"].astype(str) == str(hinban)].copy()
-    if sub.empty:
-        return "不具合区分データなし"
-    defect_cols = detect_defect_columns(sub)
-    if not defect_cols:
-        return "不具合区分データなし"
-    sums = sub[defect_cols].sum().sort_values(ascending=False)
-    total = float(sums.sum()) or 1.0
-    parts = []
-    for k, v in sums.head(6).items():
-        if v <= 0:
-            continue
-        parts.append(f"{k}: {int(v)}件 ({v/total:.1%})")
-    return " / ".join(parts) if parts else "不具合区分データなし"
+    grouped = {str(h): g for h, g in by_part.groupby("品番", sort=False)}
+    rows = [{"品番": h, "四半期": cells(grouped[h])} for h in hinbans if h in grouped]
+    rows.append({"品番": "全品番", "四半期": cells(overall)})
+    return labels, rows
 
 
 # -----------------------------
@@ -974,6 +3259,11 @@ INLINE_TEMPLATE = r"""
       border: 1px solid #bbf7d0;
       color: #16a34a;
     }
+    .section-header.trend { 
+      background: #eff6ff;
+      border: 1px solid #bfdbfe;
+      color: #1d4ed8;
+    }
     .section-sub {
       font-size: 11px;
       font-weight: 500;
@@ -1041,6 +3331,18 @@ INLINE_TEMPLATE = r"""
       font-size: 13px;
     }
     .lot-date { color: #64748b; font-size: 13px; margin-right: 6px; }
+    .lot-alert {
+      display: inline-block;
+      margin-right: 6px;
+      padding: 0 6px;
+      border-radius: 4px;
+      background: #fef2f2;
+      border: 1px solid #fca5a5;
+      color: #dc2626;
+      font-size: 11px;
+      font-weight: 700;
+      line-height: 1.6;
+    }
     .lot-qty, .lot-ng, .lot-rate { color: #475569; font-size: 13px; }
     .lot-breakdown { color: #475569; font-size: 13px; }
     .lot-qty.red, .lot-ng.red, .lot-rate.red, .lot-breakdown.red { 
@@ -1117,6 +3419,14 @@ INLINE_TEMPLATE = r"""
     }
     .ai-content br { display: block; margin-bottom: 2px; }
     
+    /* ========== 過去3年サマリ ========== */
+    .trend-scroll { overflow-x: auto; }
+    table.trend { font-size: 13px; }
+    table.trend th, table.trend td { padding: 8px 8px; white-space: nowrap; }
+    table.trend th:first-child, table.trend td:first-child { text-align: left; }
+    table.trend tr.total td { font-weight: 600; background: #f8fafc; }
+    .trend-ng { color: #94a3b8; font-size: 11px; }
+
     /* ========== その他 ========== */
     .grid { display: grid; grid-template-columns: 1fr 1fr; gap: 16px; }
     .muted { 
@@ -1207,7 +3517,7 @@ INLINE_TEMPLATE = r"""
       {% if worst_today_summary %}
       <div class="section-header worst">
         <span class="icon">⚠</span>
-        <span>41期ワースト製品（{{ run_date_short }}分）</span>
+        <span>{{ worst_term_number }}期ワースト製品（{{ run_date_short }}分）</span>
         <span class="section-sub">重点監視対象</span>
       </div>
       <table class="summary">
@@ -1240,6 +3550,7 @@ INLINE_TEMPLATE = r"""
                   {% set lot_has_ng = (lot["不良率"]|float) > 0.01 %}
                   <li class="{{ '' if lot_has_ng else 'no-defect' }}">
                     <span class="lot-tag">{{ lot["号機"] }}</span>
+                    {% if lot.get("要注意") %}<span class="lot-alert" title="{{ lot.get('判定', '') }}">要注意</span>{% endif %}
                     <span class="lot-date">{{ lot["ロット日"] if lot["ロット日"] else "" }}</span>
                     <span class="lot-qty {{ 'red' if lot_has_ng else '' }}">数量{{ "{:,.0f}".format(lot["数量"]) }}</span>
                     <span class="lot-ng {{ 'red' if lot_has_ng else '' }}">不良{{ "{:,.0f}".format(lot["総不具合数"]) }}</span>
@@ -1256,7 +3567,8 @@ INLINE_TEMPLATE = r"""
           {% set has_ai = ai_comments.get(hinban_key) %}
           <tr class="ai-row">
             <td colspan="7">
-              <div class="ai-comment {{ 'empty' if not has_ai else '' }}"><span class="ai-title">{% if has_ai %}✨ {% endif %}AI分析</span><span class="ai-content">{% if has_ai %}{{ has_ai }}{% else %}-{% endif %}</span></div>
+              <div class="ai-comment {{ 'empty' if not has_ai else '' }}"><span class="ai-title">{% if hinban_key in local_comments %}📐 自動判定{% else %}{% if has_ai %}✨ {% endif %}AI分析{% endif %}</span><span class="ai-content">{% if hinban_key in ai_pending %}生成待ち（持ち時間超過）{% if has_ai %}
+{{ has_ai }}{% endif %}{% elif has_ai %}{{ has_ai }}{% elif row.get("要注意") is sameas false %}過去1年の基準範囲内のため省略{% else %}-{% endif %}</span></div>
             </td>
           </tr>
           {% endfor %}
@@ -1300,6 +3612,7 @@ INLINE_TEMPLATE = r"""
                   {% set lot_has_ng = (lot["不良率"]|float) > 0.01 %}
                   <li class="{{ '' if lot_has_ng else 'no-defect' }}">
                     <span class="lot-tag">{{ lot["号機"] }}</span>
+                    {% if lot.get("要注意") %}<span class="lot-alert" title="{{ lot.get('判定', '') }}">要注意</span>{% endif %}
                     <span class="lot-date">{{ lot["ロット日"] if lot["ロット日"] else "" }}</span>
                     <span class="lot-qty {{ 'red' if lot_has_ng else '' }}">数量{{ "{:,.0f}".format(lot["数量"]) }}</span>
                     <span class="lot-ng {{ 'red' if lot_has_ng else '' }}">不良{{ "{:,.0f}".format(lot["総不具合数"]) }}</span>
@@ -1316,7 +3629,8 @@ INLINE_TEMPLATE = r"""
           {% set has_ai = ai_comments.get(hinban_key) %}
           <tr class="ai-row">
             <td colspan="7">
-              <div class="ai-comment {{ 'empty' if not has_ai else '' }}"><span class="ai-title">{% if has_ai %}✨ {% endif %}AI分析</span><span class="ai-content">{% if has_ai %}{{ has_ai }}{% else %}-{% endif %}</span></div>
+              <div class="ai-comment {{ 'empty' if not has_ai else '' }}"><span class="ai-title">{% if hinban_key in local_comments %}📐 自動判定{% else %}{% if has_ai %}✨ {% endif %}AI分析{% endif %}</span><span class="ai-content">{% if hinban_key in ai_pending %}生成待ち（持ち時間超過）{% if has_ai %}
+{{ has_ai }}{% endif %}{% elif has_ai %}{{ has_ai }}{% elif row.get("要注意") is sameas false %}過去1年の基準範囲内のため省略{% else %}-{% endif %}</span></div>
             </td>
           </tr>
           {% endfor %}
@@ -1324,7 +3638,43 @@ INLINE_TEMPLATE = r"""
       </table>
       <div class="muted">ワースト製品: {{ worst_lot_count }}ロット（不具合なし含む） / サマリー: {{ normal_lot_count }}ロット（不良率1%超）</div>
       <div class="muted" style="font-size:11px;">※AIコメントの不良率は1%未満のロットも含む全ロット合計で計算しています（カード表示は不良率1%以上のロットのみ）。</div>
+      {% if ai_status %}<div class="muted" style="font-size:11px; border-top:none; margin-top:0; padding-top:0;">※{{ ai_status }}</div>{% endif %}
+    </div>
+
+    {% if quarterly_trend_rows %}
+    <div class="card">
+      <div class="section-header trend">
+        <span class="icon">📈</span>
+        <span>過去3年サマリ（四半期別不良率）</span>
+        <span class="section-sub">{{ worst_term_number }}期ワースト製品・全品番合計</span>
+      </div>
+      <div class="trend-scroll">
+        <table class="trend">
+          <thead>
+            <tr>
+              <th>品番</th>
+              {% for label in quarterly_trend_labels %}<th>{{ label }}</th>{% endfor %}
+            </tr>
+          </thead>
+          <tbody>
+            {% for row in quarterly_trend_rows %}
+            <tr class="{{ 'total' if loop.last else '' }}">
+              <td class="left key">{{ row["品番"] }}</td>
+              {% for cell in row["四半期"] %}
+              <td class="num">
+                {% if cell %}
+                  <span class="rate-text {{ 'red' if cell['不良率'] > 0.01 else '' }}">{{ "{:.2%}".format(cell["不良率"]) }}</span>
+                  <div class="trend-ng">不良{{ "{:,.0f}".format(cell["総不具合数"]) }} / {{ "{:,.0f}".format(cell["数量"]) }}</div>
+                {% else %}-{% endif %}
+              </td>
+              {% endfor %}
+            </tr>
+            {% endfor %}
+          </tbody>
+        </table>
+      </div>
     </div>
+    {% endif %}
 
   </main>
   <footer>不具合分析ダッシュボード | by ARAI Precision Digital Innovation Promotion Department</footer>
@@ -1434,26 +3784,536 @@ def send_html_to_araichat(html: str, file_name: str, run_date: datetime, output_
                 raise
 
 
-def generate_dashboard(run_date: datetime, cfg: Config) -> bool:
-    if load_dotenv is not None:
-        load_dotenv()
-    setup_logging(cfg.output_dir)
+def _format_lot_dates(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.strftime("%m/%d").fillna("")
 
-    appearance_df = read_access_table(cfg.appearance_db_path, cfg.appearance_table)
+    def fmt(v: object) -> str:
+        if pd.isna(v) or v == "":
+            return ""
+        return v.strftime("%m/%d") if hasattr(v, "strftime") else str(v)
 
-    # run_date（デフォルト: 昨日）対象のロットを抽出
-    today_lots_df = extract_today_lots(appearance_df, run_date)
-    target_lot_count = int(today_lots_df["生産ロットID"].dropna().nunique())
-    if target_lot_count == 0:
-        logging.info("no lots found for run_date=%s; skip html generation", run_date.date())
-        return False
+    return values.map(fmt)
+
+
+def group_summary_by_hinban(df: pd.DataFrame) -> List[Dict[str, object]]:
+    """
+    品番単位にまとめて「ロット一覧」を作る（ロットは不良率高い順、品番は不良率合計高い順）。
+    """
+    if df.empty or "品番" not in df.columns:
+        return []
+    df = df.loc[df["品番"].notna()]
+    if df.empty:
+        return []
+    df = df.sort_values(["品番", "不良率"], ascending=[True, False], kind="mergesort")
+
+    def num(col: str) -> pd.Series:
+        return df[col].astype(float) if col in df.columns else pd.Series(0.0, index=df.index)
+
+    lots = pd.DataFrame({
+        "号機": df["号機"].astype(str) if "号機" in df.columns else "",
+        "ロット日": _format_lot_dates(df["指示日"]) if "指示日" in df.columns else "",
+        "数量": num("数量"),
+        "総不具合数": num("総不具合数"),
+        "不良率": num("不良率"),
+        "不具合内訳": df["不具合内訳"].astype(str) if "不具合内訳" in df.columns else "-",
+    }, index=df.index)
+    if "要注意" in df.columns:
+        lots["要注意"] = df["要注意"].fillna(False).astype(bool)
+        lots["判定"] = df["判定"].astype(str) if "判定" in df.columns else ""
+
+    lot_lists: Dict[object, List[Dict[str, object]]] = {}
+    for hinban, record in zip(df["品番"], lots.to_dict("records")):
+        lot_lists.setdefault(hinban, []).append(record)
+
+    totals = lots[["数量", "総不具合数"]].groupby(df["品番"], sort=False).sum()
+    firsts = df.drop_duplicates(subset=["品番"], keep="first").set_index("品番")
+    qty_total = totals["数量"].to_numpy()
+    ng_total = totals["総不具合数"].to_numpy()
+    rate_total = np.divide(ng_total, qty_total, out=np.zeros_like(ng_total), where=qty_total != 0)
+    flagged = lots["要注意"].groupby(df["品番"], sort=False).any() if "要注意" in lots.columns else None
+
+    rows: List[Dict[str, object]] = []
+    for hinban, qty, ng, rate in zip(totals.index, qty_total, ng_total, rate_total):
+        first = firsts.loc[hinban]
+        rows.append({
+            "品番": str(hinban),
+            "品名": str(first.get("品名", "")),
+            "客先名": str(first.get("客先名", "")),
+            "数量合計": float(qty),
+            "総不具合数合計": float(ng),
+            "不良率合計": float(rate),
+            "ロット一覧": lot_lists[hinban],
+            "要注意": bool(flagged[hinban]) if flagged is not None else None,
+        })
+    # 品番単位の並びも不良率合計高い順
+    rows.sort(key=lambda x: x.get("不良率合計", 0), reverse=True)
+    return rows
+
+
+def run_batched_ai_comment_jobs(
+    jobs: List[AiCommentJob],
+    model_name: str,
+    limiter: GeminiRateLimiter,
+    max_workers: int,
+    on_result: Callable[[AiCommentJob, str], None],
+    batch_size: int,
+    use_anonymization: bool = True,
+    generate: Callable[..., str] = generate_worst_part_comment,
+    budget: Optional[AiStageBudget] = None,
+    on_late_result: Optional[Callable[[AiCommentJob, str], None]] = None,
+) -> List[AiCommentJob]:
+    """
+    batch_size 件ずつ1リクエストにまとめて生成し、品番キーで分割して on_result に渡す。
+    応答に含まれなかった（リクエスト失敗・解析できなかった・期限内に返らなかった）ジョブを返す。
+    """
+    members: Dict[str, Dict[str, AiCommentJob]] = {}
+    batch_jobs: List[AiCommentJob] = []
+    for i in range(0, len(jobs), batch_size):
+        keyed: Dict[str, AiCommentJob] = {}
+        for job in jobs[i:i + batch_size]:
+            key = anonymize_for_gemini(job.hinban, "", "", use_anonymization)[0]
+            while key in keyed:
+                key += "_"
+            keyed[key] = job
+        batch_id = f"batch-{i // batch_size + 1}"
+        members[batch_id] = keyed
+        prompt = build_batch_prompt({k: j.prompt for k, j in keyed.items()})
+        batch_jobs.append(AiCommentJob(hinban=batch_id, prompt=prompt, cache_key=""))
+
+    missing: Dict[str, AiCommentJob] = {job.hinban: job for job in jobs}
+
+    def split_batch(batch_job: AiCommentJob, text: str, deliver: Callable[[AiCommentJob, str], None]) -> None:
+        parsed = _parse_batch_response(text)
+        for key, job in members[batch_job.hinban].items():
+            comment = parsed.get(key)
+            if comment:
+                deliver(job, comment)
+                missing.pop(job.hinban, None)
+
+    def on_batch(batch_job: AiCommentJob, text: str) -> None:
+        split_batch(batch_job, text, on_result)
+
+    def on_late_batch(batch_job: AiCommentJob, text: str) -> None:
+        split_batch(batch_job, text, on_late_result)
+
+    def on_batch_error(batch_job: AiCommentJob, error: Exception) -> None:
+        # まとめたリクエスト自体が失敗した場合、メンバーは missing に残し個別リクエストで投げ直す
+        logging.warning(
+            "batched Gemini request %s failed; retrying its %s parts individually",
+            batch_job.hinban,
+            len(members[batch_job.hinban]),
+        )
+
+    def generate_json(prompt: str, name: Optional[str]) -> str:
+        return generate(prompt, name, generation_config={"response_mime_type": "application/json"})
+
+    run_ai_comment_jobs(
+        batch_jobs,
+        model_name=model_name,
+        limiter=limiter,
+        max_workers=max_workers,
+        on_result=on_batch,
+        generate=generate_json,
+        budget=budget,
+        on_late_result=on_late_batch if on_late_result is not None else None,
+        on_error=on_batch_error,
+    )
+    if missing:
+        logging.info("batched Gemini requests missed %s parts; falling back to per-part requests", len(missing))
+    return list(missing.values())
+
+
+def _resolve_ai_jobs(
+    prompts: Dict[str, str],
+    cache: GeminiCommentCache,
+    model_name: str,
+    run_date: datetime,
+    max_workers: int,
+    limiter: GeminiRateLimiter,
+    batch_size: int = 1,
+    use_anonymization: bool = True,
+    budget: Optional[AiStageBudget] = None,
+) -> Tuple[Dict[str, str], List[str]]:
+    """
+    品番→プロンプトをキャッシュ参照のうえ、未生成分だけ Gemini に投げて結果を返す。
+    batch_size > 1 なら複数品番を1リクエストにまとめ、欠けた分だけ個別に投げ直す。
+    返却: (品番→コメント, budget の期限内に生成できなかった品番)
+    """
+    results: Dict[str, str] = {}
+    jobs: List[AiCommentJob] = []
+    for hinban, prompt in prompts.items():
+        cache_key = _gemini_cache_key(model_name, prompt)
+        cached = cache.get(cache_key)
+        if cached:
+            # キャッシュヒットは API を呼ばないので待機も不要
+            results[hinban] = cached
+        else:
+            jobs.append(AiCommentJob(hinban=hinban, prompt=prompt, cache_key=cache_key))
+
+    def on_comment(job: AiCommentJob, comment: str) -> None:
+        results[job.hinban] = comment
+        cache.put(job.cache_key, comment, run_date=run_date, hinban=job.hinban)
+
+    def on_late_comment(job: AiCommentJob, comment: str) -> None:
+        # 期限後に返ってきた分は今回のHTMLには載せず、同じ日の再実行のためにキャッシュだけする
+        cache.put(job.cache_key, comment, run_date=run_date, hinban=job.hinban)
+
+    logging.info(
+        "Gemini requests: %s cached, %s to generate (workers=%s, batch_size=%s)",
+        len(prompts) - len(jobs),
+        len(jobs),
+        max_workers,
+        batch_size,
+    )
+    if batch_size > 1 and len(jobs) > 1:
+        jobs = run_batched_ai_comment_jobs(
+            jobs,
+            model_name=model_name,
+            limiter=limiter,
+            max_workers=max_workers,
+            on_result=on_comment,
+            batch_size=batch_size,
+            use_anonymization=use_anonymization,
+            budget=budget,
+            on_late_result=on_late_comment,
+        )
+    pending = run_ai_comment_jobs(
+        jobs,
+        model_name=model_name,
+        limiter=limiter,
+        max_workers=max_workers,
+        on_result=on_comment,
+        budget=budget,
+        on_late_result=on_late_comment,
+    )
+    return results, [job.hinban for job in pending]
+
+
+# -----------------------------
+# ルールベースのローカルコメント
+# -----------------------------
+
+# 不具合区分名に含まれる語 → 対策（上から順に判定）
+LOCAL_COUNTERMEASURES: List[Tuple[Tuple[str, ...], str]] = [
+    (("ネジ", "ﾈｼﾞ"), "ネジゲージでの確認頻度を上げ、タップ・チェーザの摩耗を確認する。"),
+    (("寸", "径", "穴大", "穴小", "ゲージ", "形状", "段差", "溝", "幅", "厚"), "寸法測定の頻度を上げ、刃具摩耗と補正値を確認する。"),
+    (("キズ", "傷", "ｷｽﾞ", "打痕", "圧痕", "落下", "ツブレ", "こすれ", "ボッチ"), "搬送・段取り時の取扱いと治具の当たり面を点検する。"),
+    (("バリ", "ﾊﾞﾘ", "毟れ", "ムシレ", "ﾑｼﾚ", "挽目", "面粗", "切粉", "ボケ"), "刃具の状態と切削条件（送り・回転数）を確認する。"),
+    (("サビ", "汚れ", "変色", "シミ", "メッキ", "フクレ", "異物", "バレル"), "洗浄・防錆・保管状態とメッキ・バレル工程の管理状態を確認する。"),
+    (("偏心", "振れ", "同軸"), "チャッキングとセンタリングを点検する。"),
+]
+LOCAL_DEFAULT_COUNTERMEASURE = "発生工程を特定し、初品・中間検査での確認を強化する。"
+
+
+def ai_comment_mode() -> str:
+    """
+    AI_COMMENT_MODE:
+    auto（既定）: Gemini で生成し、生成できなかった品番はローカルの自動判定で補う
+    gemini: Gemini のみ / local: ネットワークを使わずローカルの自動判定のみ
+    """
+    mode = os.environ.get("AI_COMMENT_MODE", "auto").strip().lower()
+    return mode if mode in ("auto", "gemini", "local") else "auto"
+
+
+def _local_countermeasure(kind: str) -> str:
+    for words, measure in LOCAL_COUNTERMEASURES:
+        if any(w in kind for w in words):
+            return measure
+    return LOCAL_DEFAULT_COUNTERMEASURE
+
+
+def _kind_matrix(rows: pd.DataFrame, kind_cols: List[str], hinbans: pd.Index) -> np.ndarray:
+    """品番×不具合区分の件数行列（hinbans の順、無い品番は 0）"""
+    if rows.empty or not kind_cols or "品番" not in rows.columns:
+        return np.zeros((len(hinbans), len(kind_cols)))
+    sums = rows[kind_cols].groupby(rows["品番"].astype(str), sort=False).sum()
+    return sums.reindex(index=hinbans, fill_value=0).to_numpy(dtype=float, na_value=0.0)
+
+
+def _qty_ng_by_hinban(rows: pd.DataFrame, hinbans: pd.Index) -> Tuple[np.ndarray, np.ndarray]:
+    if rows.empty or not {"品番", "数量", "総不具合数"}.issubset(rows.columns):
+        return np.zeros(len(hinbans)), np.zeros(len(hinbans))
+    values = rows[["数量", "総不具合数"]].apply(pd.to_numeric, errors="coerce").fillna(0)
+    sums = values.groupby(rows["品番"].astype(str), sort=False).sum().reindex(hinbans, fill_value=0)
+    return sums["数量"].to_numpy(dtype=float), sums["総不具合数"].to_numpy(dtype=float)
+
+
+def _rate(ng: np.ndarray, qty: np.ndarray) -> np.ndarray:
+    return np.divide(ng, qty, out=np.zeros_like(ng), where=qty > 0)
+
+
+def build_local_comments(
+    hinbans: List[str],
+    today_summary: pd.DataFrame,
+    today_defects: pd.DataFrame,
+    lot_rows: pd.DataFrame,
+    baseline: LotBaseline,
+) -> Dict[str, str]:
+    """
+    Gemini を使わずに【評価】【判断】【対策】形式のコメントを作る（指標は全品番まとめて計算）。
+
+    評価: flag_unusual_lots が付けた要注意・判定（ロット単位）に従い、要注意ロットが無い品番は
+          品番全体の基準（過去ロットの EWMA）と比べて範囲内かどうかを書く
+    判断: 昨日の最多の不具合区分が過去1年の区分別件数で占める割合・順位と、直近ロットの不良率の推移
+    対策: 最多の不具合区分の名前から定型の対策を選ぶ
+    lot_rows は過去1年のロット単位集計（aggregate_defects_by_lot 形式）。
+    """
+    if not hinbans:
+        return {}
+    index = pd.Index([str(h).strip() for h in hinbans])
+    min_lots = int(os.environ.get("BASELINE_MIN_LOTS", "5"))
+    sigma = float(os.environ.get("BASELINE_SIGMA", "3"))
+
+    qty, ng = _qty_ng_by_hinban(today_summary, index)
+    rate = _rate(ng, qty)
+
+    part = baseline.by_part.reindex(index)
+    has_base = (part["ロット数"].fillna(0) >= min_lots).to_numpy()
+    ewma = part["EWMA"].to_numpy(dtype=float)
+    upper = np.maximum(part["上位パーセンタイル"].to_numpy(dtype=float), ewma + sigma * part["標準偏差"].to_numpy(dtype=float))
+
+    # 要注意ロット（HTML の印・AI 対象の絞り込みと同じ判定）のうち不良率が最も高いもの
+    flagged = np.zeros(len(index), dtype=bool)
+    flagged_base = np.zeros(len(index), dtype=bool)
+    if "要注意" in today_summary.columns and "品番" in today_summary.columns:
+        rows = today_summary.loc[today_summary["要注意"].fillna(False).astype(bool)]
+        if not rows.empty:
+            rows = rows.assign(品番=rows["品番"].astype(str).str.strip())
+            if "不良率" in rows.columns:
+                rows = rows.sort_values("不良率", ascending=False, kind="mergesort")
+            worst_lot = rows.drop_duplicates("品番").set_index("品番").reindex(index)
+            flagged = worst_lot["要注意"].notna().to_numpy()
+            if "判定" in worst_lot.columns:
+                flagged_base = flagged & (worst_lot["判定"] != "履歴不足").to_numpy()
+            if {"不良率", "基準不良率", "上限不良率"}.issubset(worst_lot.columns):
+                lot_rate = worst_lot["不良率"].to_numpy(dtype=float, na_value=np.nan)
+                rate = np.where(flagged_base, lot_rate, rate)
+                ewma = np.where(flagged_base, worst_lot["基準不良率"].to_numpy(dtype=float, na_value=np.nan), ewma)
+                upper = np.where(flagged_base, worst_lot["上限不良率"].to_numpy(dtype=float, na_value=np.nan), upper)
+    with np.errstate(invalid="ignore"):
+        level = np.select(
+            [ng <= 0, flagged_base, flagged, ~has_base, rate > ewma],
+            ["none", "high", "nobase_flag", "nobase", "above"],
+            default="normal",
+        )
+
+    # 昨日の最多区分と、その区分の過去1年での割合・順位（0 が最多）
+    kind_cols = [
+        c for c in lot_rows.columns
+        if c not in LOT_AGGREGATE_KEYS and c not in ("数量", "総不具合数") and c in today_defects.columns
+    ]
+    today_kinds = _kind_matrix(today_defects, kind_cols, index)
+    past_kinds = _kind_matrix(lot_rows, kind_cols, index)
+    has_kind = today_kinds.sum(axis=1) > 0
+    top = today_kinds.argmax(axis=1) if kind_cols else np.zeros(len(index), dtype=int)
+    past_top = past_kinds[np.arange(len(index)), top] if kind_cols else np.zeros(len(index))
+    past_total = past_kinds.sum(axis=1)
+    share = np.divide(past_top, past_total, out=np.zeros_like(past_top), where=past_total > 0)
+    past_rank = (past_kinds > past_top[:, None]).sum(axis=1) if kind_cols else np.zeros(len(index), dtype=int)
+
+    # 直近ロットと過去1年の不良率
+    year_qty, year_ng = _qty_ng_by_hinban(lot_rows, index)
+    recent_qty, recent_ng = np.zeros(len(index)), np.zeros(len(index))
+    if not lot_rows.empty and "日付" in lot_rows.columns:
+        recent = lot_rows.sort_values("日付", kind="mergesort").groupby("品番", sort=False).tail(LOT_HISTORY_RECENT_LIMIT)
+        recent_qty, recent_ng = _qty_ng_by_hinban(recent, index)
+    year_rate = _rate(year_ng, year_qty)
+    recent_rate = _rate(recent_ng, recent_qty)
+    worsening = (recent_rate > year_rate * 1.5) & (recent_ng > 0)
+
+    comments: Dict[str, str] = {}
+    for i, hinban in enumerate(index):
+        kind = kind_cols[top[i]] if has_kind[i] else ""
+        if level[i] == "none":
+            evaluation = f"不具合なし（検査数{qty[i]:,.0f}）で良好。"
+            judgement = "過去傾向からの逸脱なし。"
+            measure = "現状の加工条件・検査を維持する。"
+        else:
+            if level[i] == "nobase_flag":
+                evaluation = f"不良率{rate[i]:.2%}（不良{ng[i]:,.0f}/{qty[i]:,.0f}）。過去ロットが少なく基準比較ができないため要注意。"
+            elif level[i] == "nobase":
+                evaluation = f"不良率{rate[i]:.2%}（不良{ng[i]:,.0f}/{qty[i]:,.0f}）。要注意ロットはなし（品番全体の基準は過去ロット不足）。"
+            elif level[i] == "high":
+                evaluation = f"ロット不良率{rate[i]:.2%}で過去基準{ewma[i]:.2%}（上限{upper[i]:.2%}）を超過、要注意。"
+            elif level[i] == "above":
+                evaluation = f"不良率{rate[i]:.2%}で過去基準{ewma[i]:.2%}をやや上回る。"
+            else:
+                evaluation = f"不良率{rate[i]:.2%}で過去基準{ewma[i]:.2%}の範囲内。"
+
+            if not kind:
+                judgement = "不具合区分の記録がなく、傾向は判断できない。"
+            elif past_top[i] <= 0:
+                judgement = f"「{kind}」は過去1年に発生がなく、偶発の可能性が高い。"
+            elif past_rank[i] < 3 and share[i] >= 0.1:
+                trend = "再発兆候" if level[i] in ("high", "nobase_flag", "above") else "慢性的な発生"
+                judgement = f"「{kind}」は過去1年の{share[i]:.0%}を占める主要不具合で、{trend}と判断。"
+            else:
+                judgement = f"「{kind}」は過去1年では少数（{share[i]:.0%}）で、偶発の可能性が高い。"
+            if worsening[i]:
+                judgement += f"直近{LOT_HISTORY_RECENT_LIMIT}ロットの不良率{recent_rate[i]:.2%}は過去1年{year_rate[i]:.2%}より悪化傾向。"
+
+            measure = _local_countermeasure(kind) if kind else LOCAL_DEFAULT_COUNTERMEASURE
+            if level[i] in ("high", "nobase_flag"):
+                measure += "次ロットは初品・中間で重点確認する。"
+        comments[hinban] = f"【評価】{evaluation}\n【判断】{judgement}\n【対策】{measure}"
+    return comments
+
+
+def generate_ai_comments(
+    run_date: datetime,
+    cfg: Config,
+    today_summary: pd.DataFrame,
+    lot_history: Dict[str, LotHistory],
+    dataset: DefectDataset,
+    worst_set: set[str],
+    worst_term: Optional[TermInfo] = None,
+) -> Tuple[Dict[str, str], str, List[str]]:
+    """
+    GeminiでAIコメント生成（ワースト品番は専用プロンプト、その他は一般プロンプト）。
+    worst_term はワースト品番を決めた期（省略時は前期）。
+    返却: (品番→コメント, ai_status, 持ち時間内に生成できなかった品番)
+
+    GEMINI_SPLIT_PROMPT=true の場合は「過去傾向（当月より前）」と「昨日分」の2段に分け、
+    過去傾向の分析結果を月内の各日で再利用する。
+    ステージ全体の持ち時間（GEMINI_STAGE_BUDGET_SECONDS）を過ぎたら生成済みの分だけで返す。
+    """
+    ai_comments: Dict[str, str] = {}
+    ai_status: str = ""
+    ai_pending: List[str] = []
+    global _GEMINI_QUOTA_EXCEEDED
+    _GEMINI_QUOTA_EXCEEDED = False
+
+    if not os.environ.get("GEMINI_API_KEY"):
+        ai_status = "Gemini未設定のためAIコメントを生成できません。（.env に GEMINI_API_KEY を設定してください）"
+        logging.info("GEMINI_API_KEY not set; AI comments disabled.")
+        return ai_comments, ai_status, ai_pending
+
+    cache: Optional[GeminiCommentCache] = None
+    budget = AiStageBudget.from_env()
+    try:
+        configure_gemini()
+        prev_term = worst_term or get_previous_term_info(run_date.date())
+
+        model_name = os.environ.get("GEMINI_MODEL")
+        max_parts = int(os.environ.get("GEMINI_MAX_PARTS", "15"))
+        max_workers = int(os.environ.get("GEMINI_MAX_WORKERS", "3"))
+        # 匿名化設定（デフォルト: True = 有効）
+        use_anonymization = os.environ.get("GEMINI_ANONYMIZE", "true").lower() in ("true", "1", "yes", "on")
+        split_prompt = os.environ.get("GEMINI_SPLIT_PROMPT", "false").lower() in ("true", "1", "yes", "on")
+        batch_size = int(os.environ.get("GEMINI_BATCH_SIZE", "1"))
+        cache = GeminiCommentCache(cfg.output_dir)
+
+        if not model_name:
+            ai_status = "Geminiモデル未設定のためAIコメントを生成できません。（.env に GEMINI_MODEL を設定してください）"
+            raise RuntimeError("GEMINI_MODEL not set")
+
+        if use_anonymization:
+            logging.info("Gemini API送信時の識別情報匿名化が有効です（品番・品名・客先名を匿名化）")
+        else:
+            logging.info("Gemini API送信時の識別情報匿名化が無効です（元の情報を送信）")
+
+        candidates = today_summary
+        screen = os.environ.get("GEMINI_SCREEN_BY_BASELINE", "true").lower() in ("true", "1", "yes", "on")
+        if screen and "要注意" in today_summary.columns:
+            # 過去の基準から外れたロットのある品番だけにAIコメントを付ける
+            candidates = today_summary.loc[today_summary["要注意"].fillna(False).astype(bool)]
+            logging.info(
+                "AI comment candidates screened by baseline: %s of %s parts",
+                candidates["品番"].nunique(),
+                today_summary["品番"].nunique(),
+            )
+        all_today_hinbans = [
+            str(h).strip() for h in select_hinbans_for_ai(candidates, worst_set, max_parts=max_parts)
+        ]
+        limiter = GeminiRateLimiter.from_env()
+
+        prompts: Dict[str, str] = {}
+        if split_prompt:
+            lot_rows = dataset.lot_agg if dataset.lot_agg is not None else dataset.lot_rows_1y(run_date)
+            history_prompts, daily_prompt = build_split_prompts_for_hinbans(
+                all_today_hinbans,
+                run_date=run_date,
+                today_summary=today_summary,
+                lot_rows=lot_rows,
+                worst_set=worst_set,
+                term_info=prev_term,
+                use_anonymization=use_anonymization,
+            )
+            analyses, pending_analyses = _resolve_ai_jobs(
+                history_prompts, cache, model_name, run_date, max_workers, limiter, batch_size, use_anonymization,
+                budget=budget,
+            )
+            ai_pending.extend(pending_analyses)
+            for hinban in all_today_hinbans:
+                if analyses.get(hinban):
+                    prompts[hinban] = daily_prompt(hinban, analyses[hinban])
+
+        kind_sums = dataset.defect_kind_sums(run_date)
+        for hinban in all_today_hinbans:
+            if hinban not in prompts and hinban not in ai_pending:
+                prompts[hinban] = build_ai_prompt_for_hinban(
+                    hinban,
+                    today_summary=today_summary,
+                    lot_history=lot_history,
+                    kind_sums=kind_sums,
+                    worst_set=worst_set,
+                    term_info=prev_term,
+                    use_anonymization=use_anonymization,
+                )
+
+        if not _GEMINI_QUOTA_EXCEEDED:
+            comments, pending_comments = _resolve_ai_jobs(
+                prompts, cache, model_name, run_date, max_workers, limiter, batch_size, use_anonymization,
+                budget=budget,
+            )
+            ai_comments.update(comments)
+            ai_pending.extend(pending_comments)
+        if _GEMINI_QUOTA_EXCEEDED:
+            ai_status = "Gemini API のクォータ上限に達したため、以降のAIコメント生成を停止しました。"
+        elif ai_pending:
+            ai_pending = [h for h in all_today_hinbans if h in set(ai_pending)]
+            ai_status = (
+                f"AIコメント生成が持ち時間（{budget.seconds:.0f}秒）内に終わらなかったため、"
+                f"{len(ai_pending)}品番は生成待ちです。（GEMINI_STAGE_BUDGET_SECONDS で調整できます）"
+            )
+        else:
+            failed = [h for h in all_today_hinbans if not ai_comments.get(h)]
+            if failed:
+                ai_status = f"{len(failed)}品番はAIコメントを生成できませんでした。"
+    except Exception as e:
+        ai_status = f"Gemini コメント生成に失敗しました（{e.__class__.__name__}）。"
+        logging.warning("Gemini comment generation skipped: %s", e)
+    finally:
+        if cache is not None:
+            stats = cache.stats()
+            logging.info(
+                "Gemini comment cache: hits=%s misses=%s hit_rate=%.1f%%",
+                stats["hits"],
+                stats["misses"],
+                float(stats["hit_rate"]) * 100,
+            )
+            cache.close()
+    return ai_comments, ai_status, ai_pending
 
-    defect_df = read_access_table(cfg.defect_db_path, cfg.defect_table)
-    product_master_df = read_product_master(cfg.defect_db_path)
-    today_defects_df = join_defects(today_lots_df, defect_df)
 
-    today_summary, defects_breakdown = compute_today_summary(today_lots_df, today_defects_df)
+def build_dashboard_html(run_date: datetime, cfg: Config, dataset: DefectDataset) -> str:
+    """
+    読み込み済みのデータ（DefectDataset）から run_date 分のダッシュボードHTMLを作る。
+    dataset.lot_agg（ロット集計）があれば過去1年の推移・不具合区分はそこから作る。
+    """
+    today_lots_df = dataset.today_lots(run_date)
+    with stage_timer("join_defects") as st:
+        today_defects_df = dataset.today_defects(run_date)
+        st["rows"] = len(today_defects_df)
+
+    with stage_timer("compute_today_summary") as st:
+        today_summary, defects_breakdown = compute_today_summary(
+            today_lots_df, today_defects_df, defect_cols=dataset.defect_columns
+        )
+        st["rows"] = len(today_summary)
 
+    product_master_df = dataset.product_master
     if not product_master_df.empty and "品番" in today_summary.columns:
         pm = product_master_df.rename(
             columns={"製品番号": "品番", "製品名": "品名", "客先名": "客先名"}
@@ -1463,17 +4323,26 @@ def generate_dashboard(run_date: datetime, cfg: Config) -> bool:
         today_summary["品名"] = ""
         today_summary["客先名"] = ""
 
-    defects_1y = filter_last_1year(defect_df, run_date)
     target_hinbans = sorted(today_summary["品番"].astype(str).unique().tolist()) if "品番" in today_summary.columns else []
-    lot_history = compute_lot_history(defects_1y, target_hinbans)
+    source = "lot_aggregate" if dataset.lot_agg is not None else "defects"
+    with stage_timer("filter_last_1year", source=source) as st:
+        st["rows"] = len(dataset.last_1year(run_date))
+    with stage_timer("compute_lot_history", source=source) as st:
+        lot_history = dataset.lot_history(run_date, target_hinbans)
+        st["rows"] = len(lot_history)
+    with stage_timer("lot_baseline") as st:
+        # 過去1年の品番・号機別の基準から外れるロットに印を付ける（AI対象の絞り込み・HTML表示に使う）
+        today_summary = today_summary.join(flag_unusual_lots(today_summary, dataset.lot_baseline(run_date)))
+        st["rows"] = int(today_summary["要注意"].sum())
 
     # ワースト品番と通常品番を分離
-    worst_set = set(FIXED_WORST_41ST_HINBANS)
+    worst_ranking = dataset.worst_ranking(run_date)
+    worst_set = set(worst_ranking.hinbans)
     if "品番" in today_summary.columns:
         mask_worst = today_summary["品番"].astype(str).isin(worst_set)
         # ワースト品番: 不具合なしロットも含めて全て表示
         worst_today_summary = today_summary.loc[mask_worst].copy()
-        # 通常品番: 不良率 > 1% のみ表示
+        # 通常品番: 不良率 > 1% のみ表示（要注意の印は表示するロットにだけ付く）
         normal_today_summary_all = today_summary.loc[~mask_worst].copy()
         if "不良率" in normal_today_summary_all.columns:
             normal_today_summary = normal_today_summary_all[normal_today_summary_all["不良率"] > 0.01].copy()
@@ -1487,184 +4356,311 @@ def generate_dashboard(run_date: datetime, cfg: Config) -> bool:
     worst_lot_count = len(worst_today_summary) if not worst_today_summary.empty else 0
     normal_lot_count = len(normal_today_summary) if not normal_today_summary.empty else 0
 
-    # GeminiでAIコメント生成（固定ワーストは専用プロンプト、その他は一般プロンプト）
-    ai_comments: Dict[str, str] = {}
-    ai_status: str = ""
-    global _GEMINI_QUOTA_EXCEEDED
-    _GEMINI_QUOTA_EXCEEDED = False
+    mode = ai_comment_mode()
+    with stage_timer("ai_comments", mode=mode) as st:
+        if mode == "local":
+            ai_comments, ai_status, ai_pending = {}, "AI_COMMENT_MODE=local のため、ルールベースの自動判定を表示しています。", []
+        else:
+            ai_comments, ai_status, ai_pending = generate_ai_comments(
+                run_date,
+                cfg,
+                today_summary=today_summary,
+                lot_history=lot_history,
+                dataset=dataset,
+                worst_set=worst_set,
+                worst_term=worst_ranking.term,
+            )
+        st["rows"] = len(ai_comments)
+        st["pending"] = len(ai_pending)
+
+    worst_today_grouped = group_summary_by_hinban(worst_today_summary)
+    normal_today_grouped = group_summary_by_hinban(normal_today_summary)
+
+    local_comments: Dict[str, str] = {}
+    if mode != "gemini":
+        with stage_timer("local_comments") as st:
+            # local: 表示する品番のうち AI コメントが無いものを全てルールベースで補う
+            # auto: Gemini が使えなかった品番（未設定・クォータ・失敗・生成待ち）だけ補い、
+            #       基準範囲内で AI 対象から外した品番は「省略」のままにする
+            pending = set(ai_pending)
+            targets = []
+            for row in worst_today_grouped + normal_today_grouped:
+                hinban = str(row["品番"]).strip()
+                if ai_comments.get(hinban):
+                    continue
+                if mode == "local" or hinban in pending or (ai_status and row.get("要注意") is not False):
+                    targets.append(hinban)
+            local_comments = build_local_comments(
+                targets,
+                today_summary=today_summary,
+                today_defects=today_defects_df,
+                lot_rows=dataset.lot_rows_1y(run_date),
+                baseline=dataset.lot_baseline(run_date),
+            )
+            ai_comments.update(local_comments)
+            st["rows"] = len(local_comments)
+        if local_comments and mode == "auto" and ai_status:
+            ai_status += "（AIコメントの無い品番はルールベースの自動判定を表示しています）"
+
+    with stage_timer("quarterly_trend") as st:
+        quarterly_labels, quarterly_rows = build_quarterly_trend(
+            dataset.monthly_rollup(run_date), worst_ranking.hinbans, run_date
+        )
+        st["rows"] = len(quarterly_rows)
+
+    with stage_timer("render"):
+        template = load_template(cfg)
+        return template.render(
+            run_date=run_date.strftime("%Y-%m-%d"),
+            run_date_short=f"{run_date.month}/{run_date.day}",
+            worst_term_number=worst_ranking.term.term_number,
+            quarterly_trend_labels=quarterly_labels,
+            quarterly_trend_rows=quarterly_rows,
+            logo_text=cfg.logo_text,
+            logo_data_uri=f"data:image/png;base64,{LOGO_BASE64}",
+            today_summary=normal_today_grouped,
+            worst_today_summary=worst_today_grouped,
+            today_lot_count=int(today_lots_df["生産ロットID"].dropna().nunique()),
+            today_defect_count=int(len(today_defects_df)),
+            worst_lot_count=worst_lot_count,
+            normal_lot_count=normal_lot_count,
+            breakdown_columns=[],
+            breakdown_rows=[],
+            ai_comments=ai_comments,
+            ai_status=ai_status,
+            ai_pending=set(ai_pending),
+            local_comments=set(local_comments),
+        )
 
-    if os.environ.get("GEMINI_API_KEY"):
-        try:
-            configure_gemini()
-            prev_term = get_previous_term_info(run_date.date())
-
-            model_name = os.environ.get("GEMINI_MODEL")
-            max_parts = int(os.environ.get("GEMINI_MAX_PARTS", "15"))
-            request_interval_seconds = float(os.environ.get("GEMINI_REQUEST_INTERVAL_SECONDS", "12"))
-            # 匿名化設定（デフォルト: True = 有効）
-            use_anonymization = os.environ.get("GEMINI_ANONYMIZE", "true").lower() in ("true", "1", "yes", "on")
-            cache = load_gemini_comment_cache(cfg.output_dir)
-
-            if not model_name:
-                ai_status = "Geminiモデル未設定のためAIコメントを生成できません。（.env に GEMINI_MODEL を設定してください）"
-                raise RuntimeError("GEMINI_MODEL not set")
-            
-            if use_anonymization:
-                logging.info("Gemini API送信時の識別情報匿名化が有効です（品番・品名・客先名を匿名化）")
-            else:
-                logging.info("Gemini API送信時の識別情報匿名化が無効です（元の情報を送信）")
 
-            all_today_hinbans = select_hinbans_for_ai(today_summary, worst_set, max_parts=max_parts)
+def dashboard_file_name(run_date: datetime) -> str:
+    return f"defect_dashboard_{run_date:%Y-%m-%d}.html"
 
-            for hinban in all_today_hinbans:
-                hinban = str(hinban).strip()
-                today_rows_all = today_summary[today_summary["品番"].astype(str) == hinban]
-                today_qty = int(today_rows_all["数量"].sum()) if "数量" in today_rows_all.columns else 0
-                today_ng = int(today_rows_all["総不具合数"].sum()) if "総不具合数" in today_rows_all.columns else 0
-                part_name = (
-                    today_rows_all["品名"].astype(str).dropna().iloc[0]
-                    if "品名" in today_rows_all.columns and len(today_rows_all) else ""
-                )
-                customer = (
-                    today_rows_all["客先名"].astype(str).dropna().iloc[0]
-                    if "客先名" in today_rows_all.columns and len(today_rows_all) else ""
+
+def generate_dashboard(run_date: datetime, cfg: Config) -> bool:
+    if load_dotenv is not None:
+        load_dotenv()
+    setup_logging(cfg.output_dir)
+
+    with run_metrics(run_date, cfg.output_dir):
+        return _generate_dashboard(run_date, cfg)
+
+
+def _timed_read(stage: str, read: Callable, *args):
+    """読み込み関数を計測付きで呼ぶ（スレッドプールから使う）"""
+    with stage_timer(stage) as st:
+        result = read(*args)
+        st["rows"] = len(result[0] if isinstance(result, tuple) else result)
+    return result
+
+
+def _generate_dashboard(run_date: datetime, cfg: Config) -> bool:
+    cutoff = run_date - timedelta(days=365 * 1)
+    use_lot_store = lot_aggregate_store_enabled()
+    stored_lots, lot_meta = load_lot_aggregate(cfg.output_dir) if use_lot_store else (pd.DataFrame(), {})
+    since = lot_aggregate_refresh_start(lot_meta, cutoff, run_date) if use_lot_store else None
+    # 秒未満を切り捨て、期間側と当日ロット側の読み込みが重ならないようにする
+    window_start = (since if since is not None else cutoff).replace(microsecond=0)
+
+    # 3つの読み込みを同時に始める（不具合情報の期間分は当日ロットに依存しない）。
+    # 接続は DB ファイルごとに ACCESS_CONNECTIONS_PER_FILE 本まで使うため、同じファイルの
+    # 不具合情報と製品マスタも並行して読める。対象ロットが無い日（休日など）は
+    # 読み込みを取り消して終える（型付き読み込みは次のチャンクで打ち切られる）。
+    with access_connection_pool() as access_pool:
+        reads = ThreadPoolExecutor(max_workers=3, thread_name_prefix="access")
+        try:
+            window_future = reads.submit(_timed_read, "read_defects", read_defect_window, cfg, window_start)
+            master_future = reads.submit(_timed_read, "read_product_master", read_product_master, cfg.defect_db_path)
+            appearance_df = _timed_read("read_appearance", read_appearance_for_run_date, cfg, run_date)
+            # run_date（デフォルト: 昨日）対象のロットを抽出
+            dataset = DefectDataset(appearance_df)
+            with stage_timer("extract_today_lots") as st:
+                today_lots_df = dataset.today_lots(run_date)
+                st["rows"] = len(today_lots_df)
+            target_lot_count = int(today_lots_df["生産ロットID"].dropna().nunique())
+            if target_lot_count == 0:
+                logging.info("no lots found for run_date=%s; skip html generation", run_date.date())
+                access_pool.cancel()
+                return False
+
+            defect_df, defect_date_col = window_future.result()
+            if defect_date_col:
+                # 当日ロットのうち期間より前の行だけを追加で読む
+                today_lot_ids = today_lots_df["生産ロットID"].dropna().unique().tolist()
+                older = _timed_read(
+                    "read_defects_for_lots", read_defects_for_lots_before, cfg, defect_date_col, today_lot_ids, window_start
                 )
-                today_rate = (today_ng / today_qty * 100) if today_qty else 0.0
-                today_defect_kinds = " / ".join(
-                    [s for s in today_rows_all["不具合内訳"].astype(str).tolist() if s and s != "-"]
-                ) if "不具合内訳" in today_rows_all.columns else ""
-
-                history_rows = lot_history.get(hinban, [])
-                trend_table_str = build_trend_summary_from_history(history_rows)
-                defect_kind_summary_str = build_defect_kind_summary(defects_1y, hinban)
-
-                if hinban in worst_set:
-                    info = FIXED_WORST_41ST_INFO.get(hinban, {})
-                    prompt = build_worst_part_prompt_for_term(
-                        term_info=prev_term,
-                        part_number=hinban,
-                        part_name=info.get("品名", part_name),
-                        customer=info.get("客先名", customer),
-                        major_defects=info.get("主な不具合", ""),
-                        trend_table=trend_table_str,
-                        defect_kind_summary=defect_kind_summary_str,
-                        today_qty=today_qty,
-                        today_ng=today_ng,
-                        today_rate=today_rate,
-                        today_defect_kinds=today_defect_kinds,
-                        use_anonymization=use_anonymization,
-                    )
-                else:
-                    prompt = build_general_part_prompt(
-                        part_number=hinban,
-                        part_name=part_name,
-                        customer=customer,
-                        trend_table=trend_table_str,
-                        defect_kind_summary=defect_kind_summary_str,
-                        today_qty=today_qty,
-                        today_ng=today_ng,
-                        today_rate=today_rate,
-                        today_defect_kinds=today_defect_kinds,
-                        use_anonymization=use_anonymization,
-                    )
-
-                cache_key = _gemini_cache_key(run_date, model_name=model_name, hinban=hinban, prompt=prompt)
-                cached = cache.get(cache_key)
-                if cached:
-                    ai_comments[hinban] = cached
-                else:
-                    comment = generate_worst_part_comment(prompt, model_name=model_name)
-                    if comment:
-                        ai_comments[hinban] = comment
-                        cache[cache_key] = comment
-                        save_gemini_comment_cache(cfg.output_dir, cache)
-                if _GEMINI_QUOTA_EXCEEDED:
-                    ai_status = "Gemini API のクォータ上限に達したため、以降のAIコメント生成を停止しました。"
-                    break
-                # レートリミット対策: API呼び出し間隔は環境変数で調整可能
-                time.sleep(request_interval_seconds)
+                defect_df = concat_access_frames([defect_df, older])
+            product_master_df = master_future.result()
+        finally:
+            reads.shutdown(wait=True, cancel_futures=True)
+    dataset.attach_defects(defect_df, product_master_df)
+
+    if use_lot_store and since is not None:
+        # Access からは未集計分のみ読み、ストアへ反映する
+        with stage_timer("refresh_lot_aggregate") as st:
+            dataset.lot_agg = refresh_lot_aggregate(
+                cfg.output_dir, stored_lots, lot_meta, dataset.defects, since, run_date
+            )
+            st["rows"] = 0 if dataset.lot_agg is None else len(dataset.lot_agg)
+
+    with stage_timer("term_worst_ranking"):
+        # 当期の品番別合計を進め、締めた期のワーストを保存する
+        dataset.term_worst_state = update_term_worst_state(
+            load_term_worst_state(cfg.output_dir), dataset.term_lot_rows(run_date), run_date
+        )
+        try:
+            save_term_worst_state(cfg.output_dir, dataset.term_worst_state)
         except Exception as e:
-            ai_status = f"Gemini コメント生成に失敗しました（{e.__class__.__name__}）。"
-            logging.warning("Gemini comment generation skipped: %s", e)
-    else:
-        ai_status = "Gemini未設定のためAIコメントを生成できません。（.env に GEMINI_API_KEY を設定してください）"
-        logging.info("GEMINI_API_KEY not set; AI comments disabled.")
+            logging.warning("failed to save term worst ranking: %s", e)
 
-    # 品番単位にまとめて「ロット一覧」を作る（不良率高い順）
-    def group_by_hinban(df: pd.DataFrame) -> List[Dict[str, object]]:
-        if df.empty or "品番" not in df.columns:
-            return []
-        rows: List[Dict[str, object]] = []
-        for hinban, sub in df.groupby("品番"):
-            sub_sorted = sub.sort_values("不良率", ascending=False)
-            lot_list: List[Dict[str, object]] = []
-            for _, r in sub_sorted.iterrows():
-                # ロット日（指示日）をフォーマット
-                lot_date_val = r.get("指示日", "")
-                if pd.notna(lot_date_val) and lot_date_val != "":
-                    if hasattr(lot_date_val, "strftime"):
-                        lot_date_str = lot_date_val.strftime("%m/%d")
-                    else:
-                        lot_date_str = str(lot_date_val)
-                else:
-                    lot_date_str = ""
-                lot_list.append({
-                    "号機": str(r.get("号機", "")),
-                    "ロット日": lot_date_str,
-                    "数量": float(r.get("数量", 0)),
-                    "総不具合数": float(r.get("総不具合数", 0)),
-                    "不良率": float(r.get("不良率", 0)),
-                    "不具合内訳": str(r.get("不具合内訳", "-")),
-                })
-            qty_total = float(sub_sorted.get("数量", 0).sum()) if "数量" in sub_sorted.columns else 0.0
-            ng_total = float(sub_sorted.get("総不具合数", 0).sum()) if "総不具合数" in sub_sorted.columns else 0.0
-            rate_total = (ng_total / qty_total) if qty_total else 0.0
-            first = sub_sorted.iloc[0]
-            rows.append({
-                "品番": str(hinban),
-                "品名": str(first.get("品名", "")),
-                "客先名": str(first.get("客先名", "")),
-                "数量合計": qty_total,
-                "総不具合数合計": ng_total,
-                "不良率合計": rate_total,
-                "ロット一覧": lot_list,
-            })
-        # 品番単位の並びも不良率合計高い順
-        rows.sort(key=lambda x: x.get("不良率合計", 0), reverse=True)
-        return rows
-
-    worst_today_grouped = group_by_hinban(worst_today_summary)
-    normal_today_grouped = group_by_hinban(normal_today_summary)
-
-    template = load_template(cfg)
-    html = template.render(
-        run_date=run_date.strftime("%Y-%m-%d"),
-        run_date_short=f"{run_date.month}/{run_date.day}",
-        logo_text=cfg.logo_text,
-        logo_data_uri=f"data:image/png;base64,{LOGO_BASE64}",
-        today_summary=normal_today_grouped,
-        worst_today_summary=worst_today_grouped,
-        today_lot_count=target_lot_count,
-        today_defect_count=int(len(today_defects_df)),
-        worst_lot_count=worst_lot_count,
-        normal_lot_count=normal_lot_count,
-        breakdown_columns=[],
-        breakdown_rows=[],
-        ai_comments=ai_comments,
-        ai_status=ai_status,
-    )
+    if pyarrow is not None:
+        with stage_timer("refresh_monthly_cube") as st:
+            dataset.monthly_cube = refresh_monthly_cube(cfg.output_dir, dataset.term_lot_rows(run_date), run_date)
+            st["rows"] = len(dataset.monthly_cube)
+
+    html = build_dashboard_html(run_date, cfg, dataset)
 
-    file_name = f"defect_dashboard_{run_date:%Y-%m-%d}.html"
-    send_html_to_araichat(html, file_name=file_name, run_date=run_date, output_dir=cfg.output_dir)
+    file_name = dashboard_file_name(run_date)
+    with stage_timer("send_html_to_araichat", bytes=len(html.encode("utf-8"))):
+        send_html_to_araichat(html, file_name=file_name, run_date=run_date, output_dir=cfg.output_dir)
     logging.info("dashboard sent to ARAICHAT: %s (room_id=%s)", file_name, ARAICHAT_ROOM_ID)
     return True
 
 
+# -----------------------------
+# 期間指定（バックフィル）
+# -----------------------------
+
+# バックフィル用ワーカープロセスが共有する読み込み済みデータ
+_BACKFILL_STATE: Dict[str, object] = {}
+
+
+def read_backfill_data(cfg: Config, date_from: datetime, date_to: datetime) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    期間内の全日分を作るのに必要なデータを1回だけ読み込む（3テーブルを並行して読む）。
+    外観検査集計は期間内、不具合情報は期間開始の1年前以降、製品マスタは全件。
+    """
+    first_day = datetime.combine(date_from.date(), datetime.min.time())
+    end_day = datetime.combine(date_to.date(), datetime.min.time()) + timedelta(days=1)
+
+    def read_appearance() -> pd.DataFrame:
+        if cfg.push_down_filters:
+            available = read_access_columns(cfg.appearance_db_path, cfg.appearance_table)
+            date_col = find_date_column_name(available)
+            if date_col:
+                columns = [c for c in APPEARANCE_COLUMNS if c in available]
+                if date_col not in columns:
+                    columns.append(date_col)
+                return read_access_table(
+                    cfg.appearance_db_path,
+                    cfg.appearance_table,
+                    columns=columns,
+                    date_column=date_col,
+                    date_from=first_day,
+                    date_to=end_day,
+                    typed=cfg.typed_loading,
+                )
+        return read_access_table(cfg.appearance_db_path, cfg.appearance_table, typed=cfg.typed_loading)
+
+    with access_connection_pool(), ThreadPoolExecutor(max_workers=3, thread_name_prefix="access") as pool:
+        appearance_future = pool.submit(read_appearance)
+        defect_future = pool.submit(read_defect_window, cfg, date_from - timedelta(days=365 * 1))
+        master_future = pool.submit(read_product_master, cfg.defect_db_path)
+        return appearance_future.result(), defect_future.result()[0], master_future.result()
+
+
+def _init_backfill_worker(cfg: Config, dataset: DefectDataset, rate_share: float) -> None:
+    setup_logging(cfg.output_dir)
+    # Gemini のクォータはプロセス間で共有されるため、各ワーカーは按分したレートで呼ぶ
+    os.environ["GEMINI_RATE_SHARE"] = str(rate_share)
+    _BACKFILL_STATE.update(cfg=cfg, dataset=dataset)
+
+
+def _render_backfill_day(run_date: datetime) -> Tuple[Optional[str], Optional[Dict[str, object]]]:
+    """1日分の HTML と計測結果を返す（計測結果の jsonl への追記は親プロセスがまとめて行う）"""
+    with run_metrics(run_date, None) as metrics:
+        html = _render_backfill_day_html(run_date)
+    return html, metrics.record
+
+
+def _render_backfill_day_html(run_date: datetime) -> Optional[str]:
+    dataset: DefectDataset = _BACKFILL_STATE["dataset"]
+    with stage_timer("extract_today_lots") as st:
+        today_lots_df = dataset.today_lots(run_date)
+        st["rows"] = len(today_lots_df)
+    if int(today_lots_df["生産ロットID"].dropna().nunique()) == 0:
+        logging.info("no lots found for run_date=%s; skip html generation", run_date.date())
+        return None
+    return build_dashboard_html(run_date, _BACKFILL_STATE["cfg"], dataset)
+
+
+def generate_dashboards_for_range(date_from: datetime, date_to: datetime, cfg: Config) -> int:
+    """
+    date_from〜date_to の各日のダッシュボードを作って送信する。
+    データは1回だけ読み込み、各日の集計・AIコメント・HTML生成はプロセスプールで並行実行する。
+    送信済みキャッシュ・Geminiキャッシュは日単位の実行と同じものを使う。
+    送信した日数を返す。
+    """
+    if load_dotenv is not None:
+        load_dotenv()
+    setup_logging(cfg.output_dir)
+    if date_to < date_from:
+        raise ValueError("--to must not be earlier than --from")
+
+    dataset = DefectDataset(*read_backfill_data(cfg, date_from, date_to))
+    if dataset.defect_date_col:
+        # 全期間分のロット集計を1回だけ作り、各日は過去1年分を切り出して使う
+        dataset.lot_agg = aggregate_defects_by_lot(dataset.defects, dataset.defect_columns)
+    # 期別ワーストは保存済みのものを参照するだけ（更新は日次実行で行う）
+    dataset.term_worst_state = load_term_worst_state(cfg.output_dir)
+
+    days = [date_from + timedelta(days=i) for i in range((date_to.date() - date_from.date()).days + 1)]
+    max_workers = max(1, min(len(days), int(os.environ.get("BACKFILL_MAX_WORKERS", str(os.cpu_count() or 1)))))
+    logging.info("backfill %s..%s: %s days with %s workers", f"{date_from:%Y-%m-%d}", f"{date_to:%Y-%m-%d}", len(days), max_workers)
+
+    sent = 0
+    failures: List[str] = []
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_backfill_worker,
+        initargs=(cfg, dataset, 1.0 / max_workers),
+    ) as pool:
+        futures = {pool.submit(_render_backfill_day, day): day for day in days}
+        # 送信は送信済みキャッシュを書き換えるため親プロセスで順に行う（生成中の他の日とは並行）
+        for fut in as_completed(futures):
+            day = futures[fut]
+            try:
+                html, metrics_record = fut.result()
+                if metrics_record is not None:
+                    append_run_metrics(cfg.output_dir, metrics_record)
+                if html is None:
+                    continue
+                file_name = dashboard_file_name(day)
+                send_html_to_araichat(html, file_name=file_name, run_date=day, output_dir=cfg.output_dir)
+                logging.info("dashboard sent to ARAICHAT: %s (room_id=%s)", file_name, ARAICHAT_ROOM_ID)
+                sent += 1
+            except Exception as e:
+                logging.exception("failed to generate dashboard for %s: %s", f"{day:%Y-%m-%d}", e)
+                failures.append(f"{day:%Y-%m-%d}: {e.__class__.__name__}: {e}")
+
+    if failures:
+        raise RuntimeError("backfill failed for some days:\n" + "\n".join(failures))
+    return sent
+
+
 def parse_args(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Generate defect dashboard HTML")
     p.add_argument("--run-date", type=str, help="YYYY-MM-DD (default: yesterday)")
+    p.add_argument("--from", dest="date_from", type=str, help="backfill start YYYY-MM-DD (use with --to)")
+    p.add_argument("--to", dest="date_to", type=str, help="backfill end YYYY-MM-DD, inclusive (use with --from)")
     p.add_argument("--config", type=str, help="path to JSON config")
-    return p.parse_args(argv)
+    args = p.parse_args(argv)
+    if bool(args.date_from) != bool(args.date_to):
+        p.error("--from and --to must be given together")
+    if args.date_from and args.run_date:
+        p.error("--run-date cannot be combined with --from/--to")
+    return args
 
 
 def main(argv: Optional[Iterable[str]] = None) -> None:
@@ -1675,6 +4671,13 @@ def main(argv: Optional[Iterable[str]] = None) -> None:
         run_date = datetime.strptime(args.run_date, "%Y-%m-%d")
     cfg = load_config(args.config)
     try:
+        if args.date_from:
+            generate_dashboards_for_range(
+                datetime.strptime(args.date_from, "%Y-%m-%d"),
+                datetime.strptime(args.date_to, "%Y-%m-%d"),
+                cfg,
+            )
+            return
         ok = generate_dashboard(run_date, cfg)
         if not ok:
             return
@@ -3,6 +3,8 @@ import time
 import os
 from pathlib import Path
 import io
+import tempfile
+import uuid
 import datetime
 import smtplib
 from email.mime.text import MIMEText
@@ -10,9 +12,13 @@ import traceback
 import sys
 import hashlib
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.http import MediaIoBaseDownload, HttpRequest
+import google_auth_httplib2
+import httplib2
 from dotenv import load_dotenv
 
 # .envファイルから環境変数を読み込み
@@ -94,6 +100,12 @@ GOOGLE_DRIVE_SCOPES = [
     'https://www.googleapis.com/auth/drive'  # フルアクセス（読み取り、書き込み、削除）
 ]
 
+# ダウンロードファイルの一時保存設定
+# 閾値まではメモリ上、超えた分はディスク上の一時ファイルに保持する（ファイルサイズに関わらずメモリ使用量を一定に保つ）
+DRIVE_SPOOL_MAX_MEMORY_BYTES = int(float(os.getenv("DRIVE_SPOOL_MAX_MEMORY_MB", "4")) * 1024 * 1024)
+DRIVE_DOWNLOAD_CHUNK_BYTES = int(float(os.getenv("DRIVE_DOWNLOAD_CHUNK_MB", "1")) * 1024 * 1024)
+
+
 # 送信対象の設定（フォルダ対応版）
 # 単一ファイル指定（既存）
 target_google_drive_file_id = "1Sdqhu6zG8LhzILklNt_TvNp1ySjRFR-G"
@@ -116,45 +128,93 @@ USE_FOLDER_MODE = True  # True: フォルダモード, False: 単一ファイル
 DELETE_AFTER_UPLOAD = False  # True: 配信成功後にファイル削除, False: 削除しない
 DELETE_LOCAL_CACHE = False   # True: ローカルキャッシュも削除, False: キャッシュ保持
 
+# Google Drive APIクライアント（プロセス内で1回だけ生成して共有）
+_drive_service = None
+_drive_credentials = None
+_drive_service_lock = threading.Lock()
+_drive_http_local = threading.local()
+
+
+def _get_authorized_http():
+    """
+    呼び出し元スレッドの認証済みHTTPトランスポートを返す
+
+    httplib2.Http はスレッドセーフではないため、資格情報は全体で共有しつつ
+    トランスポートはスレッドごとに1つだけ作成し、そのスレッドの全リクエストで使い回す。
+    """
+    http = getattr(_drive_http_local, "http", None)
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(_drive_credentials, http=httplib2.Http())
+        _drive_http_local.http = http
+    return http
+
+
+def _build_drive_request(http, *args, **kwargs):
+    """build()のrequestBuilder: リクエストを呼び出し元スレッドのトランスポートで生成"""
+    return HttpRequest(_get_authorized_http(), *args, **kwargs)
+
+
 def get_google_drive_service():
     """
     Google Drive APIサービスオブジェクトを取得
 
+    初回呼び出し時にのみサービスアカウントJSONを読み込み、同梱の静的ディスカバリー
+    ドキュメントでクライアントを生成する。以降は同じクライアントを返す（スレッドセーフ）。
+
     Returns:
         googleapiclient.discovery.Resource: Google Drive APIサービス
     """
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        service_account_file = os.path.join(base_dir, GOOGLE_SERVICE_ACCOUNT_FILE)
+    global _drive_service, _drive_credentials
 
-        if not os.path.exists(service_account_file):
-            raise FileNotFoundError(f"Google サービスアカウントファイルが見つかりません: {service_account_file}")
+    if _drive_service is not None:
+        return _drive_service
 
-        credentials = Credentials.from_service_account_file(
-            service_account_file,
-            scopes=GOOGLE_DRIVE_SCOPES
-        )
+    with _drive_service_lock:
+        if _drive_service is not None:
+            return _drive_service
 
-        service = build('drive', 'v3', credentials=credentials)
-        print("Google Drive APIサービスの初期化完了")
-        return service
+        try:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            service_account_file = os.path.join(base_dir, GOOGLE_SERVICE_ACCOUNT_FILE)
 
-    except Exception as e:
-        error_msg = f"Google Drive APIサービスの初期化エラー: {str(e)}"
-        print(error_msg)
-        send_error_email(f"Google Drive API初期化エラー:\n{error_msg}")
-        return None
+            if not os.path.exists(service_account_file):
+                raise FileNotFoundError(f"Google サービスアカウントファイルが見つかりません: {service_account_file}")
+
+            _drive_credentials = Credentials.from_service_account_file(
+                service_account_file,
+                scopes=GOOGLE_DRIVE_SCOPES
+            )
+
+            _drive_service = build(
+                'drive', 'v3',
+                http=_get_authorized_http(),
+                requestBuilder=_build_drive_request,
+                static_discovery=True
+            )
+            print("Google Drive APIサービスの初期化完了")
+            return _drive_service
+
+        except Exception as e:
+            error_msg = f"Google Drive APIサービスの初期化エラー: {str(e)}"
+            print(error_msg)
+            send_error_email(f"Google Drive API初期化エラー:\n{error_msg}")
+            return None
 
 def download_file_from_google_drive(file_id):
     """
-    Google Driveからファイルをダウンロードしてバイトデータとファイル名を取得
+    Google Driveからファイルを一時ファイルへストリーミングダウンロード
+
+    ファイル全体をメモリに載せず、DRIVE_DOWNLOAD_CHUNK_BYTES ずつ SpooledTemporaryFile へ
+    書き込む（DRIVE_SPOOL_MAX_MEMORY_BYTES を超えるとディスクへ切り替わる）。
+    返したファイルハンドルは呼び出し側で close() すること。
 
     Args:
         file_id (str): Google DriveのファイルID
 
     Returns:
-        tuple: (file_data: bytes, file_name: str) 成功時、(None, None) 失敗時
+        tuple: (file_obj: 先頭に巻き戻したファイルハンドル, file_name: str) 成功時、(None, None) 失敗時
     """
+    file_data = None
     try:
         service = get_google_drive_service()
         if not service:
@@ -175,8 +235,8 @@ def download_file_from_google_drive(file_id):
         # ファイルの内容をダウンロード
         print("ファイルダウンロード開始...")
         request = service.files().get_media(fileId=file_id)
-        file_data = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_data, request)
+        file_data = tempfile.SpooledTemporaryFile(max_size=DRIVE_SPOOL_MAX_MEMORY_BYTES)
+        downloader = MediaIoBaseDownload(file_data, request, chunksize=DRIVE_DOWNLOAD_CHUNK_BYTES)
 
         done = False
         while done is False:
@@ -184,12 +244,14 @@ def download_file_from_google_drive(file_id):
             if status:
                 print(f"ダウンロード進行状況: {int(status.progress() * 100)}%")
 
-        file_bytes = file_data.getvalue()
-        print(f"ダウンロード完了: {len(file_bytes)} bytes取得")
+        print(f"ダウンロード完了: {file_data.tell()} bytes取得")
+        file_data.seek(0)
 
-        return file_bytes, file_name
+        return file_data, file_name
 
     except Exception as e:
+        if file_data is not None:
+            file_data.close()
         error_msg = f"Google Driveファイルダウンロードエラー: {str(e)}"
         print(error_msg)
         send_error_email(f"Google Driveファイルダウンロードエラー:\n{error_msg}")
@@ -286,24 +348,118 @@ def apply_file_filter(files, file_filter):
     print(f"フィルター適用後: {len(filtered_files)}件のHTMLファイルが対象")
     return filtered_files
 
+def get_stream_size(file_obj):
+    """
+    ファイルハンドルのサイズを取得（読み取り位置は先頭に戻す）
+
+    Args:
+        file_obj: シーク可能なファイルハンドル
+
+    Returns:
+        int: ファイルサイズ（bytes）
+    """
+    file_obj.seek(0, os.SEEK_END)
+    file_size = file_obj.tell()
+    file_obj.seek(0)
+    return file_size
+
+class UploadStream:
+    """
+    複数のバイト列・ファイルハンドルを連結して順に read() で返すアップロード用ストリーム
+
+    ファイル本体はメモリへコピーせずハンドルから直接読み出す。__len__ を持つため
+    requests は Content-Length 付きで逐次送信する（SpooledTemporaryFile を直接渡すと
+    サイズ取得時に fileno() でディスクへ書き出されるため、このラッパー経由で渡す）。
+    """
+
+    def __init__(self, parts):
+        self._parts = []
+        self._length = 0
+        for part in parts:
+            if isinstance(part, bytes):
+                self._length += len(part)
+                part = io.BytesIO(part)
+            else:
+                self._length += get_stream_size(part)
+            self._parts.append(part)
+        self._index = 0
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while self._index < len(self._parts) and size != 0:
+            data = self._parts[self._index].read(size)
+            if not data:
+                self._index += 1
+                continue
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(chunks)
+
+def build_multipart_stream(field_name, file_name, file_obj, content_type, fields=None):
+    """
+    multipart/form-data の本文をファイルハンドルから逐次送信するストリームを作成
+
+    requests の files= は本文全体をメモリ上で組み立てるため、その代わりに使う。
+
+    Args:
+        field_name (str): ファイルのフォーム項目名
+        file_name (str): ファイル名
+        file_obj: ファイルハンドル（先頭から送信）
+        content_type (str): ファイルのContent-Type
+        fields (dict, optional): ファイル以外のフォーム項目
+
+    Returns:
+        tuple: (UploadStream, Content-Typeヘッダー値)
+    """
+    boundary = uuid.uuid4().hex
+    # ファイル名はHTML5の形式でエスケープ（requests/urllib3と同じ）
+    quoted_name = file_name.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+    head = ""
+    for name, value in (fields or {}).items():
+        head += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+    head += (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field_name}"; filename="{quoted_name}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    )
+    tail = f'\r\n--{boundary}--\r\n'
+
+    stream = UploadStream([head.encode('utf-8'), file_obj, tail.encode('utf-8')])
+    return stream, f"multipart/form-data; boundary={boundary}"
+
 # 送信履歴管理（重複防止用）
 SENT_CACHE_FILE = Path(__file__).parent / "araichat_sent_cache.json"
 CACHE_TTL_HOURS = 24  # キャッシュ保持期間（時間）
+_sent_cache_lock = threading.Lock()  # 複数スレッドから送信する場合の送信履歴の読み書きを直列化
+_sent_in_flight = {}  # 送信中のハッシュ値 → 完了通知用 Event（_sent_cache_lock で保護）
+
+# フォルダ一括送信でのダウンロードの先読み数と、ARAICHAT APIのレート制限（1分あたりのリクエスト数）
+TRANSFER_WORKERS = int(os.getenv("DRIVE_TRANSFER_WORKERS", "4"))
+ARAICHAT_API_RATE_PER_MINUTE = float(os.getenv("ARAICHAT_API_RATE_PER_MINUTE", "120"))
+ARAICHAT_API_BURST = int(os.getenv("ARAICHAT_API_BURST", "4"))
 
-def calculate_file_digest(file_data, file_name):
+def calculate_file_digest(file_obj, file_name):
     """
-    ファイルの内容から一意なハッシュ値を計算
+    ファイルの内容から一意なハッシュ値を計算（ファイルハンドルから分割読み込み）
     
     Args:
-        file_data (bytes): ファイルデータ
+        file_obj: ファイルハンドル（計算後は先頭に巻き戻す）
         file_name (str): ファイル名
     
     Returns:
         str: SHA256ハッシュ値
     """
-    # ファイル名と内容を組み合わせてハッシュ化
-    combined = f"{file_name}:{len(file_data)}:".encode('utf-8') + file_data
-    return hashlib.sha256(combined).hexdigest()
+    # ファイル名と内容を組み合わせてハッシュ化（従来の「ファイル名:サイズ:内容」と同じ値）
+    digest = hashlib.sha256(f"{file_name}:{get_stream_size(file_obj)}:".encode('utf-8'))
+    for chunk in iter(lambda: file_obj.read(DRIVE_DOWNLOAD_CHUNK_BYTES), b""):
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
 
 def load_sent_cache():
     """
@@ -344,7 +500,11 @@ def save_sent_cache(cache):
 
 def check_already_sent(file_digest, file_name):
     """
-    ファイルが既に送信済みかチェック
+    ファイルが既に送信済みかチェックし、未送信なら送信中として予約する
+
+    確認と予約は同じロック内で行う。同じ内容のファイルを別スレッドが送信中の場合は
+    その完了を待ってから判定し直す（同じファイルを二重に送らない）。
+    False を返した場合、呼び出し側は送信後に必ず release_sent_reservation を呼ぶこと。
     
     Args:
         file_digest (str): ファイルのハッシュ値
@@ -353,16 +513,36 @@ def check_already_sent(file_digest, file_name):
     Returns:
         bool: 送信済みの場合はTrue
     """
-    cache = load_sent_cache()
+    while True:
+        with _sent_cache_lock:
+            cache = load_sent_cache()
+            in_flight = _sent_in_flight.get(file_digest)
+            if file_digest not in cache and in_flight is None:
+                _sent_in_flight[file_digest] = threading.Event()
+                return False
+        if in_flight is None:
+            break
+        print(f"⏳ 同じ内容のファイルを送信中のため完了を待ちます: {file_name}")
+        in_flight.wait()
     
-    if file_digest in cache:
-        sent_info = cache[file_digest]
-        sent_time = datetime.datetime.fromtimestamp(sent_info.get('sent_time', 0))
-        print(f"⚠️ 既に送信済みとしてスキップ: {file_name}")
-        print(f"   前回送信日時: {sent_time.strftime('%Y/%m/%d %H:%M:%S')}")
-        print(f"   ハッシュ値: {file_digest[:16]}...")
-        return True
-    return False
+    sent_info = cache[file_digest]
+    sent_time = datetime.datetime.fromtimestamp(sent_info.get('sent_time', 0))
+    print(f"⚠️ 既に送信済みとしてスキップ: {file_name}")
+    print(f"   前回送信日時: {sent_time.strftime('%Y/%m/%d %H:%M:%S')}")
+    print(f"   ハッシュ値: {file_digest[:16]}...")
+    return True
+
+def release_sent_reservation(file_digest):
+    """
+    check_already_sent で取った送信中の予約を解除し、待っているスレッドに知らせる
+    
+    Args:
+        file_digest (str): ファイルのハッシュ値
+    """
+    with _sent_cache_lock:
+        in_flight = _sent_in_flight.pop(file_digest, None)
+    if in_flight is not None:
+        in_flight.set()
 
 def mark_as_sent(file_digest, file_name):
     """
@@ -372,32 +552,135 @@ def mark_as_sent(file_digest, file_name):
         file_digest (str): ファイルのハッシュ値
         file_name (str): ファイル名
     """
-    cache = load_sent_cache()
-    cache[file_digest] = {
-        'file_name': file_name,
-        'sent_time': int(time.time())
-    }
-    save_sent_cache(cache)
+    with _sent_cache_lock:
+        cache = load_sent_cache()
+        cache[file_digest] = {
+            'file_name': file_name,
+            'sent_time': int(time.time())
+        }
+        save_sent_cache(cache)
+
+# このスクリプトは単体で配置・実行する（他のスクリプトを import しない）ため、レート制限もここに持つ
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限（スレッドセーフ）
+
+    最大 capacity 個まで貯まり、1分あたり rate_per_minute 個のペースで補充される。
+    """
+
+    def __init__(self, rate_per_minute, capacity=1):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.rate_per_sec = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得（不足している場合は補充されるまで待機）"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_sec)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate_per_sec
+            time.sleep(wait_seconds)
+
+def run_folder_transfer(filtered_files, transfer_file):
+    """
+    フォルダ内ファイルを先読みしながら転送
+
+    ダウンロードはワーカープールで TRANSFER_WORKERS 件先まで先読みし、送信・削除は
+    フォルダの並び（名前順）のまま1件ずつ行う（トークルームに届く順番を変えない）。
+    送信中に後続ファイルのダウンロードが進む。一時ファイルは先読み分だけ同時に持つ。
 
-def send_file_to_araichat(file_data, file_name):
+    Args:
+        filtered_files (list): 送信対象のファイル情報リスト
+        transfer_file (callable): (ファイル情報, ダウンロード済みファイルハンドル or None) を受け取り結果dictを返す関数
+
+    Returns:
+        list: filtered_files と同じ順序の転送結果（{'sent': bool, 'deleted': bool}）
+    """
+    total = len(filtered_files)
+    ahead = max(1, TRANSFER_WORKERS)
+    results = []
+    downloads = {}
+
+    def prefetch(i):
+        if i < total:
+            downloads[i] = executor.submit(download_file_from_google_drive, filtered_files[i]['id'])
+
+    with ThreadPoolExecutor(max_workers=ahead, thread_name_prefix="download") as executor:
+        try:
+            for i in range(ahead):
+                prefetch(i)
+            for i, file_info in enumerate(filtered_files):
+                prefetch(i + ahead)
+                file_name = file_info['name']
+                try:
+                    file_obj, _ = downloads.pop(i).result()
+                except Exception as e:
+                    print(f"❌ {file_name} ダウンロード中にエラー: {str(e)}")
+                    file_obj = None
+                try:
+                    results.append(transfer_file(file_info, file_obj))
+                except Exception as e:
+                    print(f"❌ {file_name} 転送中にエラー: {str(e)}")
+                    results.append({'sent': False, 'deleted': False})
+                print(f"[{i + 1}/{total}] 処理完了: {file_name}")
+        finally:
+            # 中断時は先読み済みの一時ファイルを解放する
+            for future in downloads.values():
+                if future.cancel() or future.exception() is not None:
+                    continue
+                file_obj, _ = future.result()
+                if file_obj is not None:
+                    file_obj.close()
+
+    return results
+
+# ARAICHAT APIのリクエスト間隔を制御するトークンバケット（全スレッド共有）
+araichat_rate_limiter = TokenBucket(ARAICHAT_API_RATE_PER_MINUTE, capacity=ARAICHAT_API_BURST)
+
+def send_file_to_araichat(file_obj, file_name):
     """
     ファイルデータをARAICHATに送信（リトライ処理＋重複防止付き）
 
     Args:
-        file_data (bytes): アップロードするファイルのバイトデータ
+        file_obj: アップロードするファイルのハンドル（download_file_from_google_drive の戻り値）
         file_name (str): ファイル名
 
     Returns:
         bool: 成功時はTrue、失敗時はFalse（既に送信済みの場合はTrue）
     """
     # ファイルのハッシュ値を計算（重複チェック用）
-    file_digest = calculate_file_digest(file_data, file_name)
+    file_digest = calculate_file_digest(file_obj, file_name)
     
-    # 既に送信済みかチェック
+    # 既に送信済みかチェック（未送信なら送信中として予約）
     if check_already_sent(file_digest, file_name):
         print(f"✅ 既に送信済みのためスキップ: {file_name}")
         return True
-    
+    try:
+        return post_file_to_araichat(file_obj, file_name, file_digest)
+    finally:
+        release_sent_reservation(file_digest)
+
+def post_file_to_araichat(file_obj, file_name, file_digest):
+    """
+    ARAICHATへファイルを送信する本体（リトライ処理付き、成功時に送信履歴へ記録）
+
+    Args:
+        file_obj: アップロードするファイルのハンドル
+        file_name (str): ファイル名
+        file_digest (str): ファイルのハッシュ値
+
+    Returns:
+        bool: 成功時はTrue、失敗時はFalse
+    """
     # 環境変数の確認
     print(f"=== ARAICHAT送信設定確認 ===")
     print(f"BASE_URL: {ARAICHAT_BASE_URL}")
@@ -427,7 +710,7 @@ def send_file_to_araichat(file_data, file_name):
     data = {"text": f"Google Driveからファイルを送信: {file_name}"}
     
     print(f"送信URL: {url}")
-    print(f"ファイルサイズ: {len(file_data)} bytes")
+    print(f"ファイルサイズ: {get_stream_size(file_obj)} bytes")
     print(f"ファイルハッシュ: {file_digest[:16]}...")
     print(f"ARAICHATへファイル送信開始: {file_name}")
     
@@ -439,8 +722,8 @@ def send_file_to_araichat(file_data, file_name):
     
     for attempt in range(1, max_retries + 1):
         try:
-            # ファイルデータをBytesIOで作成（毎回新規作成が必要）
-            files = [("files", (file_name, io.BytesIO(file_data), "text/html"))]
+            # 本文はファイルハンドルから逐次送信（リトライ時も先頭から読み直すため毎回作成）
+            body, content_type = build_multipart_stream("files", file_name, file_obj, "text/html", fields=data)
             
             # タイムアウトを個別に設定（接続タイムアウトと読み取りタイムアウト）
             timeout = (timeout_connect, timeout_read)
@@ -450,8 +733,11 @@ def send_file_to_araichat(file_data, file_name):
                 print(f"⏳ リトライ {attempt}/{max_retries}（{wait_time}秒待機後）...")
                 time.sleep(wait_time)
             
+            araichat_rate_limiter.acquire()
             start_time = time.time()
-            resp = requests.post(url, headers=headers, data=data, files=files, timeout=timeout)
+            resp = requests.post(
+                url, headers={**headers, "Content-Type": content_type}, data=body, timeout=timeout
+            )
             elapsed_time = time.time() - start_time
             
             # レスポンス詳細をログ出力
@@ -556,6 +842,47 @@ def delete_file_from_google_drive(file_id, file_name):
         # 削除エラーは重大ではないため、メール通知はスキップ
         return False
 
+def transfer_file_to_araichat(file_info, file_obj):
+    """
+    フォルダ一括送信の1ファイル分の処理（送信 → 成功時に削除）
+
+    Args:
+        file_info (dict): Google Driveのファイル情報
+        file_obj: run_folder_transfer が先読みしたファイルハンドル（ダウンロード失敗時は None）
+
+    Returns:
+        dict: {'sent': bool, 'deleted': bool}
+    """
+    file_id = file_info['id']
+    file_name = file_info['name']
+
+    print(f"\n送信中: {file_name}")
+
+    if file_obj is None:
+        print(f"❌ {file_name} ダウンロード失敗 - ファイル送信をスキップ")
+        return {'sent': False, 'deleted': False}
+
+    # ARAICHATに送信（送信後は一時ファイルをすぐに解放）
+    with file_obj:
+        sent = send_file_to_araichat(file_obj, file_name)
+    if not sent:
+        print(f"❌ {file_name} 送信失敗")
+        return {'sent': False, 'deleted': False}
+
+    print(f"✅ {file_name} 送信完了")
+    deleted = False
+
+    # 送信成功時の処理
+    if DELETE_AFTER_UPLOAD:
+        print(f"配信成功により削除実行: {file_name}")
+        deleted = delete_file_from_google_drive(file_id, file_name)
+        if not deleted:
+            print(f"⚠️ ファイル削除失敗（手動で削除してください）: {file_name}")
+    else:
+        print(f"✅ {file_name} 送信完了 - ファイル保持")
+
+    return {'sent': True, 'deleted': deleted}
+
 def send_folder_files_to_araichat(folder_id, file_filter=None):
     """
     Google Driveフォルダ内のファイルをARAICHATに送信
@@ -588,46 +915,18 @@ def send_folder_files_to_araichat(folder_id, file_filter=None):
         failed_files = []
         deleted_files = []
 
-        print(f"\n送信対象HTMLファイル: {len(filtered_files)}件")
+        print(f"\n送信対象HTMLファイル: {len(filtered_files)}件（ダウンロード先読み: {TRANSFER_WORKERS}件）")
         print("=" * 50)
 
-        for i, file_info in enumerate(filtered_files, 1):
-            file_id = file_info['id']
-            file_name = file_info['name']
-
-            print(f"\n[{i}/{len(filtered_files)}] 送信中: {file_name}")
-            
-            # ファイルをダウンロード
-            file_data, _ = download_file_from_google_drive(file_id)
-            if not file_data:
-                failed_files.append(file_name)
-                print(f"❌ {file_name} ダウンロード失敗 - ファイル送信をスキップ")
-                continue
+        results = run_folder_transfer(filtered_files, transfer_file_to_araichat)
 
-            # ARAICHATに送信
-            result = send_file_to_araichat(file_data, file_name)
-
-            if result:
-                sent_files.append(file_name)
-                print(f"✅ {file_name} 送信完了")
-                
-                # 送信成功時の処理
-                if DELETE_AFTER_UPLOAD:
-                    print(f"配信成功により削除実行: {file_name}")
-                    if delete_file_from_google_drive(file_id, file_name):
-                        deleted_files.append(file_name)
-                    else:
-                        print(f"⚠️ ファイル削除失敗（手動で削除してください）: {file_name}")
-                else:
-                    print(f"✅ {file_name} 送信完了 - ファイル保持")
+        for file_info, result in zip(filtered_files, results):
+            if result['sent']:
+                sent_files.append(file_info['name'])
             else:
-                failed_files.append(file_name)
-                print(f"❌ {file_name} 送信失敗")
-
-            # 送信間隔を空ける（API制限対策）
-            if i < len(filtered_files):
-                print("次のファイル送信まで2秒待機...")
-                time.sleep(2)
+                failed_files.append(file_info['name'])
+            if result['deleted']:
+                deleted_files.append(file_info['name'])
 
         print(f"\n=== 送信結果 ===")
         print(f"成功: {len(sent_files)}件")
@@ -681,13 +980,14 @@ def send_file_to_araichat_single(file_id=None):
         print("=== Google Driveからファイル取得 ===")
         print(f"ファイルID: {actual_file_id}")
 
-        file_data, file_name = download_file_from_google_drive(actual_file_id)
-        if not file_data:
+        file_obj, file_name = download_file_from_google_drive(actual_file_id)
+        if file_obj is None:
             print("Google Driveからのファイル取得に失敗しました")
             return False
 
         print("\n=== ARAICHATファイル送信 ===")
-        success = send_file_to_araichat(file_data, file_name)
+        with file_obj:
+            success = send_file_to_araichat(file_obj, file_name)
 
         if success:
             print("\n✅ ファイル送信が正常に完了しました")
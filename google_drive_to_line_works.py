@@ -2,8 +2,14 @@ import requests
 import jwt
 import time
 import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 from pathlib import Path
 import io
+import tempfile
+import uuid
 import shutil
 import gc
 import datetime
@@ -13,7 +19,9 @@ import traceback
 import sys
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.http import MediaIoBaseDownload, HttpRequest
+import google_auth_httplib2
+import httplib2
 from dotenv import load_dotenv
 
 # .envファイルから環境変数を読み込み
@@ -100,12 +108,42 @@ audience = "https://auth.worksmobile.com/oauth2/v2.0/token"
 service_account = os.getenv("LINE_WORKS_SERVICE_ACCOUNT", "2z1nf.serviceaccount@araiseimitsu")
 private_key_path = Path(os.getenv("LINE_WORKS_PRIVATE_KEY_PATH", "private_20250722104854.key"))
 
+# アクセストークンのキャッシュ設定
+# 有効期限の少し手前まで再利用し、次回以降の定期実行でも使えるようファイルに保存する
+LINE_WORKS_TOKEN_CACHE_FILE = Path(os.getenv(
+    "LINE_WORKS_TOKEN_CACHE_FILE",
+    str(Path(__file__).parent / "lineworks_token_cache.json")
+))
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("LINE_WORKS_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+# フォルダ一括送信でのダウンロードの先読み数と、LINE WORKS APIのレート制限（1分あたりのリクエスト数）
+TRANSFER_WORKERS = int(os.getenv("DRIVE_TRANSFER_WORKERS", "4"))
+LINE_WORKS_API_RATE_PER_MINUTE = float(os.getenv("LINE_WORKS_API_RATE_PER_MINUTE", "240"))
+LINE_WORKS_API_BURST = int(os.getenv("LINE_WORKS_API_BURST", "5"))
+
+# LINE WORKS APIのベースURL（テスト時はローカルのスタブサーバーを指定可能）
+LINE_WORKS_API_BASE_URL = os.getenv("LINE_WORKS_API_BASE_URL", "https://www.worksapis.com/v1.0").rstrip("/")
+# アクセストークン取得先（JWT の aud は常に正式なトークンエンドポイント＝audience のまま）
+LINE_WORKS_TOKEN_URL = os.getenv("LINE_WORKS_TOKEN_URL", audience)
+
+# アップロード先ホストごとに成功したアップロード方式を記録するファイル
+UPLOAD_STRATEGY_CACHE_FILE = Path(os.getenv(
+    "LINE_WORKS_UPLOAD_STRATEGY_CACHE_FILE",
+    str(Path(__file__).parent / "lineworks_upload_strategy.json")
+))
+
 # Google Drive設定
 GOOGLE_SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY_FILE", "aptest-384703-24764f69b34f.json")
 GOOGLE_DRIVE_SCOPES = [
     'https://www.googleapis.com/auth/drive'  # フルアクセス（読み取り、書き込み、削除）
 ]
 
+# ダウンロードファイルの一時保存設定
+# 閾値まではメモリ上、超えた分はディスク上の一時ファイルに保持する（ファイルサイズに関わらずメモリ使用量を一定に保つ）
+DRIVE_SPOOL_MAX_MEMORY_BYTES = int(float(os.getenv("DRIVE_SPOOL_MAX_MEMORY_MB", "4")) * 1024 * 1024)
+DRIVE_DOWNLOAD_CHUNK_BYTES = int(float(os.getenv("DRIVE_DOWNLOAD_CHUNK_MB", "1")) * 1024 * 1024)
+
+
 # 送信対象の設定（フォルダ対応版）
 # 単一ファイル指定（既存）
 target_google_drive_file_id = "1Sdqhu6zG8LhzILklNt_TvNp1ySjRFR-G"
@@ -362,46 +400,94 @@ def cleanup_folder_contents(folder_path):
         return False
 
 
+# Google Drive APIクライアント（プロセス内で1回だけ生成して共有）
+_drive_service = None
+_drive_credentials = None
+_drive_service_lock = threading.Lock()
+_drive_http_local = threading.local()
+
+
+def _get_authorized_http():
+    """
+    呼び出し元スレッドの認証済みHTTPトランスポートを返す
+
+    httplib2.Http はスレッドセーフではないため、資格情報は全体で共有しつつ
+    トランスポートはスレッドごとに1つだけ作成し、そのスレッドの全リクエストで使い回す。
+    """
+    http = getattr(_drive_http_local, "http", None)
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(_drive_credentials, http=httplib2.Http())
+        _drive_http_local.http = http
+    return http
+
+
+def _build_drive_request(http, *args, **kwargs):
+    """build()のrequestBuilder: リクエストを呼び出し元スレッドのトランスポートで生成"""
+    return HttpRequest(_get_authorized_http(), *args, **kwargs)
+
+
 def get_google_drive_service():
     """
     Google Drive APIサービスオブジェクトを取得
 
+    初回呼び出し時にのみサービスアカウントJSONを読み込み、同梱の静的ディスカバリー
+    ドキュメントでクライアントを生成する。以降は同じクライアントを返す（スレッドセーフ）。
+
     Returns:
         googleapiclient.discovery.Resource: Google Drive APIサービス
     """
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        service_account_file = os.path.join(base_dir, GOOGLE_SERVICE_ACCOUNT_FILE)
+    global _drive_service, _drive_credentials
 
-        if not os.path.exists(service_account_file):
-            raise FileNotFoundError(f"Google サービスアカウントファイルが見つかりません: {service_account_file}")
+    if _drive_service is not None:
+        return _drive_service
 
-        credentials = Credentials.from_service_account_file(
-            service_account_file,
-            scopes=GOOGLE_DRIVE_SCOPES
-        )
+    with _drive_service_lock:
+        if _drive_service is not None:
+            return _drive_service
 
-        service = build('drive', 'v3', credentials=credentials)
-        print("Google Drive APIサービスの初期化完了")
-        return service
+        try:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            service_account_file = os.path.join(base_dir, GOOGLE_SERVICE_ACCOUNT_FILE)
 
-    except Exception as e:
-        error_msg = f"Google Drive APIサービスの初期化エラー: {str(e)}"
-        print(error_msg)
-        send_error_email(f"Google Drive API初期化エラー:\n{error_msg}")
-        return None
+            if not os.path.exists(service_account_file):
+                raise FileNotFoundError(f"Google サービスアカウントファイルが見つかりません: {service_account_file}")
+
+            _drive_credentials = Credentials.from_service_account_file(
+                service_account_file,
+                scopes=GOOGLE_DRIVE_SCOPES
+            )
+
+            _drive_service = build(
+                'drive', 'v3',
+                http=_get_authorized_http(),
+                requestBuilder=_build_drive_request,
+                static_discovery=True
+            )
+            print("Google Drive APIサービスの初期化完了")
+            return _drive_service
+
+        except Exception as e:
+            error_msg = f"Google Drive APIサービスの初期化エラー: {str(e)}"
+            print(error_msg)
+            send_error_email(f"Google Drive API初期化エラー:\n{error_msg}")
+            return None
 
 
 def download_file_from_google_drive(file_id):
     """
-    Google Driveからファイルをダウンロードしてバイトデータとファイル名を取得
+    Google Driveからファイルを一時ファイルへストリーミングダウンロード
+
+    ファイル全体をメモリに載せず、DRIVE_DOWNLOAD_CHUNK_BYTES ずつ SpooledTemporaryFile へ
+    書き込む（DRIVE_SPOOL_MAX_MEMORY_BYTES を超えるとディスクへ切り替わる）。
+    返したファイルハンドルは呼び出し側で close() すること。
 
     Args:
         file_id (str): Google DriveのファイルID
 
     Returns:
-        tuple: (file_data: bytes, file_name: str) 成功時、(None, None) 失敗時
+        tuple: (file_obj: 先頭に巻き戻したファイルハンドル, file_name: str) 成功時、(None, None) 失敗時
     """
+    file_data = None
     try:
         service = get_google_drive_service()
         if not service:
@@ -422,8 +508,8 @@ def download_file_from_google_drive(file_id):
         # ファイルの内容をダウンロード
         print("ファイルダウンロード開始...")
         request = service.files().get_media(fileId=file_id)
-        file_data = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_data, request)
+        file_data = tempfile.SpooledTemporaryFile(max_size=DRIVE_SPOOL_MAX_MEMORY_BYTES)
+        downloader = MediaIoBaseDownload(file_data, request, chunksize=DRIVE_DOWNLOAD_CHUNK_BYTES)
 
         done = False
         while done is False:
@@ -431,12 +517,14 @@ def download_file_from_google_drive(file_id):
             if status:
                 print(f"ダウンロード進行状況: {int(status.progress() * 100)}%")
 
-        file_bytes = file_data.getvalue()
-        print(f"ダウンロード完了: {len(file_bytes)} bytes取得")
+        print(f"ダウンロード完了: {file_data.tell()} bytes取得")
+        file_data.seek(0)
 
-        return file_bytes, file_name
+        return file_data, file_name
 
     except Exception as e:
+        if file_data is not None:
+            file_data.close()
         error_msg = f"Google Driveファイルダウンロードエラー: {str(e)}"
         print(error_msg)
         send_error_email(f"Google Driveファイルダウンロードエラー:\n{error_msg}")
@@ -536,17 +624,205 @@ def apply_file_filter(files, file_filter):
     return filtered_files
 
 
-def upload_file_to_lineworks(access_token, file_data, file_name):
+def get_stream_size(file_obj):
+    """
+    ファイルハンドルのサイズを取得（読み取り位置は先頭に戻す）
+
+    Args:
+        file_obj: シーク可能なファイルハンドル
+
+    Returns:
+        int: ファイルサイズ（bytes）
+    """
+    file_obj.seek(0, os.SEEK_END)
+    file_size = file_obj.tell()
+    file_obj.seek(0)
+    return file_size
+
+
+class UploadStream:
+    """
+    複数のバイト列・ファイルハンドルを連結して順に read() で返すアップロード用ストリーム
+
+    ファイル本体はメモリへコピーせずハンドルから直接読み出す。__len__ を持つため
+    requests は Content-Length 付きで逐次送信する（SpooledTemporaryFile を直接渡すと
+    サイズ取得時に fileno() でディスクへ書き出されるため、このラッパー経由で渡す）。
+    """
+
+    def __init__(self, parts):
+        self._parts = []
+        self._length = 0
+        for part in parts:
+            if isinstance(part, bytes):
+                self._length += len(part)
+                part = io.BytesIO(part)
+            else:
+                self._length += get_stream_size(part)
+            self._parts.append(part)
+        self._index = 0
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while self._index < len(self._parts) and size != 0:
+            data = self._parts[self._index].read(size)
+            if not data:
+                self._index += 1
+                continue
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(chunks)
+
+
+def build_multipart_stream(field_name, file_name, file_obj, content_type, fields=None):
+    """
+    multipart/form-data の本文をファイルハンドルから逐次送信するストリームを作成
+
+    requests の files= は本文全体をメモリ上で組み立てるため、その代わりに使う。
+
+    Args:
+        field_name (str): ファイルのフォーム項目名
+        file_name (str): ファイル名
+        file_obj: ファイルハンドル（先頭から送信）
+        content_type (str): ファイルのContent-Type
+        fields (dict, optional): ファイル以外のフォーム項目
+
+    Returns:
+        tuple: (UploadStream, Content-Typeヘッダー値)
+    """
+    boundary = uuid.uuid4().hex
+    # ファイル名はHTML5の形式でエスケープ（requests/urllib3と同じ）
+    quoted_name = file_name.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+    head = ""
+    for name, value in (fields or {}).items():
+        head += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+    head += (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field_name}"; filename="{quoted_name}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    )
+    tail = f'\r\n--{boundary}--\r\n'
+
+    stream = UploadStream([head.encode('utf-8'), file_obj, tail.encode('utf-8')])
+    return stream, f"multipart/form-data; boundary={boundary}"
+
+
+# ファイル本体アップロード方式の一覧（上から順に試行）
+# name はキャッシュファイルに保存するキー
+UPLOAD_STRATEGIES = [
+    {"name": "put_bearer", "label": "PUT + Bearer Token", "method": "PUT", "auth": True, "multipart": False},
+    {"name": "put", "label": "PUT + 認証なし", "method": "PUT", "auth": False, "multipart": False},
+    {"name": "post_bearer", "label": "POST + Bearer Token", "method": "POST", "auth": True, "multipart": False},
+    {"name": "post", "label": "POST + 認証なし", "method": "POST", "auth": False, "multipart": False},
+    {"name": "post_multipart", "label": "POST + multipart/form-data", "method": "POST", "auth": True, "multipart": True},
+]
+
+_upload_strategy_lock = threading.Lock()
+_upload_strategy_cache = None
+
+
+def load_upload_strategy_cache():
+    """
+    ホストごとの成功アップロード方式を読み込む（プロセス内では初回のみファイルを読む）
+
+    Returns:
+        dict: キー: アップロード先ホスト, 値: 方式名
+    """
+    global _upload_strategy_cache
+    with _upload_strategy_lock:
+        if _upload_strategy_cache is None:
+            _upload_strategy_cache = {}
+            if UPLOAD_STRATEGY_CACHE_FILE.exists():
+                try:
+                    with open(UPLOAD_STRATEGY_CACHE_FILE, 'r', encoding='utf-8') as f:
+                        _upload_strategy_cache = json.load(f)
+                except Exception as e:
+                    print(f"⚠️ アップロード方式キャッシュ読み込みエラー: {e}")
+        return dict(_upload_strategy_cache)
+
+
+def remember_upload_strategy(host, strategy_name):
+    """
+    成功したアップロード方式を記録（変化があった場合のみ一時ファイル経由でファイルへ保存）
+
+    Args:
+        host (str): アップロード先ホスト
+        strategy_name (str): 方式名（UPLOAD_STRATEGIES の name）
+    """
+    load_upload_strategy_cache()
+    with _upload_strategy_lock:
+        if _upload_strategy_cache.get(host) == strategy_name:
+            return
+        _upload_strategy_cache[host] = strategy_name
+        try:
+            UPLOAD_STRATEGY_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = UPLOAD_STRATEGY_CACHE_FILE.with_name(UPLOAD_STRATEGY_CACHE_FILE.name + ".tmp")
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(_upload_strategy_cache, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, UPLOAD_STRATEGY_CACHE_FILE)
+        except Exception as e:
+            print(f"⚠️ アップロード方式キャッシュ保存エラー: {e}")
+
+
+def order_upload_strategies(host):
+    """
+    前回成功した方式を先頭にしたアップロード方式の試行順を返す
+
+    Args:
+        host (str): アップロード先ホスト
+
+    Returns:
+        list: UPLOAD_STRATEGIES の要素を並べ替えたリスト
+    """
+    preferred = load_upload_strategy_cache().get(host)
+    return sorted(UPLOAD_STRATEGIES, key=lambda strategy: strategy["name"] != preferred)
+
+
+def send_upload_request(strategy, upload_url, access_token, file_obj, file_name):
+    """
+    指定した方式でファイル本体をアップロード（ファイルハンドルから逐次送信）
+
+    Args:
+        strategy (dict): UPLOAD_STRATEGIES の要素
+        upload_url (str): メタデータ登録で取得したuploadURL
+        access_token (str): LINE WORKS APIのアクセストークン
+        file_obj: アップロードするファイルのハンドル（毎回先頭から送信）
+        file_name (str): ファイル名
+
+    Returns:
+        requests.Response: アップロードのレスポンス
+    """
+    headers = {}
+    if strategy["auth"]:
+        headers["Authorization"] = f"Bearer {access_token}"
+
+    if strategy["multipart"]:
+        body, headers["Content-Type"] = build_multipart_stream(
+            "file", file_name, file_obj, "application/octet-stream"
+        )
+    else:
+        headers["Content-Type"] = "application/octet-stream"
+        body = UploadStream([file_obj])
+
+    return requests.request(strategy["method"], upload_url, headers=headers, data=body)
+
+
+def upload_file_to_lineworks(access_token, file_obj, file_name):
     """
     ファイルデータをLINE WORKSにアップロードしてファイルIDを取得
 
     LINE WORKSのファイルアップロードは2段階で行われます：
     1. メタデータ登録: ファイル情報を事前に登録し、uploadURLを取得
-    2. ファイル本体アップロード: 取得したuploadURLにPUTリクエストでファイルを送信
+    2. ファイル本体アップロード: 取得したuploadURLにファイルを送信
+       （アップロード先ホストごとに前回成功した方式を先に試し、失敗時のみ他の方式へ切り替える）
 
     Args:
         access_token (str): LINE WORKS APIのアクセストークン
-        file_data (bytes): アップロードするファイルのバイトデータ
+        file_obj: アップロードするファイルのハンドル（download_file_from_google_drive の戻り値）
         file_name (str): ファイル名
 
     Returns:
@@ -555,8 +831,8 @@ def upload_file_to_lineworks(access_token, file_data, file_name):
     try:
         # ① 添付メタデータ登録
         # ファイル情報を事前に登録し、アップロード用のURLを取得
-        meta_url = f"https://www.worksapis.com/v1.0/bots/{BOT_ID}/attachments"
-        file_size = len(file_data)
+        meta_url = f"{LINE_WORKS_API_BASE_URL}/bots/{BOT_ID}/attachments"
+        file_size = get_stream_size(file_obj)
 
         # メタデータリクエストボディ
         meta_body = {
@@ -566,12 +842,13 @@ def upload_file_to_lineworks(access_token, file_data, file_name):
         }
 
         meta_headers = {
-            "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
 
         print(f"メタデータ登録開始: {file_name} ({file_size} bytes)")
-        meta_resp = requests.post(meta_url, headers=meta_headers, json=meta_body)
+        meta_resp, access_token = lineworks_api_request(
+            "POST", meta_url, access_token, headers=meta_headers, json=meta_body
+        )
         print(f"メタ登録レスポンス: {meta_resp.status_code}")
         print(f"レスポンス内容: {meta_resp.text}")
 
@@ -601,110 +878,43 @@ def upload_file_to_lineworks(access_token, file_data, file_name):
         print(f"ファイル本体アップロード開始: {upload_url}")
 
         # URLの詳細分析
+        parsed_url = urlparse(upload_url)
+        upload_host = parsed_url.netloc
         print(f"uploadURL詳細分析:")
-        try:
-            from urllib.parse import urlparse
-            parsed_url = urlparse(upload_url)
-            print(f"  ドメイン: {parsed_url.netloc}")
-            print(f"  パス: {parsed_url.path}")
-        except Exception as e:
-            print(f"  URL解析エラー: {e}")
-            print(f"  元のURL: {upload_url}")
-
-        print(f"アップロードするファイルサイズ: {len(file_data)} bytes")
-
-        # 複数のHTTPメソッドと認証方式を試行
-        methods_to_try = [
-            # PUT方式
-            {
-                "method": "PUT",
-                "name": "PUT + Bearer Token",
-                "headers": {
-                    "Content-Type": "application/octet-stream",
-                    "Authorization": f"Bearer {access_token}"
-                },
-                "data": file_data
-            },
-            {
-                "method": "PUT",
-                "name": "PUT + 認証なし",
-                "headers": {
-                    "Content-Type": "application/octet-stream"
-                },
-                "data": file_data
-            },
-            # POST方式
-            {
-                "method": "POST",
-                "name": "POST + Bearer Token",
-                "headers": {
-                    "Content-Type": "application/octet-stream",
-                    "Authorization": f"Bearer {access_token}"
-                },
-                "data": file_data
-            },
-            {
-                "method": "POST",
-                "name": "POST + 認証なし",
-                "headers": {
-                    "Content-Type": "application/octet-stream"
-                },
-                "data": file_data
-            },
-            {
-                "method": "POST",
-                "name": "POST + multipart/form-data",
-                "headers": {
-                    "Authorization": f"Bearer {access_token}"
-                },
-                "files": {"file": (file_name, file_data, "application/octet-stream")}
-            }
-        ]
+        print(f"  ドメイン: {upload_host}")
+        print(f"  パス: {parsed_url.path}")
 
-        success = False
-        for method in methods_to_try:
-            print(f"\n試行中: {method['name']}")
-            print(f"HTTPメソッド: {method['method']}")
-            print(f"ヘッダー: {method['headers']}")
+        print(f"アップロードするファイルサイズ: {file_size} bytes")
 
-            try:
-                if method['method'] == 'PUT':
-                    if "files" in method:
-                        resp = requests.put(upload_url, headers=method['headers'], files=method['files'])
-                    else:
-                        resp = requests.put(upload_url, headers=method['headers'], data=method['data'])
-                else:  # POST
-                    if "files" in method:
-                        resp = requests.post(upload_url, headers=method['headers'], files=method['files'])
-                    else:
-                        resp = requests.post(upload_url, headers=method['headers'], data=method['data'])
+        # 前回成功した方式から試行し、失敗した場合のみ残りの方式へフォールバック
+        for strategy in order_upload_strategies(upload_host):
+            print(f"\n試行中: {strategy['label']}")
 
+            try:
+                resp = send_upload_request(strategy, upload_url, access_token, file_obj, file_name)
                 print(f"レスポンス: {resp.status_code}")
 
                 if resp.status_code in (200, 201):
-                    print(f"✅ {method['name']}で成功!")
+                    print(f"✅ {strategy['label']}で成功!")
                     print(f"ファイルアップロード成功: {file_name} (ID: {file_id})")
-                    success = True
-                    break
+                    remember_upload_strategy(upload_host, strategy["name"])
+                    return file_id
                 else:
-                    print(f"❌ {method['name']}失敗: {resp.text}")
+                    print(f"❌ {strategy['label']}失敗: {resp.text}")
 
             except Exception as e:
-                print(f"❌ {method['name']}でエラー: {str(e)}")
+                print(f"❌ {strategy['label']}でエラー: {str(e)}")
 
-        if success:
-            return file_id
-        else:
-            print(f"\n全てのメソッドが失敗しました")
+        print(f"\n全てのメソッドが失敗しました")
 
-            # 最後の手段: URLを直接解析して問題を特定
-            print(f"\n=== デバッグ情報 ===")
-            print(f"取得したuploadURL: {upload_url}")
-            print(f"アクセストークンの最初の50文字: {access_token[:50]}...")
-            print(f"ファイルサイズ: {len(file_data)} bytes")
-            print(f"ファイル名: {file_name}")
+        # 最後の手段: URLを直接解析して問題を特定
+        print(f"\n=== デバッグ情報 ===")
+        print(f"取得したuploadURL: {upload_url}")
+        print(f"アクセストークンの最初の50文字: {access_token[:50]}...")
+        print(f"ファイルサイズ: {file_size} bytes")
+        print(f"ファイル名: {file_name}")
 
-            return None
+        return None
 
     except requests.exceptions.RequestException as e:
         error_msg = f"LINE WORKSアップロードネットワークエラー: {str(e)}"
@@ -733,10 +943,9 @@ def send_file_message(access_token, room_id, file_id, file_name):
     """
     try:
         # メッセージ送信用URL
-        message_url = f"https://www.worksapis.com/v1.0/bots/{BOT_ID}/channels/{room_id}/messages"
+        message_url = f"{LINE_WORKS_API_BASE_URL}/bots/{BOT_ID}/channels/{room_id}/messages"
 
         headers = {
-            "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
 
@@ -750,7 +959,7 @@ def send_file_message(access_token, room_id, file_id, file_name):
         }
 
         print(f"ファイルメッセージ送信開始: {file_name}")
-        resp = requests.post(message_url, headers=headers, json=message_data)
+        resp, _ = lineworks_api_request("POST", message_url, access_token, headers=headers, json=message_data)
 
         if resp.status_code in (200, 201):
             print(f"ファイルメッセージ送信成功: {file_name}")
@@ -772,19 +981,21 @@ def send_file_message(access_token, room_id, file_id, file_name):
         return False
 
 
-def get_access_token():
+def request_access_token():
     """
-    LINE WORKS APIのアクセストークンを取得
+    JWTを生成し、トークンエンドポイントから新しいアクセストークンを取得
+
+    通常は get_access_token() 経由でキャッシュ済みのトークンを使うこと。
 
     Returns:
-        str: 成功時はアクセストークン、失敗時はNone
+        tuple: (access_token: str, expires_in: int) 成功時、(None, None) 失敗時
     """
     try:
         # 1. JWT生成
         # Service Accountを使用してJWTトークンを生成
         if not private_key_path.exists():
             print(f"秘密鍵ファイルが見つかりません: {private_key_path}")
-            return None
+            return None, None
 
         with open(private_key_path, "r") as f:
             private_key = f.read()
@@ -808,7 +1019,7 @@ def get_access_token():
         # 2. アクセストークン取得
         # JWTを使用してOAuth2.0のアクセストークンを取得
         print("アクセストークン取得中...")
-        token_url = "https://auth.worksmobile.com/oauth2/v2.0/token"
+        token_url = LINE_WORKS_TOKEN_URL
         token_data = {
             "assertion": jwt_token,
             "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
@@ -837,33 +1048,319 @@ def get_access_token():
         if "expires_in" in token_json:
             print(f"  expires_in: {token_json['expires_in']}秒")
 
-        return access_token
+        expires_in = int(token_json.get("expires_in", 3600))
+        return access_token, expires_in
 
     except FileNotFoundError as e:
         error_msg = f"LINE WORKS秘密鍵ファイルが見つかりません: {str(e)}"
         print(error_msg)
         send_error_email(f"LINE WORKS認証エラー:\n{error_msg}")
-        return None
+        return None, None
     except (AttributeError, ValueError, jwt.InvalidSignatureError, jwt.InvalidKeyError) as e:
         error_msg = f"JWT生成エラー: {str(e)}"
         print(error_msg)
         send_error_email(f"LINE WORKS認証エラー:\n{error_msg}")
-        return None
+        return None, None
     except requests.exceptions.RequestException as e:
         error_msg = f"LINE WORKSアクセストークン取得ネットワークエラー: {str(e)}"
         print(error_msg)
         send_error_email(f"LINE WORKS認証エラー:\n{error_msg}")
-        return None
+        return None, None
     except KeyError as e:
         error_msg = f"LINE WORKSアクセストークンレスポンスエラー: {str(e)}"
         print(error_msg)
         send_error_email(f"LINE WORKS認証エラー:\n{error_msg}")
-        return None
+        return None, None
     except Exception as e:
         error_msg = f"LINE WORKS認証予期しないエラー: {str(e)}"
         print(error_msg)
         send_error_email(f"LINE WORKS認証エラー:\n{error_msg}")
-        return None
+        return None, None
+
+
+# このスクリプトは単体で配置・実行する（他のスクリプトを import しない）ため、レート制限もここに持つ
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限（スレッドセーフ）
+
+    最大 capacity 個まで貯まり、1分あたり rate_per_minute 個のペースで補充される。
+    """
+
+    def __init__(self, rate_per_minute, capacity=1):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.rate_per_sec = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得（不足している場合は補充されるまで待機）"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_sec)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate_per_sec
+            time.sleep(wait_seconds)
+
+
+def run_folder_transfer(filtered_files, transfer_file):
+    """
+    フォルダ内ファイルを先読みしながら転送
+
+    ダウンロードはワーカープールで TRANSFER_WORKERS 件先まで先読みし、送信・削除は
+    フォルダの並び（名前順）のまま1件ずつ行う（トークルームに届く順番を変えない）。
+    送信中に後続ファイルのダウンロードが進む。一時ファイルは先読み分だけ同時に持つ。
+
+    Args:
+        filtered_files (list): 送信対象のファイル情報リスト
+        transfer_file (callable): (ファイル情報, ダウンロード済みファイルハンドル or None) を受け取り結果dictを返す関数
+
+    Returns:
+        list: filtered_files と同じ順序の転送結果（{'sent': bool, 'deleted': bool}）
+    """
+    total = len(filtered_files)
+    ahead = max(1, TRANSFER_WORKERS)
+    results = []
+    downloads = {}
+
+    def prefetch(i):
+        if i < total:
+            downloads[i] = executor.submit(download_file_from_google_drive, filtered_files[i]['id'])
+
+    with ThreadPoolExecutor(max_workers=ahead, thread_name_prefix="download") as executor:
+        try:
+            for i in range(ahead):
+                prefetch(i)
+            for i, file_info in enumerate(filtered_files):
+                prefetch(i + ahead)
+                file_name = file_info['name']
+                try:
+                    file_obj, _ = downloads.pop(i).result()
+                except Exception as e:
+                    print(f"❌ {file_name} ダウンロード中にエラー: {str(e)}")
+                    file_obj = None
+                try:
+                    results.append(transfer_file(file_info, file_obj))
+                except Exception as e:
+                    print(f"❌ {file_name} 転送中にエラー: {str(e)}")
+                    results.append({'sent': False, 'deleted': False})
+                print(f"[{i + 1}/{total}] 処理完了: {file_name}")
+        finally:
+            # 中断時は先読み済みの一時ファイルを解放する
+            for future in downloads.values():
+                if future.cancel() or future.exception() is not None:
+                    continue
+                file_obj, _ = future.result()
+                if file_obj is not None:
+                    file_obj.close()
+
+    return results
+
+
+# LINE WORKS APIのリクエスト間隔を制御するトークンバケット（全スレッド共有）
+line_works_rate_limiter = TokenBucket(LINE_WORKS_API_RATE_PER_MINUTE, capacity=LINE_WORKS_API_BURST)
+
+
+class LineWorksTokenManager:
+    """
+    LINE WORKSアクセストークンの取得・キャッシュ・更新を管理するクラス
+
+    - トークンは expires_in の少し手前（refresh_margin秒前）までメモリ上で再利用
+    - 取得したトークンはローカルファイルにも保存し、次回以降の定期実行で再利用
+    - APIが401を返した場合は invalidate() で破棄し、次の get_token() で再発行
+    """
+
+    def __init__(self, cache_file=LINE_WORKS_TOKEN_CACHE_FILE, refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS):
+        self.cache_file = Path(cache_file)
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._file_loaded = False
+
+    def _is_fresh(self, expires_at):
+        return time.time() < expires_at - self.refresh_margin
+
+    def _load_from_file(self):
+        """保存済みトークンを読み込む（別の認証情報のもの・期限切れ間近のものは使わない）"""
+        if not self.cache_file.exists():
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except Exception as e:
+            print(f"⚠️ アクセストークンキャッシュ読み込みエラー: {e}")
+            return
+
+        if cache.get("client_id") != CLIENT_ID or cache.get("service_account") != service_account:
+            return
+        access_token = cache.get("access_token")
+        expires_at = float(cache.get("expires_at", 0))
+        if access_token and self._is_fresh(expires_at):
+            self._token = access_token
+            self._expires_at = expires_at
+            print(f"保存済みアクセストークンを再利用します（残り{int(expires_at - time.time())}秒）")
+
+    def _save_to_file(self):
+        """トークンを一時ファイル経由で保存（書き込み途中のファイルを読ませない）"""
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.cache_file.with_name(self.cache_file.name + ".tmp")
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "client_id": CLIENT_ID,
+                    "service_account": service_account,
+                    "access_token": self._token,
+                    "expires_at": self._expires_at,
+                }, f)
+            try:
+                os.chmod(tmp_file, 0o600)
+            except OSError:
+                pass
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            print(f"⚠️ アクセストークンキャッシュ保存エラー: {e}")
+
+    def get_token(self):
+        """
+        有効なアクセストークンを返す（必要な場合のみ認証サーバーへ問い合わせる）
+
+        Returns:
+            str: 成功時はアクセストークン、失敗時はNone
+        """
+        with self._lock:
+            if not self._file_loaded:
+                self._file_loaded = True
+                self._load_from_file()
+
+            if self._token and self._is_fresh(self._expires_at):
+                return self._token
+
+            access_token, expires_in = request_access_token()
+            if not access_token:
+                return None
+
+            self._token = access_token
+            self._expires_at = time.time() + expires_in
+            self._save_to_file()
+            return access_token
+
+    def invalidate(self, access_token=None):
+        """
+        トークンを破棄する（保存ファイルも削除）
+
+        Args:
+            access_token (str, optional): 401を受けたトークン。既に別のトークンへ
+                更新済みの場合は何もしない
+        """
+        with self._lock:
+            if access_token is not None and access_token != self._token:
+                return
+            self._token = None
+            self._expires_at = 0.0
+            try:
+                self.cache_file.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"⚠️ アクセストークンキャッシュ削除エラー: {e}")
+
+
+# プロセス内で共有するトークンマネージャー
+line_works_tokens = LineWorksTokenManager()
+
+
+def get_access_token():
+    """
+    LINE WORKS APIのアクセストークンを取得（有効なキャッシュがあれば再利用）
+
+    Returns:
+        str: 成功時はアクセストークン、失敗時はNone
+    """
+    return line_works_tokens.get_token()
+
+
+def lineworks_api_request(method, url, access_token, **kwargs):
+    """
+    LINE WORKS APIへ認証付きリクエストを送信
+
+    送信前にレート制限のトークンを取得し、401が返った場合はトークンを
+    破棄・再取得して1回だけ再送する。
+
+    Args:
+        method (str): HTTPメソッド
+        url (str): リクエストURL
+        access_token (str): 使用するアクセストークン
+        **kwargs: requests.request に渡す追加引数
+
+    Returns:
+        tuple: (response, access_token) 再送した場合は更新後のトークンを返す
+    """
+    headers = dict(kwargs.pop("headers", None) or {})
+    headers["Authorization"] = f"Bearer {access_token}"
+    line_works_rate_limiter.acquire()
+    resp = requests.request(method, url, headers=headers, **kwargs)
+    if resp.status_code != 401:
+        return resp, access_token
+
+    print("⚠️ 401 Unauthorized: アクセストークンを再取得して再送します")
+    line_works_tokens.invalidate(access_token)
+    new_token = line_works_tokens.get_token()
+    if not new_token:
+        return resp, access_token
+
+    headers["Authorization"] = f"Bearer {new_token}"
+    line_works_rate_limiter.acquire()
+    return requests.request(method, url, headers=headers, **kwargs), new_token
+
+
+_bot_info_lock = threading.Lock()
+_bot_info_cache = {}
+
+
+def get_bot_info(access_token):
+    """
+    Bot情報を取得（プロセス内で1回だけ問い合わせ、以降は結果を再利用）
+
+    Args:
+        access_token (str): LINE WORKS APIのアクセストークン
+
+    Returns:
+        dict: 成功時はBot情報、失敗時はNone
+    """
+    with _bot_info_lock:
+        if "bot_info" in _bot_info_cache:
+            return _bot_info_cache["bot_info"]
+
+        print("\nBot情報確認中...")
+        bot_info_url = f"{LINE_WORKS_API_BASE_URL}/bots/{BOT_ID}"
+        bot_info = None
+        try:
+            bot_resp, _ = lineworks_api_request(
+                "GET", bot_info_url, access_token,
+                headers={"Content-Type": "application/json"}
+            )
+            if bot_resp.status_code == 200:
+                bot_info = bot_resp.json()
+                print(f"✅ Bot情報取得成功:")
+                print(f"  Bot名: {bot_info.get('name', 'N/A')}")
+                print(f"  Bot状態: {bot_info.get('state', 'N/A')}")
+                print(f"  権限: {bot_info.get('scopes', 'N/A')}")
+            else:
+                print(f"❌ Bot情報取得失敗: {bot_resp.status_code}")
+                print(f"エラー: {bot_resp.text}")
+        except Exception as e:
+            print(f"❌ Bot情報確認エラー: {str(e)}")
+
+        # 失敗時も再問い合わせはしない（Bot情報は表示用のため）
+        _bot_info_cache["bot_info"] = bot_info
+        return bot_info
 
 
 def search_files_in_google_drive(query="", max_results=10):
@@ -974,6 +1471,45 @@ def test_google_drive_connection():
     return all_files, method_files, html_files
 
 
+def transfer_file_to_lineworks(file_info, file_obj):
+    """
+    フォルダ一括送信の1ファイル分の処理（送信 → 成功時に削除）
+
+    Args:
+        file_info (dict): Google Driveのファイル情報
+        file_obj: run_folder_transfer が先読みしたファイルハンドル（ダウンロード失敗時は None）
+
+    Returns:
+        dict: {'sent': bool, 'deleted': bool}
+    """
+    file_id = file_info['id']
+    file_name = file_info['name']
+
+    print(f"\n送信中: {file_name}")
+    if file_obj is None:
+        print(f"❌ {file_name} ダウンロード失敗 - ファイル送信をスキップ")
+        return {'sent': False, 'deleted': False}
+
+    # LINE WORKSに送信（送信後は一時ファイルをすぐに解放）
+    with file_obj:
+        sent = send_downloaded_file_to_lineworks(file_obj, file_name)
+    if not sent:
+        print(f"❌ {file_name} 送信失敗 - ファイル削除をスキップ")
+        return {'sent': False, 'deleted': False}
+
+    print(f"✅ {file_name} 送信完了")
+    deleted = False
+
+    # 送信成功時にファイル削除
+    if DELETE_AFTER_UPLOAD:
+        print(f"配信成功により削除実行: {file_name}")
+        deleted = delete_file_from_google_drive(file_id, file_name)
+        if not deleted:
+            print(f"⚠️ ファイル削除失敗（手動で削除してください）: {file_name}")
+
+    return {'sent': True, 'deleted': deleted}
+
+
 def send_folder_files_to_lineworks(folder_id, file_filter=None):
     """
     Google Driveフォルダ内のファイルをLINE WORKSに送信
@@ -1006,35 +1542,18 @@ def send_folder_files_to_lineworks(folder_id, file_filter=None):
         failed_files = []
         deleted_files = []
 
-        print(f"\n送信対象HTMLファイル: {len(filtered_files)}件")
+        print(f"\n送信対象HTMLファイル: {len(filtered_files)}件（ダウンロード先読み: {TRANSFER_WORKERS}件）")
         print("=" * 50)
 
-        for i, file_info in enumerate(filtered_files, 1):
-            file_id = file_info['id']
-            file_name = file_info['name']
-
-            print(f"\n[{i}/{len(filtered_files)}] 送信中: {file_name}")
-            result = send_file_to_lineworks(file_id)
+        results = run_folder_transfer(filtered_files, transfer_file_to_lineworks)
 
-            if result:
-                sent_files.append(file_name)
-                print(f"✅ {file_name} 送信完了")
-                
-                # 送信成功時にファイル削除
-                if DELETE_AFTER_UPLOAD:
-                    print(f"配信成功により削除実行: {file_name}")
-                    if delete_file_from_google_drive(file_id, file_name):
-                        deleted_files.append(file_name)
-                    else:
-                        print(f"⚠️ ファイル削除失敗（手動で削除してください）: {file_name}")
+        for file_info, result in zip(filtered_files, results):
+            if result['sent']:
+                sent_files.append(file_info['name'])
             else:
-                failed_files.append(file_name)
-                print(f"❌ {file_name} 送信失敗 - ファイル削除をスキップ")
-
-            # 送信間隔を空ける（API制限対策）
-            if i < len(filtered_files):
-                print("次のファイル送信まで2秒待機...")
-                time.sleep(2)
+                failed_files.append(file_info['name'])
+            if result['deleted']:
+                deleted_files.append(file_info['name'])
 
         print(f"\n=== 送信結果 ===")
         print(f"成功: {len(sent_files)}件")
@@ -1072,87 +1591,48 @@ def send_folder_files_to_lineworks(folder_id, file_filter=None):
         return {'success': False, 'sent_files': [], 'failed_files': [], 'deleted_files': [], 'total_files': 0}
 
 
-def send_file_to_lineworks(file_id=None):
+def send_downloaded_file_to_lineworks(file_obj, file_name):
     """
-    Google DriveからファイルをダウンロードしてLINE WORKSに送信
+    ダウンロード済みのファイルをLINE WORKSに送信
 
     Args:
-        file_id (str, optional): Google DriveファイルID。指定されない場合はデフォルト値を使用
+        file_obj: アップロードするファイルのハンドル（download_file_from_google_drive の戻り値）
+        file_name (str): ファイル名
 
     処理の流れ：
-    1. Google Driveからファイルをダウンロード
-    2. JWT生成（Service Accountを使用）
-    3. アクセストークン取得
-    4. ファイルアップロード
-    5. ファイルメッセージ送信
+    1. アクセストークン取得（有効なキャッシュがあれば再利用）
+    2. Bot情報確認（プロセス内で初回のみ）
+    3. ファイルアップロード
+    4. ファイルメッセージ送信
 
     Returns:
         bool: 成功時はTrue、失敗時はFalse
     """
-
-    # ファイルIDの決定
-    actual_file_id = file_id if file_id else target_google_drive_file_id
-
     try:
-        # 1. Google Driveからファイルを取得
-        print("=== Google Driveからファイル取得 ===")
-        print(f"ファイル名: method_fix.html")
-        print(f"ファイルID: {actual_file_id}")
-
-        file_data, file_name = download_file_from_google_drive(actual_file_id)
-        if not file_data:
-            print("Google Driveからのファイル取得に失敗しました")
-            return False
-
-        # 2. LINE WORKSアクセストークン取得
+        # 1. LINE WORKSアクセストークン取得
         print("\n=== LINE WORKS認証 ===")
         access_token = get_access_token()
         if not access_token:
             print("アクセストークン取得に失敗しました")
             return False
 
-        # Bot情報を確認
-        print("\nBot情報確認中...")
-        bot_info_url = f"https://www.worksapis.com/v1.0/bots/{BOT_ID}"
-        bot_headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-
-        try:
-            bot_resp = requests.get(bot_info_url, headers=bot_headers)
-            if bot_resp.status_code == 200:
-                bot_info = bot_resp.json()
-                print(f"✅ Bot情報取得成功:")
-                print(f"  Bot名: {bot_info.get('name', 'N/A')}")
-                print(f"  Bot状態: {bot_info.get('state', 'N/A')}")
-                print(f"  権限: {bot_info.get('scopes', 'N/A')}")
-            else:
-                print(f"❌ Bot情報取得失敗: {bot_resp.status_code}")
-                print(f"エラー: {bot_resp.text}")
-        except Exception as e:
-            print(f"❌ Bot情報確認エラー: {str(e)}")
+        # Bot情報を確認（プロセス内で初回のみ問い合わせ）
+        get_bot_info(access_token)
 
-        # 3. ファイルをアップロード
+        # 2. ファイルをアップロード
         print("\n=== ファイルアップロード ===")
-        file_id = upload_file_to_lineworks(access_token, file_data, file_name)
+        file_id = upload_file_to_lineworks(access_token, file_obj, file_name)
         if not file_id:
             print("ファイルアップロードに失敗しました")
             return False
 
-        # 4. ファイルメッセージを送信
+        # 3. ファイルメッセージを送信
         print("\n=== ファイルメッセージ送信 ===")
         room_id = "6d53f79a-ba39-e9d5-cf52-07ddd58d66cf"  # 全社トークルームのID
         success = send_file_message(access_token, room_id, file_id, file_name)
 
         if success:
             print("\n✅ 全ての処理が正常に完了しました")
-            
-            # 送信成功時にファイル削除（単一ファイルモード）
-            if DELETE_AFTER_UPLOAD and not USE_FOLDER_MODE:
-                print(f"\n=== ファイル削除処理 ===")
-                print(f"配信成功により削除実行: {file_name}")
-                delete_file_from_google_drive(actual_file_id, file_name)
         else:
             print("\n❌ ファイルメッセージ送信に失敗しました")
 
@@ -1165,6 +1645,59 @@ def send_file_to_lineworks(file_id=None):
         return False
 
 
+def send_file_to_lineworks(file_id=None):
+    """
+    Google DriveからファイルをダウンロードしてLINE WORKSに送信
+
+    Args:
+        file_id (str, optional): Google DriveファイルID。指定されない場合はデフォルト値を使用
+
+    処理の流れ：
+    1. Google Driveからファイルをダウンロード
+    2. LINE WORKSへ送信（send_downloaded_file_to_lineworks）
+    3. 単一ファイルモードでは送信成功時に削除
+
+    Returns:
+        bool: 成功時はTrue、失敗時はFalse
+    """
+
+    # ファイルIDの決定
+    actual_file_id = file_id if file_id else target_google_drive_file_id
+    file_obj = None
+
+    try:
+        # 1. Google Driveからファイルを取得
+        print("=== Google Driveからファイル取得 ===")
+        print(f"ファイル名: method_fix.html")
+        print(f"ファイルID: {actual_file_id}")
+
+        file_obj, file_name = download_file_from_google_drive(actual_file_id)
+        if file_obj is None:
+            print("Google Driveからのファイル取得に失敗しました")
+            return False
+
+        # 2. LINE WORKSへ送信
+        success = send_downloaded_file_to_lineworks(file_obj, file_name)
+
+        # 送信成功時にファイル削除（単一ファイルモード）
+        if success and DELETE_AFTER_UPLOAD and not USE_FOLDER_MODE:
+            print(f"\n=== ファイル削除処理 ===")
+            print(f"配信成功により削除実行: {file_name}")
+            delete_file_from_google_drive(actual_file_id, file_name)
+
+        return success
+
+    except Exception as e:
+        error_msg = f"予期しないエラーが発生しました: {str(e)}"
+        print(error_msg)
+        send_error_email(f"LINE WORKSファイル送信エラー:\n{error_msg}")
+        return False
+    finally:
+        # 一時ファイルを解放（ディスクへ書き出されていた場合は削除される）
+        if file_obj is not None:
+            file_obj.close()
+
+
 # --- メイン処理 ---
 try:
     if __name__ == "__main__":